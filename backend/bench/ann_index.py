@@ -0,0 +1,108 @@
+# Recall@k, query latency, build time and bytes on disk of every mapped index
+# type ("flat", "hnsw", "ivfpq") on synthetic clustered vectors of increasing
+# size. Recall is measured against the exact flat search of the same rows.
+#
+#   python bench/ann_index.py --rows 20000 100000 --k 4 --queries 200
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "src", "common"))
+
+DIMENSIONS = 1536
+BLOCK_ROWS = 8192
+
+
+def corpus(rows, dimensions, clusters, seed=0):
+    # Unit-length vectors around a few hundred topics, roughly how chunk
+    # embeddings of a set of guides spread out. Yielded in blocks.
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    for start in range(0, rows, BLOCK_ROWS):
+        count = min(BLOCK_ROWS, rows - start)
+        block = centers[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dimensions)).astype(np.float32)
+        yield block / np.linalg.norm(block, axis=1, keepdims=True)
+
+
+def build(directory, rows, index_type, clusters):
+    from ragbot_common import vector_index
+
+    writer = vector_index.MappedIndexWriter(directory, index_type=index_type)
+    for block in corpus(rows, DIMENSIONS, clusters):
+        start = writer.count
+        writer.add([f"chunk {start + i}" for i in range(len(block))], block, [{"page": (start + i) // 4} for i in range(len(block))])
+    started = time.perf_counter()
+    writer.close()
+    return time.perf_counter() - started
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def queries(directory, count, seed=1):
+    # Perturbed copies of random rows, so every query has close neighbours
+    import numpy as np
+    from ragbot_common import vector_index
+
+    index = vector_index.MappedIndex(directory)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(index.count, count, replace=False)
+    vectors = np.stack([index.vector(int(row)) for row in rows]).astype(np.float32)
+    return vectors + 0.05 * rng.standard_normal(vectors.shape).astype(np.float32)
+
+
+def run(directory, query_vectors, k):
+    from ragbot_common import vector_index
+
+    index = vector_index.MappedIndex(directory)
+    results, latencies = [], []
+    for query in query_vectors:
+        started = time.perf_counter()
+        results.append([row for _, row in index.search(query, k)])
+        latencies.append(time.perf_counter() - started)
+    return results, sorted(latencies)
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[20000])
+    parser.add_argument("--types", nargs="+", choices=["flat", "hnsw", "ivfpq"], default=["flat", "hnsw", "ivfpq"])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--clusters", type=int, default=256)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = None
+            for index_type in ["flat"] + [t for t in args.types if t != "flat"]:
+                directory = os.path.join(tmp, index_type)
+                build_s = build(directory, rows, index_type, args.clusters)
+                if baseline is None:
+                    query_vectors = queries(directory, args.queries)
+                results, latencies = run(directory, query_vectors, args.k)
+                if baseline is None:
+                    baseline = results
+                recall = sum(len(set(found) & set(exact)) for found, exact in zip(results, baseline)) / (args.k * len(baseline))
+                if index_type not in args.types:
+                    continue
+                print(
+                    f"rows {rows:7}  {index_type:6} recall@{args.k} {recall:6.3f}  "
+                    f"p50 {percentile(latencies, 50) * 1000:7.2f} ms  p95 {percentile(latencies, 95) * 1000:7.2f} ms  "
+                    f"ann build {build_s:7.1f} s  on disk {directory_bytes(directory) / 1e6:7.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Measures cold-start cost of the langchain-based handlers.
+#
+# Every sample runs in a fresh interpreter so module caches are empty, and
+# reports the time to import the handler module and, when an event is given,
+# the time of the first invocation. Compare STARTUP_MODE=lazy against eager:
+#
+#   python bench/cold_start.py --handler generate_response --mode lazy eager
+#
+# --event takes a JSON event file; the buckets and tables it refers to must
+# exist in the account and region the environment points at.
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(BACKEND_DIR, "src")
+STACK_FILE = os.path.join(BACKEND_DIR, "lib", "ragbot-stack.ts")
+
+HANDLERS = ["generate_response", "generate_embeddings"]
+
+DEFAULT_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "BUCKET_NAME": "ragbot-bench",
+    "DOCUMENT_TABLE": "ragbot-bench-document",
+    "SESSION_TABLE": "ragbot-bench-session",
+    "MESSAGE_TABLE": "ragbot-bench-message",
+    "TABLE_NAME": "ragbot-bench-connections",
+    "EMBEDDING_CACHE_TABLE": "ragbot-bench-embedding-cache",
+    "POWERTOOLS_SERVICE_NAME": "ragbot-bench",
+    "POWERTOOLS_LOG_LEVEL": "WARNING",
+}
+
+CHILD = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+result = {{"import_s": imported - start}}
+event_path = {event!r}
+if event_path:
+    class Context:
+        function_name = "bench"
+        memory_limit_in_mb = {memory}
+        invoked_function_arn = "arn:aws:lambda:us-east-1:000000000000:function:bench"
+        aws_request_id = "bench"
+        def get_remaining_time_in_millis(self):
+            return 300000
+    with open(event_path) as f:
+        event = json.load(f)
+    index.handler(event, Context())
+    result["first_invoke_s"] = time.perf_counter() - imported
+print(json.dumps(result))
+"""
+
+
+def configured_memory(handler):
+    # memorySize of the PythonFunction whose entry is src/<handler>
+    with open(STACK_FILE) as f:
+        stack = f.read()
+    match = re.search(r"memorySize: (\d+),[^}]*entry: 'src/%s'|entry: 'src/%s'[^}]*memorySize: (\d+)," % (handler, handler), stack)
+    if not match:
+        return None
+    return int(match.group(1) or match.group(2))
+
+
+def sample(handler, mode, event, memory):
+    paths = [os.path.join(SRC_DIR, handler), os.path.join(SRC_DIR, "common")]
+    env = {**DEFAULT_ENV, **os.environ, "STARTUP_MODE": mode}
+    code = CHILD.format(paths=paths, event=event, memory=memory or 128)
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    return f"median {statistics.median(values) * 1000:8.1f} ms  min {min(values) * 1000:8.1f} ms  max {max(values) * 1000:8.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--handler", nargs="+", choices=HANDLERS, default=HANDLERS)
+    parser.add_argument("--mode", nargs="+", choices=["lazy", "eager"], default=["lazy", "eager"])
+    parser.add_argument("--event", help="JSON event passed to the first invocation")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for handler in args.handler:
+        memory = configured_memory(handler)
+        print(f"{handler} (configured memorySize: {memory} MB)")
+        for mode in args.mode:
+            samples = [sample(handler, mode, args.event, memory) for _ in range(args.repeat)]
+            print(f"  {mode:5} import       {summarize([s['import_s'] for s in samples])}")
+            if args.event:
+                print(f"  {mode:5} first invoke {summarize([s['first_invoke_s'] for s in samples])}")
+
+
+if __name__ == "__main__":
+    main()
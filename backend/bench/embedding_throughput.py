@@ -0,0 +1,56 @@
+# Embedding throughput of the ingestion engine against the local fake Bedrock
+# endpoint, for a range of concurrency limits. Concurrency 1 is the serial
+# baseline of the previous VectorstoreIndexCreator path.
+#
+#   python bench/embedding_throughput.py --chunks 400 --latency-ms 120 --capacity 6
+
+import argparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), "src", "common"))
+
+import boto3
+from botocore.config import Config
+from fake_bedrock import FakeBedrock, serve
+from ragbot_common.embedding_engine import EmbeddingEngine, EmbeddingStats
+
+WORDS = "account member invoice payment renewal form field code error report batch export import committee event registration".split()
+
+
+def synthetic_chunks(count, words=150):
+    return [" ".join(WORDS[(i * 7 + j * 3) % len(WORDS)] for j in range(words)) + f" chunk {i}" for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--capacity", type=int, default=6)
+    parser.add_argument("--rps", type=float)
+    args = parser.parse_args()
+
+    texts = synthetic_chunks(args.chunks)
+    for concurrency in args.concurrency:
+        bedrock = FakeBedrock(args.latency_ms, capacity=args.capacity, rps=args.rps)
+        server, endpoint_url = serve(bedrock)
+        client = boto3.client(
+            "bedrock-runtime",
+            region_name="us-east-1",
+            endpoint_url=endpoint_url,
+            aws_access_key_id="bench",
+            aws_secret_access_key="bench",
+            config=Config(max_pool_connections=50, retries={"mode": "standard", "max_attempts": 1}),
+        )
+        engine = EmbeddingEngine(client, "amazon.titan-embed-text-v1", max_concurrency=concurrency)
+        stats = EmbeddingStats()
+        vectors = engine.embed(texts, stats)
+        assert len(vectors) == len(texts)
+        print(f"concurrency {concurrency:3}: {stats.as_dict()}")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
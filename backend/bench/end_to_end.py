@@ -0,0 +1,327 @@
+# End-to-end benchmark of the real handlers without a deployed stack.
+#
+# S3, DynamoDB, SQS and the API Gateway management API are moto's in-process
+# stand-ins (the tables mirror lib/ragbot-stack.ts), and Bedrock is the local
+# fake endpoint of fake_bedrock.py, with configurable embedding and completion
+# latency. Two scenarios:
+#
+#   ingest     upload_trigger + generate_embeddings for PDFs of increasing
+#              page counts: time per handler and peak traced memory
+#   questions  add_conversation, get_all_documents and generate_response for
+#              a user with N documents and M open connections: latency
+#              percentiles per handler
+#
+#   pip install moto
+#   python bench/end_to_end.py ingest --pages 10 100 400
+#   python bench/end_to_end.py questions --documents 1 10 --connections 1 10 --questions 40 --llm-latency-ms 800
+#   python bench/end_to_end.py questions --scope library --documents 10 50
+#
+# Handler settings come from the environment like in Lambda, e.g.
+# INDEX_TYPE=hnsw or CONDENSE_STRATEGY=llm. RELEVANCE_THRESHOLD defaults to 0
+# here so every question reaches the LLM; set it to measure early exits.
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, os.path.join(SRC_DIR, "common"))
+
+from fake_bedrock import FakeBedrock, serve
+
+BUCKET_NAME = "ragbot-bench"
+USER_ID = "bench-user"
+DOMAIN_NAME = "bench.execute-api.us-east-1.amazonaws.com"
+
+DEFAULT_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "BUCKET_NAME": BUCKET_NAME,
+    "DOCUMENT_TABLE": "ragbot-bench-document",
+    "CONVERSATION_TABLE": "ragbot-bench-conversation",
+    "SESSION_TABLE": "ragbot-bench-session",
+    "MESSAGE_TABLE": "ragbot-bench-message",
+    "TABLE_NAME": "ragbot-bench-connections",
+    "EMBEDDING_CACHE_TABLE": "ragbot-bench-embedding-cache",
+    "ANSWER_CACHE_TABLE": "ragbot-bench-answer-cache",
+    "RELEVANCE_THRESHOLD": "0",
+    "POWERTOOLS_SERVICE_NAME": "ragbot-bench",
+    "POWERTOOLS_LOG_LEVEL": "WARNING",
+}
+
+# environment variable -> (partition key, sort key, {global index: (partition key, sort key)}, {local index: sort key})
+TABLES = {
+    "DOCUMENT_TABLE": ("userId", "documentId", {"userId-created-index": ("userId", "created")}, {}),
+    "CONVERSATION_TABLE": ("documentId", "conversationId", {}, {"documentId-created-index": "created"}),
+    "SESSION_TABLE": ("SessionId", None, {}, {}),
+    "MESSAGE_TABLE": ("SessionId", "messageId", {}, {}),
+    "TABLE_NAME": ("connectionId", None, {"userId-index": ("userId", None)}, {}),
+    "EMBEDDING_CACHE_TABLE": ("hash", None, {}, {}),
+    "ANSWER_CACHE_TABLE": ("indexVersion", "questionId", {}, {}),
+}
+
+WORDS = (
+    "account member invoice payment renewal form field code error report batch export import committee event "
+    "registration volunteer chapter budget ledger receipt donor campaign mailing profile permission role audit "
+    "schedule venue ticket discount refund tax certificate course credit exam policy board minutes agenda"
+).split()
+
+
+class Context:
+    function_name = "bench"
+    memory_limit_in_mb = 2048
+    invoked_function_arn = "arn:aws:lambda:us-east-1:000000000000:function:bench"
+    aws_request_id = "bench"
+
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+
+def pdf_bytes(pages, lines=40, words=12, seed=0):
+    # A minimal PDF with one Helvetica text stream per page, enough for pypdf
+    rng = random.Random(seed)
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        text = [" ".join(rng.choice(WORDS) for _ in range(words)) + f" page {page + 1} line {line + 1}" for line in range(lines)]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({line}) Tj T*" for line in text) + " ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1"))
+    out.write("".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1"))
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1"))
+    return out.getvalue()
+
+
+def create_resources():
+    import boto3
+
+    def key_schema(partition_key, sort_key):
+        return [{"AttributeName": partition_key, "KeyType": "HASH"}] + ([{"AttributeName": sort_key, "KeyType": "RANGE"}] if sort_key else [])
+
+    # Indexes project all attributes here, the narrower projections of the stack only save read capacity
+    ddb = boto3.client("dynamodb")
+    for env_name, (partition_key, sort_key, global_indexes, local_indexes) in TABLES.items():
+        attributes = {partition_key, sort_key, *(name for keys in global_indexes.values() for name in keys), *local_indexes.values()} - {None}
+        kwargs = {}
+        if global_indexes:
+            kwargs["GlobalSecondaryIndexes"] = [
+                {"IndexName": name, "KeySchema": key_schema(*keys), "Projection": {"ProjectionType": "ALL"}}
+                for name, keys in global_indexes.items()
+            ]
+        if local_indexes:
+            kwargs["LocalSecondaryIndexes"] = [
+                {"IndexName": name, "KeySchema": key_schema(partition_key, key), "Projection": {"ProjectionType": "ALL"}}
+                for name, key in local_indexes.items()
+            ]
+        ddb.create_table(
+            TableName=os.environ[env_name],
+            KeySchema=key_schema(partition_key, sort_key),
+            AttributeDefinitions=[{"AttributeName": name, "AttributeType": "S"} for name in sorted(attributes)],
+            BillingMode="PAY_PER_REQUEST",
+            **kwargs,
+        )
+    boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+    os.environ["QUEUE_URL"] = boto3.client("sqs").create_queue(QueueName="ragbot-bench-embedding")["QueueUrl"]
+
+
+def load_handler(name):
+    # Every handler is a module named "index" next to its own helpers
+    directory = os.path.join(SRC_DIR, name)
+    sys.path.insert(0, directory)
+    try:
+        spec = importlib.util.spec_from_file_location(f"{name}_index", os.path.join(directory, "index.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(directory)
+    return module
+
+
+def invoke(handler, event):
+    # Returns (response, seconds); EMF metrics printed by the handlers are discarded
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        response = handler.handler(event, Context())
+        return response, time.perf_counter() - started
+
+
+class Bench:
+    def __init__(self):
+        import boto3
+
+        self.s3 = boto3.client("s3")
+        self.sqs = boto3.client("sqs")
+        ddb = boto3.resource("dynamodb")
+        self.document_table = ddb.Table(os.environ["DOCUMENT_TABLE"])
+        self.connection_table = ddb.Table(os.environ["TABLE_NAME"])
+        self.upload_trigger = load_handler("upload_trigger")
+        self.generate_embeddings = load_handler("generate_embeddings")
+        self.generate_response = load_handler("generate_response")
+        self.get_all_documents = load_handler("get_all_documents")
+        self.add_conversation = load_handler("add_conversation")
+
+    def ingest(self, file_name, data):
+        # Returns (upload_trigger seconds, generate_embeddings seconds, chunks)
+        key = f"{USER_ID}/{file_name}/{file_name}"
+        self.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data)
+        _, upload_s = invoke(self.upload_trigger, {"Records": [{"s3": {"object": {"key": key, "size": len(data)}}}]})
+
+        embed_s = 0.0
+        while True:
+            messages = self.sqs.receive_message(QueueUrl=os.environ["QUEUE_URL"], MaxNumberOfMessages=10).get("Messages", [])
+            if not messages:
+                break
+            # Whole batches, as the event source delivers them; failed records are left on the queue
+            records = [{"messageId": message["MessageId"], "body": message["Body"], "attributes": {"ApproximateReceiveCount": "1"}} for message in messages]
+            result, seconds = invoke(self.generate_embeddings, {"Records": records})
+            embed_s += seconds
+            failed = {failure["itemIdentifier"] for failure in result["batchItemFailures"]}
+            if failed:
+                raise RuntimeError(f"generate_embeddings failed {len(failed)} of {len(messages)} records")
+            for message in messages:
+                self.sqs.delete_message(QueueUrl=os.environ["QUEUE_URL"], ReceiptHandle=message["ReceiptHandle"])
+
+        meta = json.loads(self.s3.get_object(Bucket=BUCKET_NAME, Key=f"{USER_ID}/{file_name}/index.meta.json")["Body"].read())
+        return upload_s, embed_s, meta["count"]
+
+    def documents(self):
+        response, _ = invoke(self.get_all_documents, {"requestContext": {"authorizer": {"claims": {"sub": USER_ID}}}, "queryStringParameters": {"view": "summary", "limit": "100"}})
+        return json.loads(response["body"])["documents"]
+
+    def set_connections(self, count):
+        # Connections that stay are overwritten, not deleted in the same batch
+        wanted = {f"bench-{i}" for i in range(count)}
+        existing = self.connection_table.scan(ProjectionExpression="connectionId")["Items"]
+        with self.connection_table.batch_writer() as batch:
+            for item in existing:
+                if item["connectionId"] not in wanted:
+                    batch.delete_item(Key=item)
+            for i in range(count):
+                batch.put_item(Item={"connectionId": f"bench-{i}", "userId": USER_ID})
+
+    def ask(self, file_name, conversation_id, prompt, scope="document"):
+        body = {"fileName": file_name, "scope": scope, "prompt": prompt, "conversationId": conversation_id, "userId": USER_ID, "stream": False}
+        event = {
+            "body": json.dumps(body),
+            "requestContext": {"domainName": DOMAIN_NAME, "stage": "bench", "connectionId": "bench-0"},
+        }
+        return invoke(self.generate_response, event)
+
+
+def percentiles(seconds):
+    ordered = sorted(seconds)
+    at = lambda p: ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return f"p50 {at(50):8.1f} ms  p95 {at(95):8.1f} ms  p99 {at(99):8.1f} ms  max {ordered[-1] * 1000:8.1f} ms"
+
+
+def run_ingest(bench, args):
+    # Every size is ingested twice with different text: once timed, once under
+    # tracemalloc (which slows allocation-heavy code down) for the peak memory
+    for pages in args.pages:
+        data = pdf_bytes(pages, seed=pages)
+        upload_s, embed_s, chunks = bench.ingest(f"timed-{pages}.pdf", data)
+
+        tracemalloc.start()
+        bench.ingest(f"traced-{pages}.pdf", pdf_bytes(pages, seed=pages + 1))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        print(
+            f"pages {pages:5}  pdf {len(data) / 1e6:7.2f} MB  chunks {chunks:6}  "
+            f"upload_trigger {upload_s:7.2f} s  generate_embeddings {embed_s:7.2f} s  peak {peak / 1e6:7.1f} MB"
+        )
+
+
+def run_questions(bench, args):
+    rng = random.Random(0)
+    ingested = 0
+    for documents in args.documents:
+        while ingested < documents:
+            bench.ingest(f"guide-{ingested}.pdf", pdf_bytes(args.document_pages, seed=1000 + ingested))
+            ingested += 1
+        items = [item for item in bench.documents() if item["filename"] in {f"guide-{i}.pdf" for i in range(documents)}]
+
+        for connections in args.connections:
+            bench.set_connections(connections)
+            latencies = {"add_conversation": [], "get_all_documents": [], "generate_response": []}
+            calls_before = args.fake_bedrock.calls
+            asked = 0
+            while asked < args.questions:
+                # The sidebar is listed and a conversation started, then a few follow-ups asked
+                item = rng.choice(items)
+                claims = {"requestContext": {"authorizer": {"claims": {"sub": USER_ID}}}}
+                _, seconds = invoke(bench.get_all_documents, {**claims, "queryStringParameters": {"view": "summary"}})
+                latencies["get_all_documents"].append(seconds)
+                response, seconds = invoke(bench.add_conversation, {**claims, "pathParameters": {"documentId": item["documentId"]}})
+                latencies["add_conversation"].append(seconds)
+                conversation_id = json.loads(response["body"])["conversationId"]
+
+                for _ in range(min(1 + args.follow_ups, args.questions - asked)):
+                    prompt = "what does the guide say about " + " ".join(rng.sample(WORDS, 3)) + "?"
+                    _, seconds = bench.ask(item["filename"], conversation_id, prompt, args.scope)
+                    latencies["generate_response"].append(seconds)
+                    asked += 1
+
+            print(f"documents {documents:4}  connections {connections:4}  bedrock calls {args.fake_bedrock.calls - calls_before}")
+            for name, seconds in latencies.items():
+                print(f"  {name:20} n {len(seconds):4}  {percentiles(seconds)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenario", choices=["ingest", "questions"])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--documents", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--document-pages", type=int, default=20)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--follow-ups", type=int, default=2)
+    parser.add_argument("--scope", choices=["document", "library"], default="document")
+    parser.add_argument("--latency-ms", type=float, default=50, help="embedding latency")
+    parser.add_argument("--llm-latency-ms", type=float, default=500)
+    parser.add_argument("--jitter-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    for name, value in DEFAULT_ENV.items():
+        os.environ.setdefault(name, value)
+    args.fake_bedrock = FakeBedrock(args.latency_ms, args.jitter_ms, llm_latency_ms=args.llm_latency_ms)
+    server, os.environ["BEDROCK_ENDPOINT_URL"] = serve(args.fake_bedrock)
+    warnings.filterwarnings("ignore")
+
+    from moto import mock_aws
+
+    with tempfile.TemporaryDirectory() as tmp, mock_aws():
+        os.environ.setdefault("INDEX_CACHE_DIR", os.path.join(tmp, "indexes"))
+        create_resources()
+        bench = Bench()
+        if args.scenario == "ingest":
+            run_ingest(bench, args)
+        else:
+            run_questions(bench, args)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# Local stand-in for the bedrock-runtime InvokeModel API.
+#
+# Titan embedding requests return deterministic bag-of-words hashing vectors,
+# so texts sharing words get similar embeddings. Anthropic completion requests
+# return the follow-up question for condense prompts and otherwise an answer
+# stitched from the words of the prompt's context. Every call waits a
+# configurable latency (a separate one for completions), and requests are throttled (HTTP 429
+# ThrottlingException) beyond a concurrency capacity or a requests-per-second
+# rate, like a Bedrock account quota. Point a client at it with
+# BEDROCK_ENDPOINT_URL=http://127.0.0.1:<port>.
+#
+#   python bench/fake_bedrock.py --port 8787 --latency-ms 120 --llm-latency-ms 1500 --capacity 6 --rps 40
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 1536
+
+
+def fake_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def fake_completion(prompt, words=60):
+    # LangChain's condense prompt ends with the follow-up question
+    match = re.search(r"Follow Up Input: (.*)\nStandalone question:", prompt, re.S)
+    if match:
+        return " " + match.group(1).strip()
+    context = re.findall(r"\w+", prompt.split("Question:")[0])
+    start = int.from_bytes(hashlib.md5(prompt.encode("utf-8")).digest()[:4], "little") % max(1, len(context))
+    return " " + " ".join((context[start:] + context[:start])[:words]) + "."
+
+
+class FakeBedrock:
+    def __init__(self, latency_ms=100, jitter_ms=20, capacity=None, rps=None, llm_latency_ms=None):
+        self.latency_ms = latency_ms
+        self.llm_latency_ms = latency_ms if llm_latency_ms is None else llm_latency_ms
+        self.jitter_ms = jitter_ms
+        self.capacity = capacity
+        self.rps = rps
+        self.tokens = float(rps or 0)
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        with self.lock:
+            self.calls += 1
+            if self.rps:
+                now = time.monotonic()
+                self.tokens = min(self.rps, self.tokens + (now - self.refilled) * self.rps)
+                self.refilled = now
+            if (self.capacity and self.in_flight >= self.capacity) or (self.rps and self.tokens < 1):
+                self.throttled += 1
+                return False
+            if self.rps:
+                self.tokens -= 1
+            self.in_flight += 1
+            return True
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def delay(self, model_id):
+        latency_ms = self.llm_latency_ms if model_id.startswith("anthropic.") else self.latency_ms
+        time.sleep(max(0.0, random.gauss(latency_ms, self.jitter_ms)) / 1000)
+
+    def invoke(self, model_id, body):
+        if model_id.startswith("amazon.titan-embed"):
+            return {"embedding": fake_embedding(body["inputText"]), "inputTextTokenCount": len(body["inputText"].split())}
+        if model_id.startswith("anthropic."):
+            return {"completion": fake_completion(body["prompt"]), "stop_reason": "stop_sequence"}
+        raise ValueError(f"Unsupported model {model_id}")
+
+
+def make_handler(bedrock):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status, payload, headers=None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            match = re.match(r"^/model/([^/]+)/invoke$", self.path)
+            if not match:
+                return self.reply(404, {"message": f"Unknown path {self.path}"})
+
+            if not bedrock.admit():
+                return self.reply(429, {"message": "Too many requests"}, {"x-amzn-ErrorType": "ThrottlingException"})
+            try:
+                model_id = match.group(1).replace("%3A", ":")
+                bedrock.delay(model_id)
+                return self.reply(200, bedrock.invoke(model_id, body))
+            except ValueError as e:
+                return self.reply(400, {"message": str(e)}, {"x-amzn-ErrorType": "ValidationException"})
+            finally:
+                bedrock.done()
+
+    return Handler
+
+
+def serve(bedrock, port=0):
+    # Starts the server on a background thread and returns (server, endpoint_url)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(bedrock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=100)
+    parser.add_argument("--llm-latency-ms", type=float, help="latency of completions, defaults to --latency-ms")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--capacity", type=int, help="concurrent requests before throttling")
+    parser.add_argument("--rps", type=float, help="requests per second before throttling")
+    args = parser.parse_args()
+
+    bedrock = FakeBedrock(args.latency_ms, args.jitter_ms, args.capacity, args.rps, args.llm_latency_ms)
+    server, endpoint_url = serve(bedrock, args.port)
+    print(f"Fake Bedrock listening on {endpoint_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Load time and first-query time of a document index in the legacy FAISS
+# format (FAISS.load_local, unpickling index.pkl) against the memory-mapped
+# format, on synthetic indexes of increasing size. Every measurement runs in
+# a fresh interpreter so the page cache is the only thing shared.
+#
+#   python bench/index_load.py --rows 1000 10000 50000 --dtype float32 float16
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMON_DIR = os.path.join(BACKEND_DIR, "src", "common")
+sys.path.insert(0, COMMON_DIR)
+
+DIMENSIONS = 1536
+
+CHILD = """
+import json, sys, time
+sys.path.insert(0, {common!r})
+import numpy as np
+from langchain_community.embeddings import FakeEmbeddings
+from ragbot_common import vector_index
+start = time.perf_counter()
+store = vector_index.load({directory!r}, FakeEmbeddings(size={dimensions}))
+loaded = time.perf_counter()
+query = np.random.default_rng(1).standard_normal({dimensions}).astype(np.float32)
+store.similarity_search_with_score_by_vector(query.tolist(), k=4)
+queried = time.perf_counter()
+hwm_kb = int(next(line for line in open("/proc/self/status") if line.startswith("VmHWM")).split()[1])
+print(json.dumps({{"load_s": loaded - start, "query_s": queried - loaded, "max_rss_mb": hwm_kb / 1024}}))
+"""
+
+
+def build_faiss(directory, rows):
+    import numpy as np
+    from langchain_community.embeddings import FakeEmbeddings
+    from langchain_community.vectorstores import FAISS
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rows, DIMENSIONS)).astype(np.float32)
+    texts = [f"chunk {i} " + "lorem ipsum dolor sit amet " * 35 for i in range(rows)]
+    store = FAISS.from_embeddings(list(zip(texts, vectors.tolist())), FakeEmbeddings(size=DIMENSIONS), metadatas=[{"page": i // 4} for i in range(rows)])
+    store.save_local(directory)
+
+
+def directory_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def measure(directory):
+    code = CHILD.format(common=COMMON_DIR, directory=directory, dimensions=DIMENSIONS)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    from ragbot_common import vector_index
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--dtype", nargs="+", choices=["float32", "float16"], default=["float32", "float16"])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            faiss_dir = os.path.join(tmp, "faiss")
+            build_faiss(faiss_dir, rows)
+            variants = [("faiss", faiss_dir)]
+            for dtype in args.dtype:
+                mapped_dir = os.path.join(tmp, dtype)
+                vector_index.convert_faiss(faiss_dir, mapped_dir, dtype)
+                variants.append((f"mapped/{dtype}", mapped_dir))
+
+            for name, directory in variants:
+                result = measure(directory)
+                print(
+                    f"rows {rows:7}  {name:16} load {result['load_s'] * 1000:8.1f} ms  "
+                    f"first query {result['query_s'] * 1000:8.1f} ms  "
+                    f"max rss {result['max_rss_mb']:7.1f} MB  on disk {directory_bytes(directory) / 1e6:7.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
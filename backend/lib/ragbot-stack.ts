@@ -2,7 +2,7 @@ import { Stack, RemovalPolicy, Duration, CfnOutput, StackProps } from 'aws-cdk-l
 import { Construct } from 'constructs';
 import { Bucket, BlockPublicAccess, BucketEncryption, EventType, HttpMethods } from 'aws-cdk-lib/aws-s3';
 import { BucketDeployment, CacheControl, ServerSideEncryption, Source } from 'aws-cdk-lib/aws-s3-deployment';
-import { PythonFunction } from '@aws-cdk/aws-lambda-python-alpha';
+import { PythonFunction, PythonLayerVersion } from '@aws-cdk/aws-lambda-python-alpha';
 import { RestApi, LambdaIntegration, Cors, CognitoUserPoolsAuthorizer, AuthorizationType } from 'aws-cdk-lib/aws-apigateway';
 import { Architecture, Runtime } from 'aws-cdk-lib/aws-lambda';
 import { CanonicalUserPrincipal, PolicyStatement } from 'aws-cdk-lib/aws-iam';
@@ -20,7 +20,7 @@ import {
   ViewerCertificate,
 } from 'aws-cdk-lib/aws-cloudfront';
 import { AccountRecovery, UserPool, UserPoolClient, UserPoolDomain, UserPoolEmail, VerificationEmailStyle } from 'aws-cdk-lib/aws-cognito';
-import { AttributeType, BillingMode, Table } from 'aws-cdk-lib/aws-dynamodb';
+import { AttributeType, BillingMode, ProjectionType, Table } from 'aws-cdk-lib/aws-dynamodb';
 import { Certificate } from 'aws-cdk-lib/aws-certificatemanager';
 import { ARecord, HostedZone, RecordTarget } from 'aws-cdk-lib/aws-route53';
 import { CloudFrontTarget } from 'aws-cdk-lib/aws-route53-targets';
@@ -109,6 +109,18 @@ export class RagbotStack extends Stack {
           maxAge: 3000,
         },
       ],
+      lifecycleRules: [
+        {
+          // Content-addressed copies of document indexes, see generate_embeddings
+          prefix: 'embedding-cache/',
+          expiration: Duration.days(90),
+        },
+        {
+          // Index files replaced by a compaction, kept for readers of the previous metadata
+          tagFilters: { superseded: 'true' },
+          expiration: Duration.days(1),
+        },
+      ],
       autoDeleteObjects: true,
       removalPolicy: RemovalPolicy.DESTROY,
     });
@@ -120,6 +132,14 @@ export class RagbotStack extends Stack {
       billingMode: BillingMode.PAY_PER_REQUEST,
       removalPolicy: RemovalPolicy.DESTROY,
     });
+    // Newest-first listing of a user's documents, projecting only what a document card shows
+    documentTable.addGlobalSecondaryIndex({
+      indexName: 'userId-created-index',
+      partitionKey: { name: 'userId', type: AttributeType.STRING },
+      sortKey: { name: 'created', type: AttributeType.STRING },
+      projectionType: ProjectionType.INCLUDE,
+      nonKeyAttributes: ['filename', 'docStatus', 'pages', 'filesize', 'latestConversationId'],
+    });
 
     const sessionTable = new Table(this, 'SessionTable', {
       tableName: `${props.appName}-session-${props.envName}`,
@@ -128,17 +148,78 @@ export class RagbotStack extends Stack {
       billingMode: BillingMode.PAY_PER_REQUEST,
     });
 
+    // Chat history, one item per message; sessionTable only holds conversations from before it
+    const messageTable = new Table(this, 'MessageTable', {
+      tableName: `${props.appName}-messages-${props.envName}`,
+      partitionKey: { name: 'SessionId', type: AttributeType.STRING },
+      sortKey: { name: 'messageId', type: AttributeType.STRING },
+      removalPolicy: RemovalPolicy.DESTROY,
+      billingMode: BillingMode.PAY_PER_REQUEST,
+    });
+
+    // One item per conversation, listed newest first through the created index
+    const conversationTable = new Table(this, 'ConversationTable', {
+      tableName: `${props.appName}-conversations-${props.envName}`,
+      partitionKey: { name: 'documentId', type: AttributeType.STRING },
+      sortKey: { name: 'conversationId', type: AttributeType.STRING },
+      removalPolicy: RemovalPolicy.DESTROY,
+      billingMode: BillingMode.PAY_PER_REQUEST,
+    });
+    conversationTable.addLocalSecondaryIndex({
+      indexName: 'documentId-created-index',
+      sortKey: { name: 'created', type: AttributeType.STRING },
+      projectionType: ProjectionType.KEYS_ONLY,
+    });
+
     const table = new Table(this, 'WebsocketConnections', {
       tableName: `${props.appName}-connections-${props.envName}`,
       partitionKey: { name: 'connectionId', type: AttributeType.STRING },
       removalPolicy: RemovalPolicy.DESTROY,
       billingMode: BillingMode.PAY_PER_REQUEST,
     });
+    table.addGlobalSecondaryIndex({
+      indexName: 'userId-index',
+      partitionKey: { name: 'userId', type: AttributeType.STRING },
+      projectionType: ProjectionType.KEYS_ONLY,
+    });
+
+    const embeddingCacheTable = new Table(this, 'EmbeddingCacheTable', {
+      tableName: `${props.appName}-embedding-cache-${props.envName}`,
+      partitionKey: { name: 'hash', type: AttributeType.STRING },
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: RemovalPolicy.DESTROY,
+      billingMode: BillingMode.PAY_PER_REQUEST,
+    });
+
+    const answerCacheTable = new Table(this, 'AnswerCacheTable', {
+      tableName: `${props.appName}-answer-cache-${props.envName}`,
+      partitionKey: { name: 'indexVersion', type: AttributeType.STRING },
+      sortKey: { name: 'questionId', type: AttributeType.STRING },
+      timeToLiveAttribute: 'expiresAt',
+      removalPolicy: RemovalPolicy.DESTROY,
+      billingMode: BillingMode.PAY_PER_REQUEST,
+    });
 
+    // Documents that failed every attempt, kept for inspection and redrive
+    const embeddingDeadLetterQueue = new Queue(this, 'EmbeddingDeadLetterQueue', {
+      queueName: `${props.appName}-embeddings-dlq-${props.envName}`,
+      retentionPeriod: Duration.days(14),
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
     const embeddingQueue = new Queue(this, 'EmbeddingQueue', {
       queueName: `${props.appName}-embeddings-${props.envName}`,
-      visibilityTimeout: Duration.seconds(180),
+      // At least the function timeout, so a batch in progress is not delivered twice
+      visibilityTimeout: Duration.minutes(6),
       retentionPeriod: Duration.seconds(3600),
+      deadLetterQueue: { queue: embeddingDeadLetterQueue, maxReceiveCount: 3 },
+      removalPolicy: RemovalPolicy.DESTROY,
+    });
+
+    // Objects, conversations and messages of large deleted documents, removed after the API call returns
+    const cleanupQueue = new Queue(this, 'CleanupQueue', {
+      queueName: `${props.appName}-cleanup-${props.envName}`,
+      visibilityTimeout: Duration.minutes(6),
+      retentionPeriod: Duration.days(4),
       removalPolicy: RemovalPolicy.DESTROY,
     });
 
@@ -152,6 +233,14 @@ export class RagbotStack extends Stack {
       includeExtras: true,
     });
 
+    // Code shared by the RAG functions (Bedrock clients, index formats, ...)
+    const commonLayer = new PythonLayerVersion(this, 'CommonLayer', {
+      layerVersionName: `${props.appName}-common-${props.envName}`,
+      entry: 'src/common',
+      compatibleRuntimes: [Runtime.PYTHON_3_10],
+      compatibleArchitectures: [Architecture.ARM_64],
+    });
+
     const generatePresignedUrl = new PythonFunction(this, 'GeneratePresignedUrl', {
       functionName: `${props.appName}-GeneratePresignedUrl-${props.envName}`,
       entry: 'src/generate_presigned_url',
@@ -173,17 +262,19 @@ export class RagbotStack extends Stack {
       entry: 'src/upload_trigger',
       runtime: Runtime.PYTHON_3_10,
       architecture: Architecture.ARM_64,
-      memorySize: 384,
-      timeout: Duration.seconds(30),
+      memorySize: 1024,
+      timeout: Duration.minutes(2),
       environment: {
         BUCKET_NAME: bucket.bucketName,
         QUEUE_URL: embeddingQueue.queueUrl,
         DOCUMENT_TABLE: documentTable.tableName,
-        SESSION_TABLE: sessionTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
+        EXTRACT_TEXT: 'true',
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
+    conversationTable.grantWriteData(uploadTrigger);
     uploadTrigger.role?.addManagedPolicy({ managedPolicyArn: 'arn:aws:iam::aws:policy/AmazonS3ReadOnlyAccess' });
     uploadTrigger.addToRolePolicy(
       new PolicyStatement({
@@ -193,8 +284,8 @@ export class RagbotStack extends Stack {
     );
     uploadTrigger.addToRolePolicy(
       new PolicyStatement({
-        actions: ['dynamodb:PutItem'],
-        resources: [documentTable.tableArn, sessionTable.tableArn],
+        actions: ['dynamodb:PutItem', 'dynamodb:Query', 'dynamodb:UpdateItem'],
+        resources: [documentTable.tableArn],
       })
     );
     uploadTrigger.addEventSource(
@@ -204,6 +295,7 @@ export class RagbotStack extends Stack {
       })
     );
     bucket.grantRead(uploadTrigger);
+    bucket.grantPut(uploadTrigger);
 
     const generateEmbeddings = new PythonFunction(this, 'GenerateEmbeddings', {
       functionName: `${props.appName}-GenerateEmbeddings-${props.envName}`,
@@ -211,13 +303,29 @@ export class RagbotStack extends Stack {
       runtime: Runtime.PYTHON_3_10,
       architecture: Architecture.ARM_64,
       memorySize: 2048,
-      timeout: Duration.minutes(2),
+      timeout: Duration.minutes(5),
       environment: {
         BUCKET_NAME: bucket.bucketName,
         DOCUMENT_TABLE: documentTable.tableName,
+        EMBEDDING_CACHE_TABLE: embeddingCacheTable.tableName,
+        EMBEDDING_MAX_CONCURRENCY: '8',
+        EMBEDDING_RECORD_CONCURRENCY: '2',
+        EMBEDDING_MAX_RECEIVE_COUNT: '3',
+        EMBEDDING_RECORD_MIN_REMAINING_MS: '60000',
+        EMBEDDING_DEADLINE_MARGIN_MS: '10000',
+        EMBEDDING_SHARD_PAGES: '100',
+        INDEX_FORMAT: 'mapped',
+        INDEX_TYPE: 'auto',
+        INDEX_LEXICAL: 'true',
+        STARTUP_MODE: 'lazy',
+        QUEUE_URL: embeddingQueue.queueUrl,
+        COMPACTION_TOMBSTONE_RATIO: '0.25',
+        ANSWER_CACHE_TABLE: answerCacheTable.tableName,
+        POWERTOOLS_METRICS_NAMESPACE: props.appName,
+        POWERTOOLS_LOGGER_SAMPLE_RATE: '0.05',
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
     generateEmbeddings.addToRolePolicy(
       new PolicyStatement({
@@ -228,6 +336,7 @@ export class RagbotStack extends Stack {
           'sqs:DeleteMessageBatch',
           'sqs:GetQueueAttributes',
           'sqs:ReceiveMessage',
+          'sqs:SendMessage',
         ],
         resources: [embeddingQueue.queueArn],
       })
@@ -241,6 +350,8 @@ export class RagbotStack extends Stack {
           's3:GetObjectVersion',
           's3:PutObject',
           's3:PutObjectAcl',
+          's3:GetObjectTagging',
+          's3:PutObjectTagging',
           's3:GetLifecycleConfiguration',
           's3:PutLifecycleConfiguration',
           's3:DeleteObject',
@@ -256,11 +367,19 @@ export class RagbotStack extends Stack {
     );
     generateEmbeddings.addToRolePolicy(
       new PolicyStatement({
-        actions: ['dynamodb:PutItem', 'dynamodb:UpdateItem'],
+        actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
         resources: [documentTable.tableArn],
       })
     );
-    generateEmbeddings.addEventSource(new SqsEventSource(embeddingQueue, { batchSize: 1 }));
+    embeddingCacheTable.grantReadWriteData(generateEmbeddings);
+    answerCacheTable.grantReadWriteData(generateEmbeddings);
+    generateEmbeddings.addEventSource(
+      new SqsEventSource(embeddingQueue, {
+        batchSize: 4,
+        maxBatchingWindow: Duration.seconds(5),
+        reportBatchItemFailures: true,
+      })
+    );
 
     const getAllDocuments = new PythonFunction(this, 'GetAllDocuments', {
       functionName: `${props.appName}-GetAllDocuments-${props.envName}`,
@@ -271,14 +390,16 @@ export class RagbotStack extends Stack {
       timeout: Duration.seconds(30),
       environment: {
         DOCUMENT_TABLE: documentTable.tableName,
+        DOCUMENTS_CREATED_INDEX: 'userId-created-index',
+        DOCUMENTS_PAGE_SIZE: '50',
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
     getAllDocuments.addToRolePolicy(
       new PolicyStatement({
-        actions: ['dynamodb:Query'],
-        resources: [documentTable.tableArn],
+        actions: ['dynamodb:Query', 'dynamodb:BatchGetItem'],
+        resources: [documentTable.tableArn, `${documentTable.tableArn}/index/userId-created-index`],
       })
     );
 
@@ -292,16 +413,27 @@ export class RagbotStack extends Stack {
       environment: {
         DOCUMENT_TABLE: documentTable.tableName,
         SESSION_TABLE: sessionTable.tableName,
+        MESSAGE_TABLE: messageTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
+    messageTable.grantReadData(getDocument);
+    // Write access moves conversations of older documents into the conversation table
+    conversationTable.grantReadWriteData(getDocument);
     getDocument.addToRolePolicy(
       new PolicyStatement({
         actions: ['dynamodb:GetItem'],
         resources: [documentTable.tableArn, sessionTable.tableArn],
       })
     );
+    getDocument.addToRolePolicy(
+      new PolicyStatement({
+        actions: ['dynamodb:UpdateItem'],
+        resources: [documentTable.tableArn],
+      })
+    );
 
     const deleteDocument = new PythonFunction(this, 'DeleteDocument', {
       functionName: `${props.appName}-DeleteDocument-${props.envName}`,
@@ -309,15 +441,31 @@ export class RagbotStack extends Stack {
       runtime: Runtime.PYTHON_3_10,
       architecture: Architecture.ARM_64,
       memorySize: 384,
-      timeout: Duration.seconds(30),
+      // API calls are cut off by API Gateway after 29 seconds, queued cleanups may run longer
+      timeout: Duration.minutes(5),
       environment: {
         DOCUMENT_TABLE: documentTable.tableName,
         SESSION_TABLE: sessionTable.tableName,
         BUCKET_NAME: bucket.bucketName,
+        MESSAGE_TABLE: messageTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
+        ANSWER_CACHE_TABLE: answerCacheTable.tableName,
+        EMBEDDING_CACHE_TABLE: embeddingCacheTable.tableName,
+        CLEANUP_QUEUE_URL: cleanupQueue.queueUrl,
+        DELETE_ASYNC_MIN_PAGES: '200',
+        DELETE_ASYNC_MIN_CONVERSATIONS: '20',
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
-    });
+      layers: [powertoolsLayer, commonLayer],
+    });
+    answerCacheTable.grantReadWriteData(deleteDocument);
+    // Owners of the shared content-addressed index copies
+    embeddingCacheTable.grantReadWriteData(deleteDocument);
+    messageTable.grantReadWriteData(deleteDocument);
+    conversationTable.grantReadWriteData(deleteDocument);
+    sessionTable.grantWriteData(deleteDocument);
+    cleanupQueue.grantSendMessages(deleteDocument);
+    deleteDocument.addEventSource(new SqsEventSource(cleanupQueue, { batchSize: 1 }));
     deleteDocument.addToRolePolicy(
       new PolicyStatement({
         actions: ['s3:ListBucket', 's3:DeleteObject'],
@@ -327,7 +475,7 @@ export class RagbotStack extends Stack {
     deleteDocument.addToRolePolicy(
       new PolicyStatement({
         actions: ['dynamodb:DeleteItem'],
-        resources: [documentTable.tableArn, sessionTable.tableArn],
+        resources: [documentTable.tableArn],
       })
     );
 
@@ -340,15 +488,38 @@ export class RagbotStack extends Stack {
       timeout: Duration.seconds(30),
       environment: {
         DOCUMENT_TABLE: documentTable.tableName,
-        SESSION_TABLE: sessionTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
+    conversationTable.grantWriteData(addConversation);
     addConversation.addToRolePolicy(
       new PolicyStatement({
-        actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
-        resources: [documentTable.tableArn, sessionTable.tableArn],
+        actions: ['dynamodb:GetItem', 'dynamodb:UpdateItem'],
+        resources: [documentTable.tableArn],
+      })
+    );
+
+    const getConversations = new PythonFunction(this, 'GetConversations', {
+      functionName: `${props.appName}-GetConversations-${props.envName}`,
+      entry: 'src/get_conversations',
+      runtime: Runtime.PYTHON_3_10,
+      architecture: Architecture.ARM_64,
+      memorySize: 384,
+      timeout: Duration.seconds(30),
+      environment: {
+        DOCUMENT_TABLE: documentTable.tableName,
+        CONVERSATION_TABLE: conversationTable.tableName,
+      },
+      retryAttempts: 0,
+      layers: [powertoolsLayer, commonLayer],
+    });
+    conversationTable.grantReadWriteData(getConversations);
+    getConversations.addToRolePolicy(
+      new PolicyStatement({
+        actions: ['dynamodb:GetItem', 'dynamodb:UpdateItem'],
+        resources: [documentTable.tableArn],
       })
     );
 
@@ -362,13 +533,31 @@ export class RagbotStack extends Stack {
       environment: {
         BUCKET_NAME: bucket.bucketName,
         SESSION_TABLE: sessionTable.tableName,
+        MESSAGE_TABLE: messageTable.tableName,
         TABLE_NAME: table.tableName,
+        DOCUMENT_TABLE: documentTable.tableName,
+        CONNECTIONS_USER_INDEX: 'userId-index',
+        STARTUP_MODE: 'lazy',
+        ANSWER_CACHE_TABLE: answerCacheTable.tableName,
+        ANSWER_CACHE_THRESHOLD: '0.95',
+        RELEVANCE_THRESHOLD: '0.7',
+        HYBRID_CANDIDATES: '8',
+        LEXICAL_CONFIDENT_COVERAGE: '1.0',
+        LEXICAL_CONFIDENT_MARGIN: '1.5',
+        CONTEXT_MAX_TOKENS: '1500',
+        CONTEXT_MMR_LAMBDA: '0.7',
+        CONDENSE_STRATEGY: 'heuristic',
+        POWERTOOLS_METRICS_NAMESPACE: props.appName,
+        POWERTOOLS_LOGGER_SAMPLE_RATE: '0.05',
       },
       retryAttempts: 0,
-      layers: [powertoolsLayer],
+      layers: [powertoolsLayer, commonLayer],
     });
-    table.grantReadData(generateResponse);
-    sessionTable.grantReadWriteData(generateResponse);
+    table.grantReadWriteData(generateResponse);
+    sessionTable.grantReadData(generateResponse);
+    messageTable.grantReadWriteData(generateResponse);
+    documentTable.grantReadData(generateResponse);
+    answerCacheTable.grantReadWriteData(generateResponse);
     generateResponse.addToRolePolicy(
       new PolicyStatement({
         actions: [
@@ -387,7 +576,7 @@ export class RagbotStack extends Stack {
     );
     generateResponse.addToRolePolicy(
       new PolicyStatement({
-        actions: ['bedrock:InvokeModel'],
+        actions: ['bedrock:InvokeModel', 'bedrock:InvokeModelWithResponseStream'],
         resources: ['arn:aws:bedrock:*::foundation-model/anthropic.claude-v2', 'arn:aws:bedrock:*::foundation-model/amazon.titan-embed-text-v1'],
       })
     );
@@ -465,6 +654,15 @@ export class RagbotStack extends Stack {
       authorizationType: AuthorizationType.COGNITO,
     });
 
+    // GET /doc/{documentId}
+    const getConversationsApiIntegration = new LambdaIntegration(getConversations, {
+      requestTemplates: { 'application/json': '{ "statusCode": "200" }' },
+    });
+    docIdResource.addMethod('GET', getConversationsApiIntegration, {
+      authorizer,
+      authorizationType: AuthorizationType.COGNITO,
+    });
+
     // POST /doc/{documentId}
     const addConversationApiIntegration = new LambdaIntegration(addConversation, {
       requestTemplates: { 'application/json': '{ "statusCode": "200" }' },
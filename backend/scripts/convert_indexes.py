@@ -0,0 +1,61 @@
+# Converts every index.faiss/index.pkl pair in the PDF bucket to the
+# memory-mapped index format (see src/common/ragbot_common/vector_index.py).
+# Already converted documents are skipped. Legacy files are kept unless
+# --delete-legacy is passed; generate_response prefers the mapped files.
+#
+#   python scripts/convert_indexes.py --bucket ragbot-pdfbucket-dev [--dtype float16] [--delete-legacy]
+
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "common"))
+
+import boto3
+from ragbot_common import vector_index
+
+
+def legacy_prefixes(s3, bucket):
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket):
+        for item in page.get("Contents", []):
+            if item["Key"].endswith("/index.pkl"):
+                yield item["Key"].rsplit("/", 1)[0]
+
+
+def exists(s3, bucket, key):
+    return s3.list_objects_v2(Bucket=bucket, Prefix=key, MaxKeys=1).get("KeyCount", 0) > 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--delete-legacy", action="store_true")
+    args = parser.parse_args()
+
+    s3 = boto3.client("s3")
+    for prefix in legacy_prefixes(s3, args.bucket):
+        if exists(s3, args.bucket, f"{prefix}/{vector_index.META_FILE}"):
+            print(f"skip    {prefix}")
+            continue
+
+        with tempfile.TemporaryDirectory() as tmp:
+            source, target = os.path.join(tmp, "faiss"), os.path.join(tmp, "mapped")
+            os.makedirs(source)
+            for file_name in ["index.faiss", "index.pkl"]:
+                s3.download_file(args.bucket, f"{prefix}/{file_name}", os.path.join(source, file_name))
+
+            rows = vector_index.convert_faiss(source, target, args.dtype)
+            # Metadata last, readers only switch once every other file is in place
+            file_names = sorted(os.listdir(target), key=lambda name: name == vector_index.META_FILE)
+            for file_name in file_names:
+                s3.upload_file(os.path.join(target, file_name), args.bucket, f"{prefix}/{file_name}")
+
+        if args.delete_legacy:
+            s3.delete_objects(Bucket=args.bucket, Delete={"Objects": [{"Key": f"{prefix}/index.faiss"}, {"Key": f"{prefix}/index.pkl"}]})
+        print(f"convert {prefix} ({rows} rows)")
+
+
+if __name__ == "__main__":
+    main()
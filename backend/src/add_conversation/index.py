@@ -1,15 +1,15 @@
 import os, json
-from datetime import datetime
 import boto3
 import shortuuid
 from aws_lambda_powertools import Logger
+from ragbot_common.conversations import create_conversation, DocumentNotFound
 
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
-SESSION_TABLE = os.environ["SESSION_TABLE"]
+CONVERSATION_TABLE = os.environ["CONVERSATION_TABLE"]
 
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
-memory_table = ddb.Table(SESSION_TABLE)
+conversation_table = ddb.Table(CONVERSATION_TABLE)
 logger = Logger()
 
 @logger.inject_lambda_context(log_event=True)
@@ -17,37 +17,21 @@ def handler(event, context):
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
     document_id = event["pathParameters"]["documentId"]
 
-    response = document_table.get_item(
-        Key={"userId": user_id, "documentId": document_id}
-    )
-    conversations = response["Item"]["conversations"]
-    logger.info({"conversations": conversations})
-
-    conversation_id = shortuuid.uuid()
-    timestamp = datetime.utcnow()
-    timestamp_str = timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-    conversation = {
-        "conversationId": conversation_id,
-        "created": timestamp_str,
+    headers = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "*",
     }
-    conversations.append(conversation)
-    logger.info({"conversation_new": conversation})
-    document_table.update_item(
-        Key={"userId": user_id, "documentId": document_id},
-        UpdateExpression="SET conversations = :conversations",
-        ExpressionAttributeValues={":conversations": conversations},
-    )
 
-    conversation = {"SessionId": conversation_id, "History": []}
-    memory_table.put_item(Item=conversation)
+    try:
+        conversation = create_conversation(document_table, conversation_table, user_id, document_id, shortuuid.uuid())
+    except DocumentNotFound:
+        return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Document not found"})}
+    logger.info({"conversation_new": conversation})
 
     return {
         "statusCode": 200,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "*",
-        },
-        "body": json.dumps({"conversationId": conversation_id}),
+        "headers": headers,
+        "body": json.dumps({"conversationId": conversation["conversationId"]}),
     }
@@ -0,0 +1,98 @@
+import os
+import json
+import time
+import hashlib
+import uuid
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL_HOURS = int(os.environ.get("ANSWER_CACHE_TTL_HOURS", 168))
+ANSWER_CACHE_MAX_CANDIDATES = int(os.environ.get("ANSWER_CACHE_MAX_CANDIDATES", 100))
+
+
+def index_version(etags, *model_ids):
+    # Identifies the exact index files (and the models) an answer was produced
+    # from. S3 copies keep ETags, so documents reusing a cached index share answers
+    entries = sorted(etags.items()) + list(model_ids)
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+
+def remote_index_version(s3, bucket, prefix, *model_ids):
+    response = s3.list_objects_v2(Bucket=bucket, Prefix=f"{prefix}/index.")
+    etags = {item["Key"].split("/")[-1]: item["ETag"] for item in response.get("Contents", [])}
+    return index_version(etags, *model_ids) if etags else None
+
+
+class AnswerCache:
+    # Answers to standalone questions in DynamoDB, partitioned by index version.
+    # A lookup compares the question embedding with the most recent questions
+    # of the same version and returns the closest answer above the threshold.
+    # Vectors are stored as float16, which is plenty for a cosine cut-off.
+
+    def __init__(self, table, threshold=ANSWER_CACHE_THRESHOLD, ttl_hours=ANSWER_CACHE_TTL_HOURS, max_candidates=ANSWER_CACHE_MAX_CANDIDATES):
+        self.table = table
+        self.threshold = threshold
+        self.ttl_hours = ttl_hours
+        self.max_candidates = max_candidates
+
+    def lookup(self, version, vector):
+        import numpy as np
+
+        kwargs = {"KeyConditionExpression": Key("indexVersion").eq(version), "ScanIndexForward": False}
+        items = []
+        while len(items) < self.max_candidates:
+            response = self.table.query(Limit=self.max_candidates - len(items), **kwargs)
+            items.extend(response["Items"])
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        # TTL deletion lags, expired items can still be returned
+        now = int(time.time())
+        items = [item for item in items if item["expiresAt"] > now]
+        if not items:
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        candidates = np.stack([np.frombuffer(item["embedding"].value, dtype=np.float16) for item in items]).astype(np.float32)
+        similarities = candidates @ query / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(query) + 1e-12)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        item = items[best]
+        return {
+            "question": item["question"],
+            "answer": item["answer"],
+            "sources": json.loads(item["sources"]),
+            "similarity": float(similarities[best]),
+            "latencyMs": int(item["latencyMs"]),
+        }
+
+    def put(self, version, question, vector, answer, sources, latency_ms):
+        import numpy as np
+
+        created = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        self.table.put_item(
+            Item={
+                "indexVersion": version,
+                "questionId": f"{created}#{uuid.uuid4().hex}",
+                "question": question,
+                "embedding": np.asarray(vector, dtype=np.float16).tobytes(),
+                "answer": answer,
+                "sources": json.dumps(sources),
+                "latencyMs": int(latency_ms),
+                "expiresAt": int(time.time()) + self.ttl_hours * 3600,
+            }
+        )
+
+    def invalidate(self, version):
+        kwargs = {"KeyConditionExpression": Key("indexVersion").eq(version), "ProjectionExpression": "indexVersion, questionId"}
+        with self.table.batch_writer() as batch:
+            while True:
+                response = self.table.query(**kwargs)
+                for item in response["Items"]:
+                    batch.delete_item(Key={"indexVersion": item["indexVersion"], "questionId": item["questionId"]})
+                if "LastEvaluatedKey" not in response:
+                    break
+                kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
@@ -0,0 +1,78 @@
+import os
+from functools import lru_cache
+import boto3
+from botocore.config import Config
+
+BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
+EMBEDDING_MODEL_ID = os.environ.get("EMBEDDING_MODEL_ID", "amazon.titan-embed-text-v1")
+LLM_MODEL_ID = os.environ.get("LLM_MODEL_ID", "anthropic.claude-v2")
+# Model that rewrites follow-up questions into standalone ones, e.g. anthropic.claude-instant-v1
+CONDENSE_MODEL_ID = os.environ.get("CONDENSE_MODEL_ID", LLM_MODEL_ID)
+BEDROCK_ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL")
+
+# "lazy" defers langchain imports and client construction until first use,
+# "eager" builds everything during the init phase
+STARTUP_MODE = os.environ.get("STARTUP_MODE", "lazy")
+
+
+@lru_cache(maxsize=None)
+def bedrock_runtime(max_attempts=None):
+    config = Config(max_pool_connections=50, retries={"mode": "standard", "max_attempts": max_attempts} if max_attempts else None)
+    return boto3.client(service_name="bedrock-runtime", region_name=BEDROCK_REGION, endpoint_url=BEDROCK_ENDPOINT_URL, config=config)
+
+
+@lru_cache(maxsize=None)
+def embeddings():
+    from langchain_community.embeddings import BedrockEmbeddings
+
+    return BedrockEmbeddings(model_id=EMBEDDING_MODEL_ID, client=bedrock_runtime(), region_name=BEDROCK_REGION)
+
+
+@lru_cache(maxsize=None)
+def query_embeddings(maxsize=256):
+    # Bedrock embeddings whose query vectors are memoized per container, so a
+    # question embedded once (e.g. for the answer cache) is not embedded again
+    # by the retriever
+    from langchain_core.embeddings import Embeddings
+
+    class MemoizedQueryEmbeddings(Embeddings):
+        def __init__(self, embeddings):
+            self.embeddings = embeddings
+            self.cached_query = lru_cache(maxsize=maxsize)(self.embed_uncached)
+
+        def embed_uncached(self, text):
+            from ragbot_common import telemetry
+
+            with telemetry.stage("query_embedding"):
+                return tuple(self.embeddings.embed_query(text))
+
+        def embed_documents(self, texts):
+            return self.embeddings.embed_documents(texts)
+
+        def embed_query(self, text):
+            return list(self.cached_query(text))
+
+    return MemoizedQueryEmbeddings(embeddings())
+
+
+@lru_cache(maxsize=None)
+def llm(streaming=False, model_id=LLM_MODEL_ID):
+    # With streaming=True the completion is read from invoke_model_with_response_stream
+    # and every chunk is reported to the on_llm_new_token callbacks
+    from langchain.llms.bedrock import Bedrock
+
+    return Bedrock(model_id=model_id, client=bedrock_runtime(), region_name=BEDROCK_REGION, streaming=streaming)
+
+
+@lru_cache(maxsize=None)
+def embedding_engine():
+    from ragbot_common.embedding_engine import EmbeddingEngine
+
+    # botocore retries are disabled, the engine backs off and adapts its concurrency itself
+    return EmbeddingEngine(bedrock_runtime(max_attempts=1), EMBEDDING_MODEL_ID)
+
+
+def warm(*factories):
+    if STARTUP_MODE == "eager":
+        for factory in factories:
+            factory()
@@ -0,0 +1,132 @@
+import os
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from boto3.dynamodb.conditions import Key
+from ragbot_common.pagination import query_page
+
+CHAT_HISTORY_MAX_TURNS = int(os.environ.get("CHAT_HISTORY_MAX_TURNS", 10))
+CHAT_HISTORY_MAX_TOKENS = int(os.environ.get("CHAT_HISTORY_MAX_TOKENS", 2000))
+
+
+def approximate_tokens(text):
+    # Roughly 4 characters per token for English text with Claude's tokenizer
+    return len(text) // 4 + 1
+
+
+clock = threading.Lock()
+last_write = 0
+# Tells apart ids of writes from different containers in the same microsecond
+CONTAINER_ID = uuid.uuid4().hex[:8]
+
+
+def write_time():
+    # Microseconds since the epoch, strictly increasing within the container so
+    # two writes never share a timestamp even if the clock stalls or steps back
+    global last_write
+    with clock:
+        last_write = max(time.time_ns() // 1000, last_write + 1)
+        return last_write
+
+
+def message_id(micros, index=0):
+    # Sort key: write time, then the position within the write
+    stamp = (datetime(1970, 1, 1) + timedelta(microseconds=micros)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    return f"{stamp}#{index:06d}#{CONTAINER_ID}"
+
+
+def put_messages(table, session_id, messages):
+    # One item per message, so appending a turn never rewrites earlier ones.
+    # messages are dicts in LangChain's message_to_dict format
+    micros = write_time()
+    with table.batch_writer() as batch:
+        for index, message in enumerate(messages):
+            batch.put_item(Item={"SessionId": session_id, "messageId": message_id(micros, index), "type": message["type"], "data": message["data"]})
+
+
+def from_human(messages):
+    # A window cut by the turn or token limit may start with the answer of a
+    # turn whose question was cut, so it starts at the first human message
+    for start, message in enumerate(messages):
+        if message["type"] == "human":
+            return messages[start:]
+    return []
+
+
+def recent_messages(table, session_id, max_turns=CHAT_HISTORY_MAX_TURNS, max_tokens=CHAT_HISTORY_MAX_TOKENS):
+    # The newest messages that fit in both the turn window and the token budget,
+    # oldest first. Reads newest-first and stops as soon as either limit is reached
+    items, _ = query_page(table, 2 * max_turns, KeyConditionExpression=Key("SessionId").eq(session_id), ScanIndexForward=False)
+    window, tokens = [], 0
+    for item in items:
+        tokens += approximate_tokens(item["data"]["content"])
+        if window and tokens > max_tokens:
+            break
+        window.append({"type": item["type"], "data": item["data"]})
+    return window[::-1]
+
+
+def page_messages(table, session_id, limit=50, cursor=None):
+    # Pages backwards from the newest message. Each page is returned oldest
+    # first, with a cursor to the page of older messages
+    items, next_cursor = query_page(table, limit, cursor, KeyConditionExpression=Key("SessionId").eq(session_id), ScanIndexForward=False)
+    return [{"type": item["type"], "data": item["data"]} for item in reversed(items)], next_cursor
+
+
+def delete_messages(table, session_id):
+    kwargs = {"KeyConditionExpression": Key("SessionId").eq(session_id), "ProjectionExpression": "SessionId, messageId"}
+    with table.batch_writer() as batch:
+        while True:
+            response = table.query(**kwargs)
+            for item in response["Items"]:
+                batch.delete_item(Key={"SessionId": item["SessionId"], "messageId": item["messageId"]})
+            if "LastEvaluatedKey" not in response:
+                break
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def legacy_messages(session_table, session_id):
+    # Conversations from before the message table kept their whole history in
+    # one session item
+    item = session_table.get_item(Key={"SessionId": session_id}).get("Item") if session_table else None
+    return item["History"] if item else []
+
+
+def chat_history(table, session_id, session_table=None, max_turns=CHAT_HISTORY_MAX_TURNS, max_tokens=CHAT_HISTORY_MAX_TOKENS):
+    # LangChain chat history over the message table. Only the recent window is
+    # loaded, once per request; new messages are appended as single items
+    from langchain_core.chat_history import BaseChatMessageHistory
+    from langchain_core.messages import messages_from_dict, message_to_dict
+
+    class WindowedChatMessageHistory(BaseChatMessageHistory):
+        def __init__(self):
+            self.window = None
+            # History of a conversation from before the message table, written
+            # to the table ahead of the first new messages
+            self.legacy = []
+
+        @property
+        def messages(self):
+            if self.window is None:
+                stored = recent_messages(table, session_id, max_turns, max_tokens)
+                if not stored:
+                    self.legacy = legacy_messages(session_table, session_id)
+                    stored = self.legacy[-2 * max_turns :]
+                self.window = messages_from_dict(from_human(stored))
+            return self.window
+
+        def add_message(self, message):
+            self.add_messages([message])
+
+        def add_messages(self, messages):
+            window = self.messages
+            put_messages(table, session_id, self.legacy + [message_to_dict(message) for message in messages])
+            self.legacy = []
+            window.extend(messages)
+
+        def clear(self):
+            delete_messages(table, session_id)
+            self.window = []
+
+    return WindowedChatMessageHistory()
@@ -0,0 +1,90 @@
+import os
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+from ragbot_common.pagination import query_page
+
+# Local index of the conversation table sorting a document's conversations by creation time
+CONVERSATIONS_CREATED_INDEX = os.environ.get("CONVERSATIONS_CREATED_INDEX", "documentId-created-index")
+
+
+class DocumentNotFound(Exception):
+    pass
+
+
+def timestamp():
+    return datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def put_conversations(table, user_id, document_id, conversations):
+    with table.batch_writer() as batch:
+        for conversation in conversations:
+            batch.put_item(Item={"documentId": document_id, "userId": user_id, **conversation})
+
+
+def migrate_legacy(document_table, table, user_id, document):
+    # Conversations from before the conversation table were a list on the
+    # document item. They are written as items first, then removed from the
+    # document, so a failure in between leaves both copies but loses nothing
+    if "conversations" not in document:
+        return
+    conversations = document.pop("conversations")
+    put_conversations(table, user_id, document["documentId"], conversations)
+    kwargs = {"UpdateExpression": "REMOVE conversations"}
+    if conversations:
+        # Documents listed before latestConversationId existed keep their card link
+        latest = max(conversations, key=lambda conversation: conversation["created"])["conversationId"]
+        kwargs = {
+            "UpdateExpression": "REMOVE conversations SET latestConversationId = if_not_exists(latestConversationId, :conversationId)",
+            "ExpressionAttributeValues": {":conversationId": latest},
+        }
+    document_table.update_item(Key={"userId": user_id, "documentId": document["documentId"]}, **kwargs)
+
+
+def create_conversation(document_table, table, user_id, document_id, conversation_id):
+    # One conditional write on the document (it must exist and no longer hold a
+    # legacy list) and one put, however many conversations the document has
+    conversation = {"conversationId": conversation_id, "created": timestamp()}
+    try:
+        document_table.update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression="SET latestConversationId = :conversationId",
+            ConditionExpression="attribute_exists(documentId) AND attribute_not_exists(conversations)",
+            ExpressionAttributeValues={":conversationId": conversation_id},
+        )
+    except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+        document = document_table.get_item(Key={"userId": user_id, "documentId": document_id}, ProjectionExpression="documentId, conversations").get("Item")
+        if not document:
+            raise DocumentNotFound(document_id)
+        migrate_legacy(document_table, table, user_id, document)
+        return create_conversation(document_table, table, user_id, document_id, conversation_id)
+    put_conversations(table, user_id, document_id, [conversation])
+    return conversation
+
+
+def page_conversations(table, document_id, limit=50, cursor=None):
+    # Newest first. Reads are consistent, so a conversation just created is listed
+    return query_page(
+        table,
+        limit,
+        cursor,
+        IndexName=CONVERSATIONS_CREATED_INDEX,
+        KeyConditionExpression=Key("documentId").eq(document_id),
+        ProjectionExpression="conversationId, created",
+        ScanIndexForward=False,
+        ConsistentRead=True,
+    )
+
+
+def delete_conversations(table, document_id):
+    # Returns the ids of the deleted conversations
+    conversation_ids = []
+    kwargs = {"KeyConditionExpression": Key("documentId").eq(document_id), "ProjectionExpression": "conversationId"}
+    with table.batch_writer() as batch:
+        while True:
+            response = table.query(**kwargs)
+            for item in response["Items"]:
+                batch.delete_item(Key={"documentId": document_id, "conversationId": item["conversationId"]})
+                conversation_ids.append(item["conversationId"])
+            if "LastEvaluatedKey" not in response:
+                return conversation_ids
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
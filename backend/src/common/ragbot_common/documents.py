@@ -0,0 +1,8 @@
+# Attributes of document items kept for the backend only: the binary routing
+# vector of library questions and the bookkeeping of page-range shards
+INTERNAL_ATTRIBUTES = ("centroid", "shardRun", "shardCount", "shardsDone")
+
+
+def client_document(document):
+    # The document item as the API returns it
+    return {name: value for name, value in document.items() if name not in INTERNAL_ATTRIBUTES}
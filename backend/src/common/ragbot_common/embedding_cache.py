@@ -0,0 +1,93 @@
+import time
+import hashlib
+from array import array
+
+EMBEDDING_CACHE_TTL_DAYS = 90
+
+
+class EmbeddingCache:
+    # Persistent chunk embedding cache in DynamoDB, keyed by the SHA-256 of the
+    # embedding model id and the chunk text. Vectors are stored as packed float32.
+
+    def __init__(self, table, model_id):
+        self.table = table
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text):
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(dict.fromkeys(keys))
+        client = self.table.meta.client
+        for start in range(0, len(keys), 100):
+            request = {self.table.name: {"Keys": [{"hash": key} for key in keys[start : start + 100]]}}
+            while request:
+                response = client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table.name, []):
+                    vector = array("f")
+                    vector.frombytes(item["embedding"].value)
+                    found[item["hash"]] = vector.tolist()
+                request = response.get("UnprocessedKeys")
+        return found
+
+    def put_many(self, entries):
+        expires_at = int(time.time()) + EMBEDDING_CACHE_TTL_DAYS * 86400
+        with self.table.batch_writer(overwrite_by_pkeys=["hash"]) as batch:
+            for key, vector in entries.items():
+                batch.put_item(Item={"hash": key, "embedding": array("f", vector).tobytes(), "expiresAt": expires_at})
+
+    def embed(self, texts, engine, stats=None):
+        # Looks every text up first and only sends the misses to the embedding engine
+        keys = [self.key(text) for text in texts]
+        cached = self.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - sum(1 for key in keys if key in missing)
+        self.misses += sum(1 for key in keys if key in missing)
+
+        if missing:
+            vectors = engine.embed(list(missing.values()), stats)
+            fresh = dict(zip(missing.keys(), vectors))
+            self.put_many(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+
+class ContentOwners:
+    # Documents sharing a content-addressed index copy (embedding-cache/<model>/<hash>),
+    # kept as a string set in the embedding cache table. The item has no expiresAt.
+    # Documents indexed before owners were recorded are not listed, so deleting
+    # the last listed one also drops the copy; the others only lose the shortcut.
+
+    def __init__(self, table, model_id):
+        self.table = table
+        self.model_id = model_id
+
+    def key(self, content_hash):
+        return {"hash": f"content#{self.model_id}#{content_hash}"}
+
+    def add(self, content_hash, owner):
+        self.table.update_item(Key=self.key(content_hash), UpdateExpression="ADD owners :owner", ExpressionAttributeValues={":owner": {owner}})
+
+    def remove(self, content_hash, owner):
+        # Returns whether any other document still shares the content
+        response = self.table.update_item(
+            Key=self.key(content_hash),
+            UpdateExpression="DELETE owners :owner",
+            ExpressionAttributeValues={":owner": {owner}},
+            ReturnValues="ALL_NEW",
+        )
+        if response.get("Attributes", {}).get("owners"):
+            return True
+        try:
+            self.table.delete_item(Key=self.key(content_hash), ConditionExpression="attribute_not_exists(owners)")
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            # Another document was added in the meantime
+            return True
+        return False
@@ -0,0 +1,134 @@
+import os
+import json
+import math
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 8))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 8))
+
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException", "ModelNotReadyException"}
+
+
+class AdaptiveLimiter:
+    # Concurrency limit that grows by one slot per "window" of successful calls
+    # and halves on throttling (AIMD), bounded by [minimum, maximum]
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class EmbeddingStats:
+    def __init__(self):
+        self.chunks = 0
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latencies = []
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, latency, throttled):
+        with self.lock:
+            self.calls += 1
+            self.latencies.append(latency)
+            if throttled:
+                self.throttles += 1
+                self.retries += 1
+
+    def percentile(self, p):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    def as_dict(self):
+        return {
+            "chunks": self.chunks,
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttles": self.throttles,
+            "seconds": round(self.seconds, 3),
+            "chunks_per_s": round(self.chunks / self.seconds, 2) if self.seconds else 0.0,
+            "p50_call_ms": round(self.percentile(50) * 1000, 1),
+            "p95_call_ms": round(self.percentile(95) * 1000, 1),
+        }
+
+
+class EmbeddingEngine:
+    # Embeds texts with bounded concurrent Bedrock calls. Throttled calls are
+    # retried with exponential backoff and full jitter, and shrink the
+    # concurrency limit until calls succeed again. Results keep input order.
+    # The limiter and the thread pool belong to the engine (one per container,
+    # see bedrock.embedding_engine), so a limit reduced by throttling carries
+    # over to the next call and concurrent callers share one budget.
+
+    def __init__(self, client, model_id, max_concurrency=EMBEDDING_MAX_CONCURRENCY, max_retries=EMBEDDING_MAX_RETRIES, base_delay=0.1, max_delay=8.0):
+        self.client = client
+        self.model_id = model_id
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="embed")
+
+    def invoke(self, text):
+        # Same request as langchain's BedrockEmbeddings, so query and document vectors match
+        response = self.client.invoke_model(
+            body=json.dumps({"inputText": text.replace(os.linesep, " ")}),
+            modelId=self.model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response.get("body").read())["embedding"]
+
+    def embed_one(self, text, stats):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                embedding = self.invoke(text)
+            except ClientError as e:
+                throttled = e.response["Error"]["Code"] in THROTTLING_ERRORS
+                self.limiter.release(throttled=throttled)
+                stats.record(time.perf_counter() - start, throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt)))
+                attempt += 1
+                continue
+            self.limiter.release()
+            stats.record(time.perf_counter() - start, False)
+            return embedding
+
+    def embed(self, texts, stats=None):
+        stats = stats or EmbeddingStats()
+        start = time.perf_counter()
+        embeddings = list(self.executor.map(lambda text: self.embed_one(text, stats), texts))
+        stats.chunks += len(texts)
+        stats.seconds += time.perf_counter() - start
+        return embeddings
@@ -0,0 +1,141 @@
+import os
+import re
+import math
+import heapq
+from array import array
+from collections import Counter
+
+# BM25 parameters
+LEXICAL_K1 = float(os.environ.get("LEXICAL_K1", 1.2))
+LEXICAL_B = float(os.environ.get("LEXICAL_B", 0.75))
+
+# Words, numbers and codes such as "t4-a", "err-1042" or "5.2.1"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+SEPARATOR_PATTERN = re.compile(r"[-_./:]")
+STOPWORDS = frozenset(
+    "a about an and are as at be been but by can could do does for from has have how i if in into is it its "
+    "me my not of on or our should so than that the their them then there these they this to was we were what "
+    "when where which while who why will with would you your".split()
+)
+
+
+def terms(text):
+    # Lowercased terms of a text. Codes are kept whole and also split into
+    # their parts, so "ERR-1042" is found by "err-1042" as well as by "1042"
+    result = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        result.append(token)
+        parts = SEPARATOR_PATTERN.split(token)
+        if len(parts) > 1:
+            result.extend(part for part in parts if part not in STOPWORDS)
+    return result
+
+
+class LexicalWriter:
+    # Collects the postings of one segment while its rows are written. Rows
+    # and term frequencies are kept in typed arrays, not lists of ints
+
+    def __init__(self):
+        self.postings = {}  # term -> (rows, term frequencies)
+        self.lengths = array("I")
+
+    def add(self, texts):
+        for text in texts:
+            row = len(self.lengths)
+            counts = Counter(terms(text))
+            self.lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings = self.postings.get(term)
+                if postings is None:
+                    postings = self.postings[term] = (array("I"), array("H"))
+                postings[0].append(row)
+                postings[1].append(min(count, 65535))
+
+    def write(self, path):
+        # One .npz of plain arrays (no pickles): the vocabulary as newline
+        # separated UTF-8, postings offsets per term, rows, term frequencies
+        # and the term count of every row
+        import numpy as np
+
+        vocabulary = sorted(self.postings)
+        rows = array("I")
+        frequencies = array("H")
+        offsets = [0]
+        for term in vocabulary:
+            rows.extend(self.postings[term][0])
+            frequencies.extend(self.postings[term][1])
+            offsets.append(len(rows))
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                vocabulary=np.frombuffer("\n".join(vocabulary).encode("utf-8"), dtype=np.uint8),
+                offsets=np.asarray(offsets, dtype=np.uint64),
+                rows=np.frombuffer(rows, dtype=np.uint32),
+                frequencies=np.frombuffer(frequencies, dtype=np.uint16),
+                lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+            )
+
+
+class LexicalSegment:
+    def __init__(self, path):
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as data:
+            vocabulary = data["vocabulary"].tobytes().decode("utf-8")
+            self.offsets = data["offsets"]
+            self.rows = data["rows"]
+            self.frequencies = data["frequencies"]
+            self.lengths = data["lengths"]
+        self.vocabulary = {term: i for i, term in enumerate(vocabulary.split("\n"))} if vocabulary else {}
+
+    @property
+    def nbytes(self):
+        return int(self.offsets.nbytes + self.rows.nbytes + self.frequencies.nbytes + self.lengths.nbytes)
+
+    def postings(self, term):
+        i = self.vocabulary.get(term)
+        if i is None:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.rows[start:end], self.frequencies[start:end]
+
+
+def search(segments, query, k, k1=LEXICAL_K1, b=LEXICAL_B):
+    # BM25 over [(base row, LexicalSegment, dead local rows)]. Returns
+    # [(score, row, coverage)] best first, coverage being the share of the
+    # query's IDF weight the row contains (1.0 = every query term). Document
+    # frequencies and lengths include tombstoned rows, which only shifts the
+    # weights slightly until the index is compacted
+    import numpy as np
+
+    query_terms = list(dict.fromkeys(terms(query)))
+    if not query_terms or not segments:
+        return []
+    count = sum(len(segment.lengths) for _, segment, _ in segments)
+    average_length = sum(float(segment.lengths.sum()) for _, segment, _ in segments) / (count or 1) or 1.0
+    frequencies = {term: sum(len(postings[0]) for _, segment, _ in segments if (postings := segment.postings(term)) is not None) for term in query_terms}
+    idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in frequencies.items()}
+    total_weight = sum(idf.values()) or 1.0
+
+    best = []
+    for base, segment, dead in segments:
+        scores = np.zeros(len(segment.lengths), dtype=np.float32)
+        weights = np.zeros(len(segment.lengths), dtype=np.float64)
+        for term in query_terms:
+            postings = segment.postings(term)
+            if postings is None:
+                continue
+            rows, tf = postings[0], postings[1].astype(np.float32)
+            norm = k1 * (1 - b + b * segment.lengths[rows] / average_length)
+            scores[rows] += idf[term] * tf * (k1 + 1) / (tf + norm)
+            weights[rows] += idf[term]
+        if len(dead):
+            scores[dead] = 0
+        hits = np.flatnonzero(scores)
+        if len(hits) > k:
+            hits = hits[np.argpartition(scores[hits], -k)[-k:]]
+        # Rounded, so a row with every term has a coverage of exactly 1.0
+        best.extend((float(scores[row]), base + int(row), round(float(weights[row]) / total_weight, 6)) for row in hits)
+    return heapq.nlargest(k, best)
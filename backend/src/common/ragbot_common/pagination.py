@@ -0,0 +1,32 @@
+import json
+import base64
+from decimal import Decimal
+
+
+def encode_cursor(last_evaluated_key):
+    if not last_evaluated_key:
+        return None
+    data = json.dumps(last_evaluated_key, default=lambda value: int(value) if isinstance(value, Decimal) else str(value))
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+
+
+def query_page(table, limit, cursor=None, **kwargs):
+    # One page of a query, at most limit items, plus an opaque cursor for the
+    # next page (None on the last one). DynamoDB may return fewer items than
+    # the limit (1 MB pages, filters), so pages are topped up until full.
+    items = []
+    start_key = decode_cursor(cursor)
+    while True:
+        if start_key:
+            kwargs["ExclusiveStartKey"] = start_key
+        response = table.query(Limit=limit - len(items), **kwargs)
+        items.extend(response["Items"])
+        start_key = response.get("LastEvaluatedKey")
+        if not start_key or len(items) >= limit:
+            return items, encode_cursor(start_key)
@@ -0,0 +1,77 @@
+import gzip
+import json
+import hashlib
+
+ARTIFACT_VERSION = 1
+ARTIFACT_NAME = "text.json.gz"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_pages(reader):
+    # Reads /Count from the page tree root instead of len(reader.pages),
+    # which flattens the tree and builds every page object
+    return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+
+def extract(path):
+    # Extracts every page with the same pypdf call PyPDFLoader uses. All page
+    # texts are concatenated and offsets[i] is where page i starts, so
+    # text[offsets[i]:offsets[i + 1]] is the text of page i
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    texts = []
+    offsets = []
+    position = 0
+    for page in reader.pages:
+        text = page.extract_text()
+        offsets.append(position)
+        texts.append(text)
+        position += len(text)
+
+    return {
+        "version": ARTIFACT_VERSION,
+        "sha256": file_sha256(path),
+        "pages": len(offsets),
+        "offsets": offsets,
+        "text": "".join(texts),
+    }
+
+
+def write_artifact(s3, bucket, key, artifact):
+    body = gzip.compress(json.dumps(artifact, separators=(",", ":")).encode("utf-8"))
+    s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/json", ContentEncoding="gzip")
+
+
+def read_artifact(s3, bucket, key):
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    artifact = json.loads(gzip.decompress(response["Body"].read()))
+    if artifact.get("version") != ARTIFACT_VERSION:
+        return None
+    return artifact
+
+
+def page_texts(artifact, first=0, last=None):
+    # Pages first up to (not including) last
+    text = artifact["text"]
+    offsets = artifact["offsets"] + [len(text)]
+    for page in range(first, artifact["pages"] if last is None else min(last, artifact["pages"])):
+        yield page, text[offsets[page] : offsets[page + 1]]
+
+
+def page_documents(artifact, source, first=0, last=None):
+    # Same documents PyPDFLoader.lazy_load yields, without parsing the PDF again
+    from langchain_core.documents import Document
+
+    for page, text in page_texts(artifact, first, last):
+        yield Document(page_content=text, metadata={"source": source, "page": page})
@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Payloads (events, answers, source documents) are logged in full only at
+# DEBUG, which POWERTOOLS_LOGGER_SAMPLE_RATE enables for a sample of
+# invocations; INFO lines carry them truncated to this many characters
+LOG_PAYLOAD_CHARS = int(os.environ.get("LOG_PAYLOAD_CHARS", 500))
+
+
+class StageTimer:
+    # Wall-clock time per named stage of one invocation. Stages entered from
+    # several threads at once (e.g. library shard searches) add up their time.
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.seconds = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def as_dict(self):
+        return {name: round(seconds * 1000, 1) for name, seconds in self.seconds.items()}
+
+    def emit(self, metrics, logger, **fields):
+        # One EMF metric per stage plus the total, and one summary log line
+        from aws_lambda_powertools.metrics import MetricUnit
+
+        total = time.perf_counter() - self.started
+        for name, seconds in self.seconds.items():
+            metrics.add_metric(name=metric_name(name), unit=MetricUnit.Milliseconds, value=seconds * 1000)
+        metrics.add_metric(name="TotalLatency", unit=MetricUnit.Milliseconds, value=total * 1000)
+        logger.info({"stages_ms": self.as_dict(), "total_ms": round(total * 1000, 1), **fields})
+
+
+# The timer of the invocation (or SQS record) in progress, so code deep in the
+# call stack can time itself without a timer being passed down. Threads that
+# started their own timer use it, all others the one started last
+local = threading.local()
+latest = StageTimer()
+
+
+def start():
+    global latest
+    latest = local.timer = StageTimer()
+    return latest
+
+
+def current():
+    return getattr(local, "timer", None) or latest
+
+
+def stage(name):
+    return current().stage(name)
+
+
+def metric_name(stage_name):
+    return "".join(part.capitalize() for part in stage_name.split("_")) + "Latency"
+
+
+def truncate(value, limit=LOG_PAYLOAD_CHARS):
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
+
+
+def stage_callbacks(condense_tag="condense"):
+    # Times retrieval and the LLM calls inside a LangChain chain. LLM calls made
+    # by a chain tagged condense_tag count as "condense", all others as "generation"
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class StageCallbacks(BaseCallbackHandler):
+        def __init__(self):
+            self.started = {}
+            self.condense_runs = set()
+
+        def on_chain_start(self, serialized, inputs, *, run_id, tags=None, **kwargs):
+            if tags and condense_tag in tags:
+                self.condense_runs.add(run_id)
+
+        def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+            self.started[run_id] = ("retrieval", time.perf_counter())
+
+        def on_retriever_end(self, documents, *, run_id, **kwargs):
+            self.end(run_id)
+
+        def on_retriever_error(self, error, *, run_id, **kwargs):
+            self.end(run_id)
+
+        def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+            self.started[run_id] = ("condense" if parent_run_id in self.condense_runs else "generation", time.perf_counter())
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            self.end(run_id)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self.end(run_id)
+
+        def end(self, run_id):
+            if run_id in self.started:
+                name, started = self.started.pop(run_id)
+                current().add(name, time.perf_counter() - started)
+
+    return StageCallbacks()
@@ -0,0 +1,563 @@
+import os
+import json
+import mmap
+import heapq
+from ragbot_common import lexical_index
+
+# On-disk layouts of a document index, selected with INDEX_FORMAT:
+#
+# "faiss"  - index.faiss + pickled docstore index.pkl, written by FAISS.save_local
+# "mapped" - pickle-free and memory-mapped on load:
+#            index.meta.json        format version, row count, dimensions, dtype,
+#                                   segments and tombstone count
+#            index[.seg].vectors    contiguous row-major float32/float16 block
+#            index[.seg].norms      float32 squared L2 norm of every row
+#            index[.seg].chunks     one UTF-8 JSON record {"text", "metadata"} per row
+#            index[.seg].offsets    uint64 byte offsets of the records, count + 1 entries
+#            index.tombstones       sorted uint64 rows that were deleted
+#            index[.seg].ann        optional FAISS HNSW or IVF-PQ index of the segment
+#            index[.seg].lexical    optional BM25 inverted index of the segment (.npz)
+#
+# A mapped index is a list of immutable segments. Rows are numbered across
+# segments in order; incremental updates append a segment and tombstone the
+# rows they replace, compaction rewrites the live rows into one new segment.
+INDEX_FORMAT = os.environ.get("INDEX_FORMAT", "mapped")
+INDEX_DTYPE = os.environ.get("INDEX_DTYPE", "float32")
+# Whether new segments get a lexical index for hybrid retrieval
+INDEX_LEXICAL = os.environ.get("INDEX_LEXICAL", "true").lower() == "true"
+
+# Search structure of a mapped segment. "auto" picks one from the segment's row
+# count: small segments are scanned exactly ("flat"), larger ones get an HNSW
+# graph and very large ones an IVF-PQ index. ANN candidates are always re-ranked
+# with exact distances against the mapped vectors.
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "auto")
+INDEX_HNSW_MIN_ROWS = int(os.environ.get("INDEX_HNSW_MIN_ROWS", 20000))
+INDEX_IVFPQ_MIN_ROWS = int(os.environ.get("INDEX_IVFPQ_MIN_ROWS", 200000))
+INDEX_HNSW_M = int(os.environ.get("INDEX_HNSW_M", 32))
+INDEX_HNSW_EF_CONSTRUCTION = int(os.environ.get("INDEX_HNSW_EF_CONSTRUCTION", 80))
+INDEX_HNSW_EF_SEARCH = int(os.environ.get("INDEX_HNSW_EF_SEARCH", 64))
+INDEX_IVF_NLIST = int(os.environ.get("INDEX_IVF_NLIST", 0))  # 0 = 4 * sqrt(rows)
+INDEX_IVF_NPROBE = int(os.environ.get("INDEX_IVF_NPROBE", 32))
+INDEX_PQ_M = int(os.environ.get("INDEX_PQ_M", 96))
+INDEX_PQ_BITS = int(os.environ.get("INDEX_PQ_BITS", 8))
+INDEX_ANN_CANDIDATES = int(os.environ.get("INDEX_ANN_CANDIDATES", 8))
+INDEX_ANN_TRAIN_ROWS = int(os.environ.get("INDEX_ANN_TRAIN_ROWS", 100000))
+
+MAPPED_VERSION = 1
+META_FILE = "index.meta.json"
+TOMBSTONES_FILE = "index.tombstones"
+SEARCH_BLOCK_ROWS = 8192
+
+
+def segment_file(directory, segment, part):
+    return os.path.join(directory, f"index.{segment}.{part}" if segment else f"index.{part}")
+
+
+def segments(meta):
+    # Indexes written before segments existed are a single unnamed segment
+    return meta.get("segments", [{"name": "", "count": meta["count"]}])
+
+
+def read_meta(directory):
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    if meta["version"] != MAPPED_VERSION:
+        raise ValueError(f"Unsupported index version {meta['version']}")
+    meta["segments"] = segments(meta)
+    meta.setdefault("tombstones", 0)
+    meta.setdefault("nextSegment", len(meta["segments"]))
+    return meta
+
+
+def write_meta(directory, meta):
+    with open(os.path.join(directory, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+
+def read_tombstones(directory, meta):
+    import numpy as np
+
+    if not meta.get("tombstones"):
+        return np.zeros(0, dtype=np.uint64)
+    return np.fromfile(os.path.join(directory, TOMBSTONES_FILE), dtype=np.uint64)
+
+
+def add_tombstones(directory, meta, rows):
+    import numpy as np
+
+    tombstones = np.union1d(read_tombstones(directory, meta), np.asarray(rows, dtype=np.uint64)).astype(np.uint64)
+    tombstones.tofile(os.path.join(directory, TOMBSTONES_FILE))
+    meta["tombstones"] = int(len(tombstones))
+    write_meta(directory, meta)
+
+
+def next_segment(meta):
+    name = f"s{meta['nextSegment']:04d}"
+    meta["nextSegment"] += 1
+    return name
+
+
+def live_records(directory, meta):
+    # Yields (row, record) for every row that is not tombstoned. Only needs the
+    # chunks and offsets files, not the vectors
+    import numpy as np
+
+    tombstones = set(read_tombstones(directory, meta).tolist())
+    base = 0
+    for segment in meta["segments"]:
+        offsets = np.fromfile(segment_file(directory, segment["name"], "offsets"), dtype=np.uint64)
+        with open(segment_file(directory, segment["name"], "chunks"), "rb") as f:
+            chunks = f.read()
+        for row in range(segment["count"]):
+            if base + row not in tombstones:
+                yield base + row, json.loads(chunks[int(offsets[row]) : int(offsets[row + 1])])
+        base += segment["count"]
+
+
+def segment_file_names(segment):
+    parts = ["vectors", "norms", "chunks", "offsets"] + (["ann"] if segment.get("ann") else []) + (["lexical"] if segment.get("lexical") else [])
+    return [os.path.basename(segment_file("", segment["name"], part)) for part in parts]
+
+
+def segment_files(meta):
+    # Every file name the index described by meta consists of
+    names = [META_FILE] + ([TOMBSTONES_FILE] if meta.get("tombstones") else [])
+    for segment in meta["segments"]:
+        names.extend(segment_file_names(segment))
+    return names
+
+
+def choose_index_type(rows, index_type=INDEX_TYPE):
+    if index_type != "auto":
+        return index_type
+    if rows >= INDEX_IVFPQ_MIN_ROWS:
+        return "ivfpq"
+    if rows >= INDEX_HNSW_MIN_ROWS:
+        return "hnsw"
+    return "flat"
+
+
+def needs_ann(meta, index_type=INDEX_TYPE):
+    # Whether the index is large enough for an ANN structure that none of its
+    # segments has, e.g. one merged from many small shard segments. Compacting
+    # it into one segment builds one
+    return choose_index_type(meta["count"], index_type) != "flat" and not any("ann" in segment for segment in segments(meta))
+
+
+def build_ann(path, vectors, index_type):
+    # Builds the ANN index of a segment from its mapped vectors and returns its
+    # parameters for the metadata, or None when the segment stays flat
+    import math
+    import faiss
+    import numpy as np
+
+    rows, dimensions = vectors.shape
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, INDEX_HNSW_M)
+        index.hnsw.efConstruction = INDEX_HNSW_EF_CONSTRUCTION
+        params = {"m": INDEX_HNSW_M, "efConstruction": INDEX_HNSW_EF_CONSTRUCTION}
+    elif index_type == "ivfpq":
+        nlist = min(INDEX_IVF_NLIST or int(4 * math.sqrt(rows)), rows // 39)
+        pq_m = max(m for m in range(1, INDEX_PQ_M + 1) if dimensions % m == 0)
+        # k-means needs a few dozen training rows per centroid
+        if nlist < 1 or rows < 39 * 2**INDEX_PQ_BITS:
+            return None
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimensions), dimensions, nlist, pq_m, INDEX_PQ_BITS)
+        sample = np.sort(np.random.default_rng(0).choice(rows, min(rows, INDEX_ANN_TRAIN_ROWS), replace=False))
+        index.train(np.asarray(vectors[sample], dtype=np.float32))
+        params = {"nlist": nlist, "m": pq_m, "bits": INDEX_PQ_BITS}
+    elif index_type == "flat":
+        return None
+    else:
+        raise ValueError(f"Unknown index type {index_type}")
+
+    for start in range(0, rows, SEARCH_BLOCK_ROWS):
+        index.add(np.asarray(vectors[start : start + SEARCH_BLOCK_ROWS], dtype=np.float32))
+    faiss.write_index(index, path)
+    return {"type": index_type, **params}
+
+
+class FaissIndexWriter:
+    def __init__(self, directory, embeddings):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.vectorstore = None
+        self.count = 0
+
+    def add(self, texts, vectors, metadatas):
+        from langchain_community.vectorstores import FAISS
+
+        text_embeddings = list(zip(texts, vectors))
+        if self.vectorstore is None:
+            self.vectorstore = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+        else:
+            self.vectorstore.add_embeddings(text_embeddings, metadatas=metadatas)
+        self.count += len(texts)
+
+    def close(self):
+        self.vectorstore.save_local(self.directory)
+
+
+class MappedIndexWriter:
+    # Writes one segment, appending rows batch by batch so a document never has
+    # to be held in memory whole. close() adds the segment to the given meta
+    # (an existing index being extended) or starts a new index.
+
+    def __init__(self, directory, dtype=INDEX_DTYPE, segment="", index_type=INDEX_TYPE, lexical=INDEX_LEXICAL):
+        import numpy as np
+
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.segment = segment
+        self.index_type = index_type
+        self.lexical = lexical_index.LexicalWriter() if lexical else None
+        self.dimensions = None
+        self.count = 0
+        self.offsets = [0]
+        self.norms_file = open(segment_file(directory, segment, "norms"), "wb")
+        self.vectors_file = open(segment_file(directory, segment, "vectors"), "wb")
+        self.chunks_file = open(segment_file(directory, segment, "chunks"), "wb")
+
+    def add(self, texts, vectors, metadatas):
+        import numpy as np
+
+        block = np.asarray(vectors, dtype=self.dtype)
+        if self.dimensions is None:
+            self.dimensions = block.shape[1]
+        self.vectors_file.write(np.ascontiguousarray(block).tobytes())
+        widened = block.astype(np.float32)
+        np.einsum("ij,ij->i", widened, widened).astype(np.float32).tofile(self.norms_file)
+
+        for text, metadata in zip(texts, metadatas):
+            record = json.dumps({"text": text, "metadata": metadata}, separators=(",", ":")).encode("utf-8")
+            self.chunks_file.write(record)
+            self.offsets.append(self.offsets[-1] + len(record))
+        if self.lexical:
+            self.lexical.add(texts)
+        self.count += len(texts)
+
+    def close(self, meta=None):
+        import numpy as np
+
+        self.vectors_file.close()
+        self.norms_file.close()
+        self.chunks_file.close()
+        np.asarray(self.offsets, dtype=np.uint64).tofile(segment_file(self.directory, self.segment, "offsets"))
+
+        entry = {"name": self.segment, "count": self.count}
+        if self.count:
+            vectors = np.memmap(segment_file(self.directory, self.segment, "vectors"), dtype=self.dtype, mode="r", shape=(self.count, self.dimensions))
+            ann = build_ann(segment_file(self.directory, self.segment, "ann"), vectors, choose_index_type(self.count, self.index_type))
+            if ann:
+                entry["ann"] = ann
+        if self.lexical:
+            self.lexical.write(segment_file(self.directory, self.segment, "lexical"))
+            entry["lexical"] = True
+
+        if meta is None:
+            meta = {"version": MAPPED_VERSION, "count": 0, "dimensions": self.dimensions, "dtype": self.dtype.name, "metric": "l2", "segments": [], "tombstones": 0, "nextSegment": 1}
+        meta["segments"].append(entry)
+        meta["count"] += self.count
+        meta["dimensions"] = meta["dimensions"] or self.dimensions
+        write_meta(self.directory, meta)
+        return meta
+
+
+def writer(directory, embeddings, index_format=INDEX_FORMAT):
+    if index_format == "faiss":
+        return FaissIndexWriter(directory, embeddings)
+    return MappedIndexWriter(directory)
+
+
+class MappedSegment:
+    def __init__(self, directory, meta, segment, base):
+        import numpy as np
+
+        self.base = base
+        self.count = segment["count"]
+        if self.count:
+            self.vectors = np.memmap(segment_file(directory, segment["name"], "vectors"), dtype=meta["dtype"], mode="r", shape=(self.count, meta["dimensions"]))
+            self.norms = np.memmap(segment_file(directory, segment["name"], "norms"), dtype=np.float32, mode="r", shape=(self.count,))
+        else:
+            # Empty files cannot be mapped
+            self.vectors = np.zeros((0, meta["dimensions"] or 0), dtype=meta["dtype"])
+            self.norms = np.zeros(0, dtype=np.float32)
+        self.offsets = np.memmap(segment_file(directory, segment["name"], "offsets"), dtype=np.uint64, mode="r")
+        with open(segment_file(directory, segment["name"], "chunks"), "rb") as f:
+            self.chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+        # The ANN index is read into memory; only the vectors stay mapped
+        self.ann = None
+        self.ann_bytes = 0
+        if segment.get("ann"):
+            import faiss
+
+            path = segment_file(directory, segment["name"], "ann")
+            self.ann = faiss.read_index(path)
+            self.ann_bytes = os.path.getsize(path)
+            if segment["ann"]["type"] == "hnsw":
+                self.ann.hnsw.efSearch = INDEX_HNSW_EF_SEARCH
+            else:
+                self.ann.nprobe = INDEX_IVF_NPROBE
+
+        self.lexical = lexical_index.LexicalSegment(segment_file(directory, segment["name"], "lexical")) if segment.get("lexical") else None
+
+    def record(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return json.loads(self.chunks[start:end])
+
+    def candidates(self, query, k):
+        # Yields (rows, local row ids) to score exactly: every row in blocks,
+        # or the rows the ANN index returns for the query
+        import numpy as np
+
+        if self.ann is None:
+            for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+                stop = min(self.count, start + SEARCH_BLOCK_ROWS)
+                yield slice(start, stop), np.arange(start, stop)
+            return
+
+        _, ids = self.ann.search(query.reshape(1, -1), min(self.count, k * INDEX_ANN_CANDIDATES))
+        ids = np.sort(ids[0][ids[0] >= 0])
+        yield ids, ids
+
+    def distances(self, query, query_norm, rows):
+        import numpy as np
+
+        block = np.asarray(self.vectors[rows], dtype=np.float32)
+        return np.maximum(self.norms[rows] - 2 * (block @ query) + query_norm, 0)
+
+
+class MappedIndex:
+    # Read side of the "mapped" format. Vectors and chunk records are
+    # memory-mapped, so loading only reads the metadata and a query only pages
+    # in the vector blocks and the records of the rows it returns.
+
+    def __init__(self, directory):
+        import numpy as np
+
+        self.meta = read_meta(directory)
+        self.count = self.meta["count"]
+        self.dimensions = self.meta["dimensions"]
+        self.segments = []
+        base = 0
+        for segment in self.meta["segments"] if not self.empty else []:
+            self.segments.append(MappedSegment(directory, self.meta, segment, base))
+            base += segment["count"]
+        self.tombstones = read_tombstones(directory, self.meta)
+        self.bases = np.asarray([segment.base for segment in self.segments], dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return int(sum(segment.offsets.nbytes + segment.ann_bytes + (segment.lexical.nbytes if segment.lexical else 0) for segment in self.segments) + self.tombstones.nbytes)
+
+    @property
+    def empty(self):
+        # A document without text is indexed with no rows and no dimensions
+        return self.count == 0 or self.dimensions is None
+
+    @property
+    def lexical(self):
+        # Hybrid retrieval needs every segment indexed, older ones are not
+        return bool(self.segments) and all(segment.lexical for segment in self.segments)
+
+    def segment_of(self, row):
+        import bisect
+
+        segment = self.segments[bisect.bisect_right(self.bases.tolist(), row) - 1]
+        return segment, row - segment.base
+
+    def record(self, row):
+        segment, local_row = self.segment_of(row)
+        return segment.record(local_row)
+
+    def vector(self, row):
+        segment, local_row = self.segment_of(row)
+        return segment.vectors[local_row]
+
+    def live_rows(self):
+        import numpy as np
+
+        return np.setdiff1d(np.arange(self.count, dtype=np.uint64), self.tombstones)
+
+    def search(self, query_vector, k):
+        # Squared-L2 search (the same scores as IndexFlatL2) as
+        # |v|^2 - 2 v.q + |q|^2, over every row of flat segments and over the
+        # ANN candidates of the others. Rows are scored in blocks so float16
+        # rows are widened a block at a time. Tombstoned rows never match
+        import numpy as np
+
+        if self.empty:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        query_norm = float(query @ query)
+        best = []
+        for segment in self.segments:
+            dead = self.tombstones[(self.tombstones >= segment.base) & (self.tombstones < segment.base + segment.count)].astype(np.int64) - segment.base
+            for rows, ids in segment.candidates(query, k + len(dead)):
+                distances = segment.distances(query, query_norm, rows)
+                if len(dead):
+                    distances[np.isin(ids, dead)] = np.inf
+                top = np.argpartition(distances, k - 1)[:k] if len(distances) > k else np.arange(len(distances))
+                best.extend((float(distances[i]), segment.base + int(ids[i])) for i in top if np.isfinite(distances[i]))
+        return heapq.nsmallest(k, best)
+
+
+    def lexical_search(self, query, k):
+        # [(BM25 score, row, coverage)] best first, tombstoned rows excluded
+        import numpy as np
+
+        if self.empty:
+            return []
+        segments = []
+        for segment in self.segments:
+            dead = self.tombstones[(self.tombstones >= segment.base) & (self.tombstones < segment.base + segment.count)].astype(np.int64) - segment.base
+            segments.append((segment.base, segment.lexical, dead))
+        return lexical_index.search(segments, query, k)
+
+
+def compact(source_directory, target_directory, block_rows=SEARCH_BLOCK_ROWS):
+    # Rewrites the live rows of an index into a single new segment. The segment
+    # gets a fresh name so its files never overwrite ones a reader may still use
+    import numpy as np
+
+    index = MappedIndex(source_directory)
+    meta = dict(index.meta)
+    output = MappedIndexWriter(target_directory, meta["dtype"], segment=next_segment(meta))
+    live = index.live_rows()
+    for start in range(0, len(live), block_rows):
+        rows = [int(row) for row in live[start : start + block_rows]]
+        records = [index.record(row) for row in rows]
+        output.add([record["text"] for record in records], np.stack([index.vector(row) for row in rows]), [record["metadata"] for record in records])
+
+    compacted = {**meta, "count": 0, "segments": [], "tombstones": 0}
+    return output.close(compacted)
+
+
+def mapped_vectorstore(directory, embeddings):
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import VectorStore
+
+    class MappedVectorStore(VectorStore):
+        def __init__(self, index, embedding):
+            self.index = index
+            self.embedding = embedding
+
+        @property
+        def embeddings(self):
+            return self.embedding
+
+        @property
+        def memory_bytes(self):
+            # Resident cost once loaded; the mapped files are paged in on demand
+            return self.index.nbytes
+
+        def _select_relevance_score_fn(self):
+            return self._euclidean_relevance_score_fn
+
+        def similarity_search_with_relevance_by_vector(self, embedding, k=4):
+            # Relevance is the cosine similarity, recovered from the squared L2
+            # distance and the stored norms. Unlike 1 - d / sqrt(2) it does not
+            # assume unit-length embeddings, which Titan does not return
+            import math
+
+            query_norm = sum(x * x for x in embedding)
+            results = []
+            for distance, row in self.index.search(embedding, k):
+                segment, local_row = self.index.segment_of(row)
+                row_norm = float(segment.norms[local_row])
+                cosine = (query_norm + row_norm - distance) / (2 * math.sqrt(query_norm * row_norm) or 1.0)
+                record = self.index.record(row)
+                results.append((Document(page_content=record["text"], metadata=record["metadata"]), cosine))
+            return results
+
+        def lexical_search(self, query, k=4):
+            # [(Document, BM25 score, coverage)], empty for indexes written
+            # before segments had a lexical index
+            if not self.index.lexical:
+                return []
+            results = []
+            for score, row, coverage in self.index.lexical_search(query, k):
+                record = self.index.record(row)
+                results.append((Document(page_content=record["text"], metadata=record["metadata"]), score, coverage))
+            return results
+
+        def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+            results = []
+            for distance, row in self.index.search(embedding, k):
+                record = self.index.record(row)
+                results.append((Document(page_content=record["text"], metadata=record["metadata"]), distance))
+            return results
+
+        def similarity_search_with_score(self, query, k=4, **kwargs):
+            return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+        def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+            return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+        def similarity_search(self, query, k=4, **kwargs):
+            return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+        def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+            return self.similarity_search_with_relevance_by_vector(self.embedding.embed_query(query), k)
+
+        def add_texts(self, texts, metadatas=None, **kwargs):
+            raise TypeError("Mapped indexes are read-only, write them with MappedIndexWriter")
+
+        @classmethod
+        def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+            raise TypeError("Mapped indexes are read-only, write them with MappedIndexWriter")
+
+    return MappedVectorStore(MappedIndex(directory), embeddings)
+
+
+def load(directory, embeddings):
+    # Picks the reader from the files present; mapped wins if both formats exist
+    if os.path.exists(os.path.join(directory, META_FILE)):
+        return mapped_vectorstore(directory, embeddings)
+
+    from langchain_community.vectorstores import FAISS
+
+    class CosineFAISS(FAISS):
+        # Relevance is the cosine similarity, as for mapped indexes; the stock
+        # 1 - d / sqrt(2) assumes unit-length embeddings, which Titan does not return
+        def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+            import numpy as np
+
+            query_vector = np.asarray([self._embed_query(query)], dtype=np.float32)
+            query_norm = float(np.linalg.norm(query_vector))
+            _, rows = self.index.search(query_vector, k)
+            results = []
+            for row in rows[0]:
+                if row < 0:
+                    continue
+                vector = self.index.reconstruct(int(row))
+                cosine = float(vector @ query_vector[0]) / (float(np.linalg.norm(vector)) * query_norm or 1.0)
+                results.append((self.docstore.search(self.index_to_docstore_id[int(row)]), cosine))
+            return results
+
+    return CosineFAISS.load_local(directory, embeddings)
+
+
+def convert_faiss(source_directory, target_directory, dtype=INDEX_DTYPE):
+    # Rewrites an index.faiss/index.pkl pair in the mapped format, keeping row order.
+    # Only run this on indexes we wrote ourselves: it unpickles index.pkl
+    import faiss
+    import pickle
+
+    index = faiss.read_index(os.path.join(source_directory, "index.faiss"))
+    with open(os.path.join(source_directory, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+
+    output = MappedIndexWriter(target_directory, dtype)
+    for start in range(0, index.ntotal, SEARCH_BLOCK_ROWS):
+        rows = range(start, min(index.ntotal, start + SEARCH_BLOCK_ROWS))
+        documents = [docstore.search(index_to_docstore_id[row]) for row in rows]
+        output.add(
+            [doc.page_content for doc in documents],
+            index.reconstruct_n(start, len(rows)),
+            [doc.metadata for doc in documents],
+        )
+    output.close()
+    return output.count
@@ -13,7 +13,8 @@ logger = Logger()
 @logger.inject_lambda_context(log_event=True)
 def handler(event, context):
     connection_id = event["requestContext"]["connectionId"]
+    user_id = event["requestContext"]["authorizer"]["userId"]
 
-    table.put_item(Item={"connectionId": connection_id})
+    table.put_item(Item={"connectionId": connection_id, "userId": user_id})
 
     return {}
@@ -2,38 +2,131 @@ import os
 import boto3
 import json
 from aws_lambda_powertools import Logger
+from ragbot_common import bedrock
+from ragbot_common.chat_history import delete_messages
+from ragbot_common.conversations import delete_conversations, page_conversations
+from ragbot_common.answer_cache import AnswerCache, remote_index_version
+from ragbot_common.embedding_cache import ContentOwners
 
 BUCKET_NAME = os.environ["BUCKET_NAME"]
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
 SESSION_TABLE = os.environ["SESSION_TABLE"]
+MESSAGE_TABLE = os.environ["MESSAGE_TABLE"]
+CONVERSATION_TABLE = os.environ["CONVERSATION_TABLE"]
+EMBEDDING_CACHE_TABLE = os.environ["EMBEDDING_CACHE_TABLE"]
+ANSWER_CACHE_TABLE = os.environ.get("ANSWER_CACHE_TABLE")
+# Documents at or above either size are cleaned up from the queue instead of in the API call
+CLEANUP_QUEUE_URL = os.environ.get("CLEANUP_QUEUE_URL")
+DELETE_ASYNC_MIN_PAGES = int(os.environ.get("DELETE_ASYNC_MIN_PAGES", 200))
+DELETE_ASYNC_MIN_CONVERSATIONS = int(os.environ.get("DELETE_ASYNC_MIN_CONVERSATIONS", 20))
+# Content-addressed index copies shared by every document with the same bytes, see generate_embeddings
+INDEX_CACHE_PREFIX = os.environ.get("INDEX_CACHE_PREFIX", "embedding-cache")
+# DeleteObjects removes at most 1000 keys per request
+DELETE_OBJECTS_BATCH = 1000
 
 s3 = boto3.client("s3")
+sqs = boto3.client("sqs")
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
 session_table = ddb.Table(SESSION_TABLE)
+message_table = ddb.Table(MESSAGE_TABLE)
+conversation_table = ddb.Table(CONVERSATION_TABLE)
+content_owners = ContentOwners(ddb.Table(EMBEDDING_CACHE_TABLE), bedrock.EMBEDDING_MODEL_ID)
+answer_cache = AnswerCache(ddb.Table(ANSWER_CACHE_TABLE)) if ANSWER_CACHE_TABLE else None
 
 logger = Logger()
 
+def delete_objects(prefix, keys=()):
+    # Every object under prefix (and keys), listed page by page and removed in batches
+    batch = list(keys)
+    deleted = 0
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        batch.extend(item["Key"] for item in page.get("Contents", []))
+        while len(batch) >= DELETE_OBJECTS_BATCH:
+            deleted += delete_batch(batch[:DELETE_OBJECTS_BATCH])
+            batch = batch[DELETE_OBJECTS_BATCH:]
+    if batch:
+        deleted += delete_batch(batch)
+    return deleted
+
+def delete_batch(keys):
+    response = s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True})
+    errors = response.get("Errors", [])
+    if errors:
+        raise RuntimeError(f"Failed to delete {len(errors)} objects, e.g. {errors[0]['Key']}: {errors[0]['Message']}")
+    return len(keys)
+
+def cleanup(user_id, document_id, file_name, conversation_ids, content_hash=None):
+    # Removes everything a document left behind once its item is gone: cached
+    # answers, conversations with their messages and legacy sessions, and all
+    # of its objects. The content-addressed copy of its index goes too unless
+    # another document has the same bytes; copies made for an earlier
+    # embedding model are left to the bucket's lifecycle rule. Safe to run
+    # again after a partial failure.
+    prefix = f"{user_id}/{file_name}"
+    if answer_cache:
+        version = remote_index_version(s3, BUCKET_NAME, prefix, bedrock.EMBEDDING_MODEL_ID, bedrock.LLM_MODEL_ID)
+        if version:
+            answer_cache.invalidate(version)
+
+    conversation_ids = set(conversation_ids) | set(delete_conversations(conversation_table, document_id))
+    with session_table.batch_writer() as batch:
+        for conversation_id in conversation_ids:
+            batch.delete_item(Key={"SessionId": conversation_id})
+    for conversation_id in conversation_ids:
+        delete_messages(message_table, conversation_id)
+
+    # The trailing slash keeps e.g. "guide.pdf.old" out of "guide.pdf"
+    objects = delete_objects(f"{prefix}/", [prefix])
+    if content_hash and not content_owners.remove(content_hash, f"{user_id}/{document_id}"):
+        objects += delete_objects(f"{INDEX_CACHE_PREFIX}/{bedrock.EMBEDDING_MODEL_ID}/{content_hash}/")
+    logger.info({"deleted": document_id, "conversations": len(conversation_ids), "objects": objects})
+
+def is_large(document):
+    if int(document.get("pages") or 0) >= DELETE_ASYNC_MIN_PAGES:
+        return True
+    _, more = page_conversations(conversation_table, document["documentId"], DELETE_ASYNC_MIN_CONVERSATIONS)
+    return more is not None
+
+def cleanup_records(event):
+    # Cleanup jobs queued by the API
+    for record in event["Records"]:
+        job = json.loads(record["body"])
+        cleanup(job["user"], job["documentId"], job["fileName"], job["conversationIds"], job.get("contentHash"))
+
 @logger.inject_lambda_context(log_event=True)
 def handler(event, context):
+    if "Records" in event:
+        return cleanup_records(event)
+
     event_body = json.loads(event["body"])
-    file_name = event_body["fileName"]
- 
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
     document_id = event["pathParameters"]["documentId"]
     conversation_id = event["pathParameters"]["conversationId"]
 
-    document_table.delete_item(Key={"userId": user_id, "documentId": document_id})
-    
-    session_table.delete_item(Key={"SessionId": conversation_id})
+    # The document disappears from the listing right away, the rest is cleaned up after
+    document = document_table.delete_item(Key={"userId": user_id, "documentId": document_id}, ReturnValues="ALL_OLD").get("Attributes", {})
+    file_name = document.get("filename", event_body["fileName"])
+    conversation_ids = [conversation_id] + [conversation["conversationId"] for conversation in document.get("conversations", [])]
+
+    job = {"user": user_id, "documentId": document_id, "fileName": file_name, "conversationIds": conversation_ids, "contentHash": document.get("contentHash")}
+    if CLEANUP_QUEUE_URL and is_large({"documentId": document_id, **document}):
+        sqs.send_message(QueueUrl=CLEANUP_QUEUE_URL, MessageBody=json.dumps(job))
+        status_code = 202
+    else:
+        try:
+            cleanup(user_id, document_id, file_name, conversation_ids, job["contentHash"])
+            status_code = 200
+        except Exception:
+            # The item is already gone, so nothing would find the leftovers again; the queue retries them
+            if not CLEANUP_QUEUE_URL:
+                raise
+            logger.exception({"cleanup": "queued after failure", "documentId": document_id})
+            sqs.send_message(QueueUrl=CLEANUP_QUEUE_URL, MessageBody=json.dumps(job))
+            status_code = 202
 
-    objects = s3.list_objects(Bucket=BUCKET_NAME, Prefix=f"{user_id}/{file_name}")
-    for item in objects.get("Contents"):
-        s3.delete_object(Bucket=BUCKET_NAME, Key=item["Key"])
-    s3.delete_object(Bucket=BUCKET_NAME, Key=f"{user_id}/{file_name}")
-    
     return {
-        "statusCode": 200,
+        "statusCode": status_code,
         "headers": {
             "Content-Type": "application/json",
             "Access-Control-Allow-Headers": "*",
@@ -44,6 +137,7 @@ def handler(event, context):
             {
                 "documentId": document_id,
                 "conversationId": conversation_id,
+                "cleanup": "queued" if status_code == 202 else "done",
             },
             default=str,
         ),
@@ -0,0 +1,55 @@
+import os
+import hashlib
+from ragbot_common import vector_index
+from pipeline import prefetch
+
+COMPACTION_TOMBSTONE_RATIO = float(os.environ.get("COMPACTION_TOMBSTONE_RATIO", 0.25))
+
+
+def chunk_key(text, metadata):
+    # The page is part of the key so kept rows never point at a stale page; chunks
+    # that only moved are re-added, but their embeddings come from the embedding cache
+    return hashlib.sha256(f"{metadata.get('page')}\0{text}".encode("utf-8")).hexdigest()
+
+
+def update_index(directory, meta, batches, embed):
+    # Diffs the new chunks against the live rows of an existing mapped index.
+    # Unchanged chunks keep their rows, new chunks are embedded into one new
+    # segment, and rows missing from the new content are tombstoned. Returns
+    # the updated meta and the names of the files that changed.
+    existing = {}
+    for row, record in vector_index.live_records(directory, meta):
+        existing.setdefault(chunk_key(record["text"], record["metadata"]), []).append(row)
+
+    writer = None
+    for batch in prefetch(batches):
+        new_chunks = []
+        for chunk in batch:
+            rows = existing.get(chunk_key(chunk.page_content, chunk.metadata))
+            if rows:
+                rows.pop()
+            else:
+                new_chunks.append(chunk)
+        if new_chunks:
+            writer = writer or vector_index.MappedIndexWriter(directory, meta["dtype"], segment=vector_index.next_segment(meta))
+            texts = [chunk.page_content for chunk in new_chunks]
+            writer.add(texts, embed(texts), [chunk.metadata for chunk in new_chunks])
+
+    changed = []
+    if writer:
+        meta = writer.close(meta)
+        changed.extend(vector_index.segment_file_names(meta["segments"][-1]))
+
+    removed = [row for rows in existing.values() for row in rows]
+    if removed:
+        vector_index.add_tombstones(directory, meta, removed)
+        changed.append(vector_index.TOMBSTONES_FILE)
+    else:
+        vector_index.write_meta(directory, meta)
+    # Metadata last, so readers only see the new segment once its files exist
+    changed.append(vector_index.META_FILE)
+    return meta, changed, (writer.count if writer else 0), len(removed)
+
+
+def needs_compaction(meta):
+    return meta["count"] and meta["tombstones"] / meta["count"] >= COMPACTION_TOMBSTONE_RATIO
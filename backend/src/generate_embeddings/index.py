@@ -1,21 +1,55 @@
 import os
 import boto3
 import json
-from langchain_community.embeddings import BedrockEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.indexes import VectorstoreIndexCreator
-from langchain_community.vectorstores import FAISS
-from aws_lambda_powertools import Logger
+import time
+import shutil
+import tempfile
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from ragbot_common import bedrock
+from ragbot_common.embedding_engine import EmbeddingStats
+from ragbot_common.embedding_cache import EmbeddingCache, ContentOwners
+from ragbot_common import pdf_text, telemetry, vector_index
+from ragbot_common.answer_cache import AnswerCache, remote_index_version
+from pipeline import chunk_batches, build_index, Centroid
+import incremental
+import shards
 
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
 BUCKET_NAME = os.environ["BUCKET_NAME"]
+EMBEDDING_CACHE_TABLE = os.environ["EMBEDDING_CACHE_TABLE"]
+INDEX_CACHE_PREFIX = os.environ.get("INDEX_CACHE_PREFIX", "embedding-cache")
+QUEUE_URL = os.environ.get("QUEUE_URL")
+ANSWER_CACHE_TABLE = os.environ.get("ANSWER_CACHE_TABLE")
+# Records of one SQS batch processed at once; they share the Bedrock concurrency limit
+EMBEDDING_RECORD_CONCURRENCY = int(os.environ.get("EMBEDDING_RECORD_CONCURRENCY", 2))
+# maxReceiveCount of the queue's redrive policy, the attempt after which a document is FAILED
+EMBEDDING_MAX_RECEIVE_COUNT = int(os.environ.get("EMBEDDING_MAX_RECEIVE_COUNT", 3))
+FAILURE_REASON_CHARS = 500
+# Records are not started with less time left than this; they go back to the queue
+EMBEDDING_RECORD_MIN_REMAINING_MS = int(os.environ.get("EMBEDDING_RECORD_MIN_REMAINING_MS", 60000))
+# A final attempt still running this long before the function times out marks its document FAILED
+EMBEDDING_DEADLINE_MARGIN_MS = int(os.environ.get("EMBEDDING_DEADLINE_MARGIN_MS", 10000))
+# Tag of index files a compaction replaced; the bucket's lifecycle rule expires
+# them a day later, so readers still on the previous metadata can fetch them
+SUPERSEDED_TAG = {"Key": "superseded", "Value": "true"}
 
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
+embedding_cache_table = ddb.Table(EMBEDDING_CACHE_TABLE)
+content_owners = ContentOwners(embedding_cache_table, bedrock.EMBEDDING_MODEL_ID)
+answer_cache = AnswerCache(ddb.Table(ANSWER_CACHE_TABLE)) if ANSWER_CACHE_TABLE else None
 
 s3 = boto3.client("s3")
+sqs = boto3.client("sqs")
 
 logger = Logger()
+metrics = Metrics(namespace=os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "RagBot"))
+
+bedrock.warm(bedrock.embeddings, bedrock.embedding_engine)
 
 def set_doc_status(user_id, document_id, status):
     document_table.update_item(
@@ -24,38 +58,550 @@ def set_doc_status(user_id, document_id, status):
         ExpressionAttributeValues={":docStatus": status},
     )
 
-@logger.inject_lambda_context(log_event=True)
+def set_doc_attributes(user_id, document_id, attributes):
+    # Returns the previous values of the attributes it replaced
+    response = document_table.update_item(
+        Key={"userId": user_id, "documentId": document_id},
+        UpdateExpression="SET " + ", ".join(f"#{name} = :{name}" for name in attributes),
+        ExpressionAttributeNames={f"#{name}": name for name in attributes},
+        ExpressionAttributeValues={f":{name}": value for name, value in attributes.items()},
+        ReturnValues="UPDATED_OLD",
+    )
+    return response.get("Attributes", {})
+
+def replace_content(user_id, document_id, previous_hash, content_hash):
+    # A re-uploaded document no longer shares its old bytes; their index copy
+    # goes with the last document that had them, as in delete_document
+    if previous_hash and previous_hash != content_hash and not content_owners.remove(previous_hash, f"{user_id}/{document_id}"):
+        delete_prefix(f"{content_index_prefix(previous_hash)}/")
+
+def set_doc_failed(user_id, document_id, reason):
+    # Documents deleted while they were processed are not written back
+    try:
+        document_table.update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression="SET docStatus = :docStatus, failureReason = :failureReason",
+            ConditionExpression="attribute_exists(documentId)",
+            ExpressionAttributeValues={":docStatus": "FAILED", ":failureReason": reason},
+        )
+    except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+def content_index_prefix(content_hash):
+    # Indexes of previously embedded files, shared by every upload with the same
+    # bytes. content_owners lists the documents that have them
+    return f"{INDEX_CACHE_PREFIX}/{bedrock.EMBEDDING_MODEL_ID}/{content_hash}"
+
+def index_files(prefix):
+    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix=f"{prefix}/index.")
+    return [item["Key"].split("/")[-1] for item in response.get("Contents", [])]
+
+def delete_index_files(prefix, keep):
+    stale = [file_name for file_name in index_files(prefix) if file_name not in keep]
+    if stale:
+        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": f"{prefix}/{file_name}"} for file_name in stale]})
+
+def retire_index_files(prefix, keep):
+    for file_name in index_files(prefix):
+        if file_name not in keep:
+            s3.put_object_tagging(Bucket=BUCKET_NAME, Key=f"{prefix}/{file_name}", Tagging={"TagSet": [SUPERSEDED_TAG]})
+
+def copy_index(source_prefix, target_prefix):
+    # The metadata is copied last, and files of an older index at the target
+    # (e.g. segments of a replaced document) are removed afterwards
+    file_names = sorted(index_files(source_prefix), key=lambda file_name: file_name == vector_index.META_FILE)
+    for file_name in file_names:
+        s3.copy_object(Bucket=BUCKET_NAME, Key=f"{target_prefix}/{file_name}", CopySource={"Bucket": BUCKET_NAME, "Key": f"{source_prefix}/{file_name}"})
+    if file_names:
+        delete_index_files(target_prefix, set(file_names))
+    return len(file_names)
+
+def download_index(prefix, directory, parts=None):
+    # Downloads a mapped index, optionally only the files ending in one of parts.
+    # Returns its metadata, or None if the document has no mapped index. Only
+    # files the metadata refers to are fetched, not superseded segments
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    if vector_index.META_FILE not in index_files(prefix):
+        return None
+    s3.download_file(BUCKET_NAME, f"{prefix}/{vector_index.META_FILE}", f"{directory}/{vector_index.META_FILE}")
+    meta = vector_index.read_meta(directory)
+    for file_name in vector_index.segment_files(meta):
+        if file_name != vector_index.META_FILE and (parts is None or file_name.split(".")[-1] in parts or file_name == vector_index.TOMBSTONES_FILE):
+            s3.download_file(BUCKET_NAME, f"{prefix}/{file_name}", f"{directory}/{file_name}")
+    return meta
+
+def upload_index(prefix, directory, file_names):
+    # Metadata last, so readers never see it before the files it refers to
+    for file_name in sorted(file_names, key=lambda file_name: file_name == vector_index.META_FILE):
+        s3.upload_file(f"{directory}/{file_name}", BUCKET_NAME, f"{prefix}/{file_name}")
+
+def index_version(prefix):
+    return remote_index_version(s3, BUCKET_NAME, prefix, bedrock.EMBEDDING_MODEL_ID, bedrock.LLM_MODEL_ID) if answer_cache else None
+
+def invalidate_answers(previous_version, prefix):
+    # Cached answers were produced from the replaced index
+    if previous_version and previous_version != index_version(prefix):
+        answer_cache.invalidate(previous_version)
+
+def read_json(key):
+    try:
+        return json.loads(s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def split_pages(pages):
+    # Same splitting as VectorstoreIndexCreator, but pages stream through
+    # splitting and concurrent embedding instead of being loaded up front.
+    # start_index (the chunk's position on its page) lets generate_response
+    # join chunks that follow each other
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return chunk_batches(pages, RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=0, add_start_index=True))
+
+def embedder(embedding_cache, stats):
+    timer = telemetry.current()
+
+    def embed(texts):
+        # Runs on the pipeline's embedding threads, so "embed" overlaps "pipeline"
+        with timer.stage("embed"):
+            return embedding_cache.embed(texts, bedrock.embedding_engine(), stats)
+
+    return embed
+
+def delete_prefix(prefix, keep=None):
+    # Every object under prefix except those under keep, in batches of 1000
+    stale = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        stale.extend(item["Key"] for item in page.get("Contents", []) if not (keep and item["Key"].startswith(keep)))
+    for start in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in stale[start : start + 1000]], "Quiet": True})
+
+def fan_out(event_body, content_hash, pages, previous_version):
+    # Queues one job per page range. A new run resets the checkpoints, the same
+    # run (a redelivered or repeated message) keeps the shards already done
+    user_id, document_id = event_body["user"], event_body["documentId"]
+    ranges = shards.page_ranges(pages)
+    run = shards.run_id(bedrock.EMBEDDING_MODEL_ID, content_hash, ranges)
+    try:
+        document_table.update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression="SET shardRun = :run, shardCount = :count REMOVE shardsDone",
+            ConditionExpression="attribute_exists(documentId) AND (attribute_not_exists(shardRun) OR shardRun <> :run)",
+            ExpressionAttributeValues={":run": run, ":count": len(ranges)},
+        )
+        # Partial indexes of runs that were replaced before they merged
+        prefix = f"{user_id}/{event_body['key'].split('/')[-1]}"
+        delete_prefix(f"{prefix}/shards/", keep=f"{prefix}/shards/{run}/")
+    except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+    jobs = [
+        {
+            "action": "shard",
+            "documentId": document_id,
+            "user": user_id,
+            "key": event_body["key"],
+            "textKey": event_body["textKey"],
+            "contentHash": content_hash,
+            "previousVersion": previous_version,
+            "run": run,
+            "shard": shard,
+            "shards": len(ranges),
+            "firstPage": first,
+            "lastPage": last,
+        }
+        for shard, (first, last) in enumerate(ranges)
+    ]
+    # SendMessageBatch takes at most 10 messages
+    for start in range(0, len(jobs), 10):
+        entries = [{"Id": str(job["shard"]), "MessageBody": json.dumps(job)} for job in jobs[start : start + 10]]
+        failed = sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=entries).get("Failed", [])
+        if failed:
+            raise RuntimeError(f"Failed to queue {len(failed)} shards, e.g. {failed[0]['Id']}: {failed[0].get('Message')}")
+    logger.info({"fanOut": document_id, "run": run, "shards": len(ranges), "pages": pages})
+
+def checkpoint_shard(user_id, document_id, run, shard):
+    # Returns the shards of the run done so far, or None when the run was
+    # replaced (re-upload) or finished, or the document deleted
+    try:
+        response = document_table.update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression="ADD shardsDone :shard",
+            ConditionExpression="shardRun = :run",
+            ExpressionAttributeValues={":shard": {shard}, ":run": run},
+            ReturnValues="UPDATED_NEW",
+        )
+    except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return response["Attributes"]["shardsDone"]
+
+def process_shard(event_body, work_dir):
+    # Builds the partial index of one page range under the run's prefix, then
+    # checkpoints it. Whichever shard completes the run merges them
+    user_id, document_id = event_body["user"], event_body["documentId"]
+    run, shard = event_body["run"], event_body["shard"]
+    file_name_full = event_body["key"].split("/")[-1]
+    prefix = f"{user_id}/{file_name_full}"
+    shard_prefix = shards.shard_prefix(prefix, run, shard)
+
+    with telemetry.stage("status"):
+        document = document_table.get_item(Key={"userId": user_id, "documentId": document_id}, ProjectionExpression="shardRun, shardsDone").get("Item")
+    if not document or document.get("shardRun") != run:
+        logger.info({"staleShard": shard, "run": run})
+        return "shard"
+
+    # A shard that finished before a failed checkpoint or merge is not rebuilt
+    if shard not in document.get("shardsDone", set()) and not read_json(f"{shard_prefix}/{shards.SUMMARY_FILE}"):
+        with telemetry.stage("text_read"):
+            artifact = pdf_text.read_artifact(s3, BUCKET_NAME, event_body["textKey"])
+            pages = pdf_text.page_documents(artifact, f"/tmp/{file_name_full}", event_body["firstPage"], event_body["lastPage"])
+
+        stats = EmbeddingStats()
+        embedding_cache = EmbeddingCache(embedding_cache_table, bedrock.EMBEDDING_MODEL_ID)
+        embed = embedder(embedding_cache, stats)
+        centroid = Centroid()
+        index_dir = f"{work_dir}/shard"
+        shutil.rmtree(index_dir, ignore_errors=True)
+        with telemetry.stage("pipeline"):
+            chunks = build_index(
+                split_pages(pages),
+                lambda texts: centroid.add(embed(texts)),
+                vector_index.MappedIndexWriter(index_dir, segment=shards.segment_name(shard)),
+            )
+        if chunks:
+            with open(f"{index_dir}/index.centroid", "wb") as f:
+                f.write(centroid.tobytes())
+        summary = {"chunks": chunks, "hits": embedding_cache.hits, "misses": embedding_cache.misses}
+        logger.info({"shard": shard, "pages": [event_body["firstPage"], event_body["lastPage"]], "embedding_stats": stats.as_dict(), **summary})
+
+        with telemetry.stage("upload"):
+            upload_index(shard_prefix, index_dir, os.listdir(index_dir))
+            s3.put_object(Bucket=BUCKET_NAME, Key=f"{shard_prefix}/{shards.SUMMARY_FILE}", Body=json.dumps(summary))
+            shutil.rmtree(index_dir, ignore_errors=True)
+
+    with telemetry.stage("status"):
+        done = checkpoint_shard(user_id, document_id, run, shard)
+    if done is None:
+        # The run was replaced while this shard was built, its files are not needed
+        delete_prefix(f"{shard_prefix}/")
+        return "shard"
+    if len(done) < event_body["shards"]:
+        return "shard"
+    with telemetry.stage("merge"):
+        merge_shards(event_body, prefix)
+    return "merge"
+
+def merge_shards(event_body, prefix):
+    # The shards' segments are copied into the document's index as they are and
+    # one metadata lists them all, so merging moves no vectors through the function
+    user_id, document_id, run = event_body["user"], event_body["documentId"], event_body["run"]
+    shard_prefixes = [shards.shard_prefix(prefix, run, shard) for shard in range(event_body["shards"])]
+    metas = [read_json(f"{shard_prefix}/{vector_index.META_FILE}") for shard_prefix in shard_prefixes]
+    summaries = [read_json(f"{shard_prefix}/{shards.SUMMARY_FILE}") for shard_prefix in shard_prefixes]
+
+    file_names = [vector_index.META_FILE]
+    centroids = []
+    for shard_prefix, meta in zip(shard_prefixes, metas):
+        for file_name in vector_index.segment_file_names(meta["segments"][0]):
+            s3.copy_object(Bucket=BUCKET_NAME, Key=f"{prefix}/{file_name}", CopySource={"Bucket": BUCKET_NAME, "Key": f"{shard_prefix}/{file_name}"})
+            file_names.append(file_name)
+        if meta["count"]:
+            centroids.append((s3.get_object(Bucket=BUCKET_NAME, Key=f"{shard_prefix}/index.centroid")["Body"].read(), meta["count"]))
+
+    meta = shards.merge_meta(metas)
+    # None when no shard had any text
+    centroid = shards.merge_centroids(centroids)
+    if centroid:
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}/index.centroid", Body=centroid)
+        file_names.append("index.centroid")
+    # Metadata last, then the files of a replaced index are removed
+    s3.put_object(Bucket=BUCKET_NAME, Key=f"{prefix}/{vector_index.META_FILE}", Body=json.dumps(meta))
+    delete_index_files(prefix, set(file_names))
+    copy_index(prefix, content_index_prefix(event_body["contentHash"]))
+
+    cache_stats = {"hits": sum(summary["hits"] for summary in summaries), "misses": sum(summary["misses"] for summary in summaries), "indexReused": False}
+    assignments = "docStatus = :docStatus, contentHash = :contentHash, embeddingCache = :embeddingCache"
+    removals = "shardRun, shardCount, shardsDone"
+    values = {":docStatus": "READY", ":contentHash": event_body["contentHash"], ":embeddingCache": cache_stats, ":run": run}
+    if centroid:
+        assignments += ", centroid = :centroid"
+        values[":centroid"] = centroid
+    else:
+        removals += ", centroid"
+    content_owners.add(event_body["contentHash"], f"{user_id}/{document_id}")
+    try:
+        previous = document_table.update_item(
+            Key={"userId": user_id, "documentId": document_id},
+            UpdateExpression=f"SET {assignments} REMOVE {removals}",
+            ConditionExpression="shardRun = :run",
+            ExpressionAttributeValues=values,
+            ReturnValues="UPDATED_OLD",
+        ).get("Attributes", {})
+    except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+        # A duplicate merge already finished the run
+        return
+    replace_content(user_id, document_id, previous.get("contentHash"), event_body["contentHash"])
+    invalidate_answers(event_body.get("previousVersion"), prefix)
+    # Every shard segment is below the ANN threshold, compaction rewrites them
+    # into one segment with an HNSW or IVF-PQ index over all the rows
+    if QUEUE_URL and vector_index.needs_ann(meta):
+        sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps({"action": "compact", "documentId": document_id, "user": user_id, "key": event_body["key"]}))
+
+    # The partial indexes are no longer needed
+    keys = [f"{shard_prefix}/{file_name}" for shard_prefix, meta in zip(shard_prefixes, metas) for file_name in vector_index.segment_file_names(meta["segments"][0]) + [vector_index.META_FILE, "index.centroid", shards.SUMMARY_FILE]]
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=BUCKET_NAME, Delete={"Objects": [{"Key": key} for key in keys[start : start + 1000]], "Quiet": True})
+    logger.info({"merged": document_id, "shards": len(metas), "count": meta["count"], "embedding_cache": cache_stats})
+
+def index_centroid(directory):
+    # Mean of the rows of a compacted (tombstone-free) mapped index, None if it has none
+    index = vector_index.MappedIndex(directory)
+    centroid = Centroid()
+    for segment in index.segments:
+        for start in range(0, segment.count, vector_index.SEARCH_BLOCK_ROWS):
+            centroid.add(segment.vectors[start : start + vector_index.SEARCH_BLOCK_ROWS])
+    return centroid.tobytes() if centroid.count else None
+
+def read_centroid(prefix):
+    try:
+        return s3.get_object(Bucket=BUCKET_NAME, Key=f"{prefix}/index.centroid")["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def compact_index(user_id, document_id, prefix, work_dir):
+    # Rewrites the live rows into one segment when the index has tombstones or
+    # is made of segments too small for the ANN index its size calls for
+    source_dir = f"{work_dir}/index"
+    target_dir = f"{work_dir}/compact"
+    meta = download_index(prefix, source_dir)
+    if not meta or not (meta["tombstones"] or vector_index.needs_ann(meta)):
+        return
+    previous_version = index_version(prefix)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    meta = vector_index.compact(source_dir, target_dir)
+    file_names = vector_index.segment_files(meta)
+    # The compacted index holds exactly the live rows, so its mean replaces the
+    # centroid that incremental updates only adjusted
+    centroid = index_centroid(target_dir)
+    if centroid:
+        with open(f"{target_dir}/index.centroid", "wb") as f:
+            f.write(centroid)
+        file_names.append("index.centroid")
+    upload_index(prefix, target_dir, file_names)
+    # New readers only see the compacted segment; the replaced files are kept
+    # for a while for readers that loaded the old metadata
+    retire_index_files(prefix, set(file_names))
+    invalidate_answers(previous_version, prefix)
+    if centroid:
+        try:
+            document_table.update_item(
+                Key={"userId": user_id, "documentId": document_id},
+                UpdateExpression="SET centroid = :centroid",
+                ConditionExpression="attribute_exists(documentId)",
+                ExpressionAttributeValues={":centroid": centroid},
+            )
+        except document_table.meta.client.exceptions.ConditionalCheckFailedException:
+            pass
+    shutil.rmtree(source_dir, ignore_errors=True)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    logger.info({"compacted": prefix, "count": meta["count"]})
+
+@metrics.log_metrics
+@logger.inject_lambda_context
 def handler(event, context):
-    event_body = json.loads(event["Records"][0]["body"])
+    # Every record of the batch, a few at a time; only the failed ones are
+    # reported back, so SQS retries those and deletes the rest. Records of the
+    # same document run one after the other, in queue order
+    logger.debug(event)
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000
+    documents = {}
+    for record in event["Records"]:
+        documents.setdefault(json.loads(record["body"]).get("documentId"), []).append(record)
+
+    def process_records(records):
+        return [message_id for record in records if (message_id := process_record(record, deadline))]
+
+    # Built before the record threads, so they all share its concurrency limit
+    bedrock.embedding_engine()
+    with ThreadPoolExecutor(max_workers=max(1, min(EMBEDDING_RECORD_CONCURRENCY, len(documents)))) as executor:
+        failures = [message_id for message_ids in executor.map(process_records, documents.values()) for message_id in message_ids]
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+def process_record(record, deadline):
+    # Returns the record's messageId if it failed or was not started
+    timer = telemetry.start()
+    event_body = json.loads(record["body"])
+    # Retried until the queue moves the message to its dead-letter queue, the
+    # last attempt marks the document as failed. A timeout ends the invocation
+    # without reaching the except block, so a watchdog does it just before
+    receive_count = int(record.get("attributes", {}).get("ApproximateReceiveCount", 1))
+    final = receive_count >= EMBEDDING_MAX_RECEIVE_COUNT and event_body.get("action") != "compact"
+
+    # A deferred final attempt would go to the dead-letter queue with its
+    # document still PROCESSING, so it runs anyway while the watchdog has time
+    remaining = deadline - time.monotonic()
+    if remaining * 1000 < (EMBEDDING_DEADLINE_MARGIN_MS if final else EMBEDDING_RECORD_MIN_REMAINING_MS):
+        logger.info({"documentId": event_body.get("documentId"), "deferred": "too little time left", "final": final})
+        if final:
+            set_doc_failed(event_body["user"], event_body["documentId"], "Timed out")
+        return record.get("messageId")
+    watchdog = None
+    if final:
+        watchdog = threading.Timer(max(0.0, remaining - EMBEDDING_DEADLINE_MARGIN_MS / 1000), set_doc_failed, (event_body["user"], event_body["documentId"], "Timed out"))
+        watchdog.daemon = True
+        watchdog.start()
+    # Each record has its own scratch directory, records of one batch may carry files of the same name
+    work_dir = tempfile.mkdtemp(prefix="record-")
+    try:
+        mode = process(event_body, work_dir)
+    except Exception as e:
+        logger.exception({"documentId": event_body.get("documentId"), "receiveCount": receive_count, "final": final})
+        metrics.add_metric(name="DocumentFailures", unit=MetricUnit.Count, value=1)
+        if final:
+            set_doc_failed(event_body["user"], event_body["documentId"], f"{type(e).__name__}: {e}"[:FAILURE_REASON_CHARS])
+        return record.get("messageId")
+    finally:
+        if watchdog:
+            watchdog.cancel()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    timer.emit(metrics, logger, documentId=event_body["documentId"], mode=mode)
+    return None
+
+def process(event_body, work_dir):
+    # Returns how the document was indexed: "compact", "reused", "incremental",
+    # "full", or for large documents "fan_out", then "shard" and "merge"
+    from langchain_community.document_loaders import PyPDFLoader
+
     document_id = event_body["documentId"]
     user_id = event_body["user"]
     key = event_body["key"]
     file_name_full = key.split("/")[-1]
 
-    set_doc_status(user_id, document_id, "PROCESSING")
+    if event_body.get("action") == "compact":
+        with telemetry.stage("compaction"):
+            compact_index(user_id, document_id, f"{user_id}/{file_name_full}", work_dir)
+        return "compact"
+    if event_body.get("action") == "shard":
+        return process_shard(event_body, work_dir)
 
-    s3.download_file(BUCKET_NAME, key, f"/tmp/{file_name_full}")
+    with telemetry.stage("status"):
+        set_doc_status(user_id, document_id, "PROCESSING")
+        previous_version = index_version(f"{user_id}/{file_name_full}")
 
-    loader = PyPDFLoader(f"/tmp/{file_name_full}")
+    # upload_trigger already extracted the text, the PDF is only parsed here for older uploads
+    with telemetry.stage("text_read"):
+        artifact = pdf_text.read_artifact(s3, BUCKET_NAME, event_body["textKey"]) if "textKey" in event_body else None
+        if artifact:
+            content_hash = artifact["sha256"]
+            pages = pdf_text.page_documents(artifact, f"/tmp/{file_name_full}")
+        else:
+            pdf_path = f"{work_dir}/{file_name_full}"
+            s3.download_file(BUCKET_NAME, key, pdf_path)
+            content_hash = pdf_text.file_sha256(pdf_path)
+            pages = PyPDFLoader(pdf_path).lazy_load()
 
-    bedrock_runtime = boto3.client(service_name="bedrock-runtime", region_name="us-east-1")
+    # A byte-identical file was embedded before, reuse its index without calling Bedrock
+    with telemetry.stage("content_cache"):
+        reused = copy_index(content_index_prefix(content_hash), f"{user_id}/{file_name_full}")
+    if reused:
+        logger.info({"index_cache": "hit", "contentHash": content_hash})
+        cache_stats = {"hits": 0, "misses": 0, "indexReused": True}
+        attributes = {"docStatus": "READY", "contentHash": content_hash, "embeddingCache": cache_stats}
+        try:
+            attributes["centroid"] = s3.get_object(Bucket=BUCKET_NAME, Key=f"{user_id}/{file_name_full}/index.centroid")["Body"].read()
+        except s3.exceptions.NoSuchKey:
+            pass
+        with telemetry.stage("status"):
+            content_owners.add(content_hash, f"{user_id}/{document_id}")
+            previous = set_doc_attributes(user_id, document_id, attributes)
+            replace_content(user_id, document_id, previous.get("contentHash"), content_hash)
+            invalidate_answers(previous_version, f"{user_id}/{file_name_full}")
+        return "reused"
 
-    embeddings = BedrockEmbeddings(
-        model_id="amazon.titan-embed-text-v1", 
-        client=bedrock_runtime, 
-        region_name="us-east-1"
-    )
+    stats = EmbeddingStats()
+    embedding_cache = EmbeddingCache(embedding_cache_table, bedrock.EMBEDDING_MODEL_ID)
+    embed = embedder(embedding_cache, stats)
+    index_dir = f"{work_dir}/index"
+    centroid = Centroid()
 
-    index_creator = VectorstoreIndexCreator(
-        vectorstore_cls=FAISS, 
-        embedding=embeddings
-    )
+    # A re-uploaded document only embeds its changed chunks into a new segment
+    # and tombstones the removed ones, instead of rebuilding the whole index
+    with telemetry.stage("index_download"):
+        meta = download_index(f"{user_id}/{file_name_full}", index_dir, parts={"chunks", "offsets"}) if event_body.get("incremental") else None
+    if meta:
+        live = meta["count"] - meta["tombstones"]
+        with telemetry.stage("pipeline"):
+            meta, changed, added, removed = incremental.update_index(index_dir, meta, split_pages(pages), lambda texts: centroid.add(embed(texts)))
+        cache_stats = {"hits": embedding_cache.hits, "misses": embedding_cache.misses, "indexReused": False}
+        logger.info({"added": added, "removed": removed, "embedding_stats": stats.as_dict(), "embedding_cache": cache_stats, "index": meta})
+        attributes = {"docStatus": "READY", "contentHash": content_hash, "embeddingCache": cache_stats}
+
+        # The kept rows count with the previous mean (the removed rows' vectors
+        # are not downloaded), compaction recomputes it from the live rows
+        previous = read_centroid(f"{user_id}/{file_name_full}")
+        if previous and (added or removed):
+            centroid.include(previous, live - removed)
+            if centroid.count:
+                attributes["centroid"] = centroid.tobytes()
+                with open(f"{index_dir}/index.centroid", "wb") as f:
+                    f.write(attributes["centroid"])
+                changed.insert(0, "index.centroid")
 
-    index_from_loader = index_creator.from_loaders([loader])
+        with telemetry.stage("upload"):
+            upload_index(f"{user_id}/{file_name_full}", index_dir, changed)
+            shutil.rmtree(index_dir, ignore_errors=True)
+            copy_index(f"{user_id}/{file_name_full}", content_index_prefix(content_hash))
+        with telemetry.stage("status"):
+            content_owners.add(content_hash, f"{user_id}/{document_id}")
+            previous = set_doc_attributes(user_id, document_id, attributes)
+            replace_content(user_id, document_id, previous.get("contentHash"), content_hash)
+            invalidate_answers(previous_version, f"{user_id}/{file_name_full}")
 
-    index_from_loader.vectorstore.save_local("/tmp")
+        if QUEUE_URL and incremental.needs_compaction(meta):
+            sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps({"action": "compact", "documentId": document_id, "user": user_id, "key": key}))
+        return "incremental"
+
+    # Too large for one invocation, page ranges are indexed by separate jobs
+    if artifact and QUEUE_URL and shards.fan_out(artifact["pages"]):
+        with telemetry.stage("fan_out"):
+            fan_out(event_body, content_hash, artifact["pages"], previous_version)
+        return "fan_out"
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    with telemetry.stage("pipeline"):
+        chunks = build_index(
+            split_pages(pages),
+            lambda texts: centroid.add(embed(texts)),
+            vector_index.writer(index_dir, bedrock.embeddings()),
+        )
+    # A document without text has no centroid and is only searched unscored
+    if chunks:
+        with open(f"{index_dir}/index.centroid", "wb") as f:
+            f.write(centroid.tobytes())
+    cache_stats = {"hits": embedding_cache.hits, "misses": embedding_cache.misses, "indexReused": False}
+    logger.info(
+        {
+            "chunks": chunks,
+            "embedding_stats": stats.as_dict(),
+            "embedding_cache": cache_stats,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+        }
+    )
 
-    s3.upload_file("/tmp/index.faiss", BUCKET_NAME, f"{user_id}/{file_name_full}/index.faiss")
-    s3.upload_file("/tmp/index.pkl", BUCKET_NAME, f"{user_id}/{file_name_full}/index.pkl")
+    with telemetry.stage("upload"):
+        upload_index(f"{user_id}/{file_name_full}", index_dir, os.listdir(index_dir))
+        # A full rebuild of a replaced document leaves no segments of the old index behind
+        delete_index_files(f"{user_id}/{file_name_full}", set(os.listdir(index_dir)))
+        shutil.rmtree(index_dir, ignore_errors=True)
+        copy_index(f"{user_id}/{file_name_full}", content_index_prefix(content_hash))
 
-    set_doc_status(user_id, document_id, "READY")
+    with telemetry.stage("status"):
+        attributes = {"docStatus": "READY", "contentHash": content_hash, "embeddingCache": cache_stats}
+        if chunks:
+            attributes["centroid"] = centroid.tobytes()
+        content_owners.add(content_hash, f"{user_id}/{document_id}")
+        previous = set_doc_attributes(user_id, document_id, attributes)
+        replace_content(user_id, document_id, previous.get("contentHash"), content_hash)
+        invalidate_answers(previous_version, f"{user_id}/{file_name_full}")
+    return "full"
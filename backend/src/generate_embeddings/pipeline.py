@@ -0,0 +1,95 @@
+import os
+import queue
+import threading
+
+PIPELINE_BATCH_CHUNKS = int(os.environ.get("PIPELINE_BATCH_CHUNKS", 32))
+PIPELINE_QUEUE_BATCHES = int(os.environ.get("PIPELINE_QUEUE_BATCHES", 4))
+
+_DONE = object()
+
+
+def prefetch(iterable, maxsize=PIPELINE_QUEUE_BATCHES):
+    # Runs the iterable on a background thread, handing items over through a
+    # bounded queue so the producer never gets more than maxsize items ahead
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put(item)
+            items.put(_DONE)
+        except BaseException as e:
+            items.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # Unblock a producer waiting on a full queue
+        while not items.empty():
+            items.get_nowait()
+
+
+def chunk_batches(pages, text_splitter, batch_size=PIPELINE_BATCH_CHUNKS):
+    # Splits pages as they are extracted and yields lists of at most batch_size chunks
+    batch = []
+    for page in pages:
+        for chunk in text_splitter.split_documents([page]):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+class Centroid:
+    # Running mean of a document's chunk vectors, used to route library-wide
+    # questions to the documents most likely to answer them
+
+    def __init__(self):
+        self.total = None
+        self.count = 0
+
+    def add(self, vectors):
+        import numpy as np
+
+        block = np.asarray(vectors, dtype=np.float64)
+        self.total = block.sum(axis=0) if self.total is None else self.total + block.sum(axis=0)
+        self.count += len(block)
+        return vectors
+
+    def include(self, centroid, count):
+        # Adds count vectors known only by their mean, e.g. the kept rows of an index
+        import numpy as np
+
+        if not count:
+            return
+        block = np.frombuffer(centroid, dtype=np.float32).astype(np.float64) * count
+        self.total = block if self.total is None else self.total + block
+        self.count += count
+
+    def tobytes(self):
+        import numpy as np
+
+        return (self.total / self.count).astype(np.float32).tobytes()
+
+
+def build_index(batches, embed, writer):
+    # Extraction and splitting run ahead on a background thread while the
+    # current batch is embedded; vectors are written to the index batch by batch
+    for batch in prefetch(batches):
+        texts = [chunk.page_content for chunk in batch]
+        writer.add(texts, embed(texts), [chunk.metadata for chunk in batch])
+    writer.close()
+    return writer.count
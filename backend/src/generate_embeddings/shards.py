@@ -0,0 +1,60 @@
+import os
+import hashlib
+from ragbot_common import vector_index
+
+# Documents with more pages are indexed in page ranges of this size, each by its
+# own queued job, and the partial indexes merged once all are done. 0 disables it
+EMBEDDING_SHARD_PAGES = int(os.environ.get("EMBEDDING_SHARD_PAGES", 100))
+SUMMARY_FILE = "shard.json"
+
+
+def fan_out(pages):
+    return EMBEDDING_SHARD_PAGES > 0 and pages > EMBEDDING_SHARD_PAGES and vector_index.INDEX_FORMAT == "mapped"
+
+
+def page_ranges(pages, size=EMBEDDING_SHARD_PAGES):
+    # [first, last) page of every shard
+    return [(first, min(pages, first + size)) for first in range(0, pages, size)]
+
+
+def run_id(model_id, content_hash, ranges):
+    # Same model, bytes and ranges give the same run, so a repeated fan-out
+    # resumes the shards that already finished instead of starting over
+    return hashlib.sha256(f"{model_id}\0{content_hash}\0{ranges}".encode("utf-8")).hexdigest()[:16]
+
+
+def shard_prefix(prefix, run, shard):
+    return f"{prefix}/shards/{run}/{shard:04d}"
+
+
+def segment_name(shard):
+    # Shards write differently named segments, so the merged index is their
+    # files side by side under one metadata and rows keep the page order
+    return f"s{shard + 1:04d}"
+
+
+def merge_meta(metas):
+    # Metadata of the index made of the single segment of every shard, in shard order
+    first = metas[0]
+    return {
+        "version": vector_index.MAPPED_VERSION,
+        "count": sum(meta["count"] for meta in metas),
+        "dimensions": next((meta["dimensions"] for meta in metas if meta["dimensions"]), None),
+        "dtype": first["dtype"],
+        "metric": first["metric"],
+        "segments": [segment for meta in metas for segment in meta["segments"]],
+        "tombstones": 0,
+        "nextSegment": len(metas) + 1,
+    }
+
+
+def merge_centroids(centroids):
+    # Mean of the shards' mean vectors, weighted by their chunk counts; None
+    # when no shard has any chunks
+    import numpy as np
+
+    chunks = sum(count for _, count in centroids)
+    if not chunks:
+        return None
+    total = sum(np.frombuffer(centroid, dtype=np.float32).astype(np.float64) * count for centroid, count in centroids if count)
+    return (total / chunks).astype(np.float32).tobytes()
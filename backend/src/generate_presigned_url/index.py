@@ -29,6 +29,8 @@ def handler(event, context):
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
     file_name_full = event["queryStringParameters"]["file_name"]
     file_name = file_name_full.split(".pdf")[0]
+    # Replacing uploads over the existing document, which is then re-indexed incrementally
+    replace = event["queryStringParameters"].get("replace", "false").lower() == "true"
 
     exists = key_exists(BUCKET_NAME, f"{user_id}/{file_name_full}/{file_name_full}")
 
@@ -38,10 +40,11 @@ def handler(event, context):
             "file_name_full": file_name_full,
             "file_name": file_name,
             "exists": exists,
+            "replace": replace,
         }
     )
 
-    if exists:
+    if exists and not replace:
         suffix = shortuuid.ShortUUID().random(length=4)
         key = f"{user_id}/{file_name}-{suffix}.pdf/{file_name}-{suffix}.pdf"
     else:
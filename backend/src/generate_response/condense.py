@@ -0,0 +1,67 @@
+import os
+import re
+import time
+from aws_lambda_powertools import Logger
+
+# "llm" condenses every follow-up question with CONDENSE_MODEL_ID. "heuristic"
+# first checks whether the follow-up already reads as a standalone question and
+# only calls the model for the ones that refer back to the conversation.
+CONDENSE_STRATEGY = os.environ.get("CONDENSE_STRATEGY", "llm")
+
+REFERRING_WORDS = {
+    "it", "its", "itself", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "him", "his", "she", "her", "hers", "one", "ones", "there", "above", "previous",
+    "former", "latter", "same", "such", "else", "again", "also", "another", "other", "more",
+}
+FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "what about", "how about", "then ", "why ", "why?", "ok", "okay")
+
+logger = Logger(child=True)
+
+
+def is_standalone(question):
+    # Long enough to carry its own subject, and nothing that points back at
+    # an earlier turn ("what about it", "and the second one?")
+    text = question.strip().lower()
+    words = re.findall(r"[a-z']+", text)
+    return len(words) >= 4 and not text.startswith(FOLLOW_UP_OPENERS) and not REFERRING_WORDS.intersection(words)
+
+
+def question_generator(llm_chain, strategy=CONDENSE_STRATEGY):
+    if strategy != "heuristic":
+        return llm_chain
+
+    from langchain.chains.llm import LLMChain
+
+    # ConversationalRetrievalChain only accepts an LLMChain as question generator
+    class HeuristicCondenseChain(LLMChain):
+        def _call(self, inputs, run_manager=None):
+            if is_standalone(inputs["question"]):
+                logger.info({"condense": "skipped"})
+                return {self.output_key: inputs["question"]}
+            return super()._call(inputs, run_manager)
+
+    return HeuristicCondenseChain(llm=llm_chain.llm, prompt=llm_chain.prompt, tags=llm_chain.tags)
+
+
+def llm_call_stats():
+    # Counts the LLM calls of one turn and their latency, to show what the
+    # first-turn and heuristic fast paths save
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMCallStats(BaseCallbackHandler):
+        def __init__(self):
+            self.calls = 0
+            self.seconds = 0.0
+            self.started = {}
+
+        def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+            self.started[run_id] = time.perf_counter()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            self.calls += 1
+            self.seconds += time.perf_counter() - self.started.pop(run_id, time.perf_counter())
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self.started.pop(run_id, None)
+
+    return LLMCallStats()
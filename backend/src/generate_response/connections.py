@@ -0,0 +1,47 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from aws_lambda_powertools import Logger
+
+CONNECTIONS_USER_INDEX = os.environ.get("CONNECTIONS_USER_INDEX", "userId-index")
+POST_CONCURRENCY = int(os.environ.get("POST_CONCURRENCY", 8))
+
+logger = Logger(child=True)
+
+executor = ThreadPoolExecutor(max_workers=POST_CONCURRENCY)
+
+
+def connection_user(table, connection_id):
+    # The user a connection was opened by, as stored by connect_websocket after
+    # the authorizer checked the token. None for unknown (e.g. pruned) connections
+    item = table.get_item(Key={"connectionId": connection_id}, ProjectionExpression="userId").get("Item")
+    return item["userId"] if item else None
+
+
+def user_connections(table, user_id):
+    connection_ids = []
+    kwargs = {"IndexName": CONNECTIONS_USER_INDEX, "KeyConditionExpression": Key("userId").eq(user_id)}
+    while True:
+        response = table.query(**kwargs)
+        connection_ids.extend(item["connectionId"] for item in response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return connection_ids
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def post(api, table, connection_id, data):
+    try:
+        api.post_to_connection(ConnectionId=connection_id, Data=data)
+        return True
+    except api.exceptions.GoneException:
+        logger.info(f"Pruning stale connectionId {connection_id}")
+        table.delete_item(Key={"connectionId": connection_id})
+    except Exception as e:
+        logger.error(f"Error sending message to connectionId {connection_id}: {e}")
+    return False
+
+
+def broadcast(api, table, connection_ids, data):
+    # Posts concurrently with a bounded pool; returns the connections that were reached
+    results = executor.map(lambda connection_id: post(api, table, connection_id, data), connection_ids)
+    return [connection_id for connection_id, ok in zip(connection_ids, results) if ok]
@@ -0,0 +1,123 @@
+import os
+import math
+from ragbot_common import telemetry
+from ragbot_common.chat_history import approximate_tokens
+from ragbot_common.lexical_index import terms
+
+# Budget of the retrieved text put into the answer prompt
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 1500))
+# MMR trade-off between retrieval rank (1.0) and novelty against the chunks already packed (0.0)
+CONTEXT_MMR_LAMBDA = float(os.environ.get("CONTEXT_MMR_LAMBDA", 0.7))
+# Chunks whose terms overlap an already packed one this much (Jaccard) are dropped
+CONTEXT_DUPLICATE_SIMILARITY = float(os.environ.get("CONTEXT_DUPLICATE_SIMILARITY", 0.8))
+# Shortest repeated text between the end of one chunk and the start of the next that counts as overlap
+CONTEXT_MIN_OVERLAP = int(os.environ.get("CONTEXT_MIN_OVERLAP", 20))
+
+
+def overlap(left, right, minimum=CONTEXT_MIN_OVERLAP):
+    # Length of the longest end of left that right starts with
+    for length in range(min(len(left), len(right)), minimum - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def join(block, doc):
+    # (text, start) of the block extended by doc when one contains the other or
+    # doc continues the block's text with an overlap, else None. Chunks that
+    # only sit next to each other stay apart, a guessed separator could splice
+    # words. Rows kept across a re-upload can carry stale start_index values,
+    # so positions only confirm an overlap found in the text
+    text, start = block["text"], block["start"]
+    other, other_start = doc.page_content, doc.metadata.get("start_index")
+    if other in text:
+        return text, start
+    if text in other:
+        # The block now spans doc, so later chunks are placed against its start
+        if other_start is None and start is not None:
+            other_start = start - other.index(text)
+        return other, other_start
+    length = overlap(text, other)
+    if not length:
+        return None
+    if start is not None and other_start is not None and other_start != start + len(text) - length:
+        return None
+    return text + other[length:], start
+
+
+def merge_chunks(documents):
+    # Groups the chunks of one page (in page order when their start_index is
+    # known) and joins the ones that repeat or continue each other. Returns
+    # blocks with the best retrieval rank of the chunks they contain
+    pages = {}
+    for rank, doc in enumerate(documents):
+        key = (doc.metadata.get("fileName") or doc.metadata.get("source"), doc.metadata.get("page"))
+        pages.setdefault(key, []).append((rank, doc))
+
+    blocks = []
+    for chunks in pages.values():
+        chunks.sort(key=lambda chunk: (chunk[1].metadata.get("start_index", math.inf), chunk[0]))
+        current = None
+        for rank, doc in chunks:
+            joined = join(current, doc) if current else None
+            if joined is None:
+                current = {"text": doc.page_content, "start": doc.metadata.get("start_index"), "rank": rank, "metadata": doc.metadata}
+                blocks.append(current)
+            else:
+                current["text"], current["start"] = joined
+                current["rank"] = min(current["rank"], rank)
+    return blocks
+
+
+def similarity(left, right):
+    return len(left & right) / (len(left | right) or 1)
+
+
+def pack(blocks, max_tokens=CONTEXT_MAX_TOKENS, mmr_lambda=CONTEXT_MMR_LAMBDA, duplicate=CONTEXT_DUPLICATE_SIMILARITY):
+    # Greedy MMR: the next block is the one best ranked by retrieval and least
+    # like the blocks already packed, until the token budget is spent. The
+    # best block always goes in, cut to the budget if it alone exceeds it
+    candidates = [{**block, "terms": set(terms(block["text"]))} for block in blocks]
+    ranks = max((block["rank"] for block in blocks), default=0) + 1
+    packed = []
+    tokens = 0
+    while candidates:
+        def redundancy(block):
+            return max((similarity(block["terms"], other["terms"]) for other in packed), default=0.0)
+
+        best = max(candidates, key=lambda block: mmr_lambda * (1 - block["rank"] / ranks) - (1 - mmr_lambda) * redundancy(block))
+        candidates.remove(best)
+        if packed and redundancy(best) >= duplicate:
+            continue
+        size = approximate_tokens(best["text"])
+        if tokens + size > max_tokens:
+            if packed:
+                continue
+            best["text"] = best["text"][: max_tokens * 4]
+            size = approximate_tokens(best["text"])
+        packed.append(best)
+        tokens += size
+    return packed
+
+
+def context_retriever(retriever, max_tokens=CONTEXT_MAX_TOKENS):
+    # Wraps the retriever the answer chain uses: the retrieved chunks are
+    # merged per page, deduplicated and packed to max_tokens before they are
+    # stuffed into the prompt. Token counts before and after are kept for metrics
+    from langchain_core.documents import Document
+    from langchain_core.retrievers import BaseRetriever
+
+    class ContextRetriever(BaseRetriever):
+        tokens_before: int = 0
+        tokens_after: int = 0
+
+        def _get_relevant_documents(self, query, *, run_manager):
+            # Not a child run, so retrieval is timed once by the stage callbacks
+            documents = retriever.invoke(query)
+            with telemetry.stage("context_packing"):
+                packed = pack(merge_chunks(documents), max_tokens)
+            self.tokens_before = sum(approximate_tokens(doc.page_content) for doc in documents)
+            self.tokens_after = sum(approximate_tokens(block["text"]) for block in packed)
+            return [Document(page_content=block["text"], metadata=block["metadata"]) for block in packed]
+
+    return ContextRetriever()
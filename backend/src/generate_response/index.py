@@ -1,54 +1,110 @@
 import os
 import boto3
 import json
-from langchain.llms.bedrock import Bedrock
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
-from langchain.memory import ConversationBufferMemory
-from langchain_community.embeddings import BedrockEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import ConversationalRetrievalChain
-from aws_lambda_powertools import Logger
+import time
+from functools import lru_cache
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from ragbot_common import bedrock, telemetry, vector_index
+from ragbot_common.answer_cache import AnswerCache, index_version
+from ragbot_common.chat_history import chat_history
+from vector_cache import VectorStoreCache
+from connections import connection_user, user_connections, broadcast
+from library import library_retriever
+from relevance import relevance_retriever, NOT_FOUND_MESSAGE
+from context import context_retriever
+from condense import question_generator as condense_question_generator, llm_call_stats
 
 BUCKET_NAME = os.environ["BUCKET_NAME"]
 SESSION_TABLE = os.environ["SESSION_TABLE"]
 TABLE_NAME = os.environ["TABLE_NAME"]
+DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
+MESSAGE_TABLE = os.environ["MESSAGE_TABLE"]
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "false").lower() == "true"
+# Answers to first questions on a document are cached when a table is configured
+ANSWER_CACHE_TABLE = os.environ.get("ANSWER_CACHE_TABLE")
 
 s3 = boto3.client("s3")
-ddb_client = boto3.client("dynamodb")
 ddb = boto3.resource("dynamodb")
 table = ddb.Table(TABLE_NAME)
+document_table = ddb.Table(DOCUMENT_TABLE)
+message_table = ddb.Table(MESSAGE_TABLE)
+session_table = ddb.Table(SESSION_TABLE)
+
+index_cache = VectorStoreCache(s3, BUCKET_NAME)
+answer_cache = AnswerCache(ddb.Table(ANSWER_CACHE_TABLE)) if ANSWER_CACHE_TABLE else None
 
 logger = Logger()
+metrics = Metrics(namespace=os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "RagBot"))
+
+@lru_cache(maxsize=None)
+def chain_components(streaming=False):
+    # The question generator and combine-documents chains only depend on the LLM,
+    # so they are built once per container; retriever and memory are per request.
+    # When streaming, only the answer LLM streams so condensed questions are not forwarded.
+    # The chain never condenses the first question of a conversation (there is
+    # no history to fold in), so a first turn is a single LLM call
+    from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+    from langchain.chains.llm import LLMChain
+    from langchain.chains.question_answering import load_qa_chain
+
+    question_generator = condense_question_generator(LLMChain(llm=bedrock.llm(model_id=bedrock.CONDENSE_MODEL_ID), prompt=CONDENSE_QUESTION_PROMPT, tags=["condense"]))
+    combine_docs_chain = load_qa_chain(bedrock.llm(streaming), chain_type="stuff")
+    return question_generator, combine_docs_chain
+
+def load_index(path):
+    return vector_index.load(path, bedrock.query_embeddings())
 
-@logger.inject_lambda_context(log_event=True)
+def sources(documents):
+    return [
+        {"fileName": doc.metadata.get("fileName"), "page": doc.metadata.get("page"), "content": doc.page_content[:200]}
+        for doc in documents
+    ]
+
+bedrock.warm(bedrock.query_embeddings, bedrock.llm, lambda: chain_components(STREAM_RESPONSES))
+
+@metrics.log_metrics
+@logger.inject_lambda_context
 def handler(event, context):
+    from langchain.memory import ConversationBufferMemory
+    from langchain.chains import ConversationalRetrievalChain
+
+    timer = telemetry.start()
+    logger.debug(event)
     event_body = json.loads(event["body"])
-    file_name = event_body["fileName"]
+    # scope "library" asks across all of the user's documents instead of fileName only
+    scope = event_body.get("scope", "document")
+    file_name = event_body.get("fileName")
     human_input = event_body["prompt"]
     conversation_id = event_body["conversationId"] #event["pathParameters"]["conversationId"]
-    user = event_body["userId"] #event["requestContext"]["authorizer"]["claims"]["sub"]
-    paginator = ddb_client.get_paginator("scan")
-    connectionIds = []
+    stream = event_body.get("stream", STREAM_RESPONSES)
 
     api_gateway_management_api = boto3.client(
         "apigatewaymanagementapi",
         endpoint_url= "https://" + event["requestContext"]["domainName"] + "/" + event["requestContext"]["stage"]
     )
 
-    # Extend connections
-    for page in paginator.paginate(TableName=TABLE_NAME):
-        connectionIds.extend(page["Items"])
-
-    s3.download_file(BUCKET_NAME, f"{user}/{file_name}/index.faiss", "/tmp/index.faiss")
-    s3.download_file(BUCKET_NAME, f"{user}/{file_name}/index.pkl", "/tmp/index.pkl")
+    # The asking user is the one the connection was authorized for, never a
+    # userId from the body, so answers and indexes stay with their owner
+    connection_id = event["requestContext"]["connectionId"]
+    with telemetry.stage("connections"):
+        user = (event["requestContext"].get("authorizer") or {}).get("userId") or connection_user(table, connection_id)
+        if not user:
+            logger.warning({"unknown_connection": connection_id})
+            return {"statusCode": 403, "body": json.dumps("Unknown connection")}
+        # Every open tab of the asking user, including the connection the question came from
+        connection_ids = user_connections(table, user)
+    if event["requestContext"]["connectionId"] not in connection_ids:
+        connection_ids.append(event["requestContext"]["connectionId"])
 
-    bedrock_runtime = boto3.client(service_name="bedrock-runtime", region_name="us-east-1")
+    if scope == "library":
+        retriever = library_retriever(index_cache, load_index, document_table, user, bedrock.query_embeddings())
+    else:
+        with telemetry.stage("index_load"):
+            retriever = relevance_retriever(index_cache.get(f"{user}/{file_name}", load_index))
 
-    embeddings = BedrockEmbeddings(model_id="amazon.titan-embed-text-v1", client=bedrock_runtime, region_name="us-east-1")
-    llm = Bedrock(model_id="anthropic.claude-v2", client=bedrock_runtime, region_name="us-east-1")
-    faiss_index = FAISS.load_local("/tmp", embeddings)
-
-    message_history = DynamoDBChatMessageHistory(table_name=SESSION_TABLE, session_id=conversation_id, primary_key_name='SessionId')
+    # Only the last turns (within a token budget) are loaded; each message is its own item
+    message_history = chat_history(message_table, conversation_id, session_table)
 
     memory = ConversationBufferMemory(
         memory_key="chat_history",
@@ -57,26 +113,122 @@ def handler(event, context):
         output_key="answer",
         return_messages=True,
     )
+    with telemetry.stage("history"):
+        first_turn = not message_history.messages
 
-    qa = ConversationalRetrievalChain.from_llm(
-        llm=llm,
-        retriever=faiss_index.as_retriever(),
-        memory=memory,
-        return_source_documents=True,
-    )
+    # A first question on a single document is standalone, so it can be answered
+    # from a cached answer to a similar question on the same index version. The
+    # lookup is keyed by the question's embedding, so it is skipped for
+    # questions the lexical index answers without one
+    cache_version = None
+    cached = None
+    not_found = False
+    lexical_only = False
+    cacheable = answer_cache and scope != "library" and first_turn and not retriever.confident(human_input)
+    etags = index_cache.etags(f"{user}/{file_name}") if cacheable else None
+    if etags:
+        started = time.perf_counter()
+        cache_version = index_version(etags, bedrock.EMBEDDING_MODEL_ID, bedrock.LLM_MODEL_ID)
+        question_vector = bedrock.query_embeddings().embed_query(human_input)
+        with telemetry.stage("answer_cache"):
+            cached = answer_cache.lookup(cache_version, question_vector)
+        lookup_ms = (time.perf_counter() - started) * 1000
+        metrics.add_metric(name="AnswerCacheHit", unit=MetricUnit.Count, value=1 if cached else 0)
+        if cached:
+            metrics.add_metric(name="AnswerCacheLatencySaved", unit=MetricUnit.Milliseconds, value=max(0.0, cached["latencyMs"] - lookup_ms))
+            logger.info({"answer_cache": "hit", "similarity": cached["similarity"], "cached_question": cached["question"]})
+
+    if cached:
+        memory.save_context({"question": human_input}, {"answer": cached["answer"]})
+        answer, answer_sources = cached["answer"], cached["sources"]
+    else:
+        question_generator, combine_docs_chain = chain_components(stream)
+        # Retrieved chunks are merged, deduplicated and packed to a token budget before the prompt
+        packing_retriever = context_retriever(retriever)
+        qa = ConversationalRetrievalChain(
+            question_generator=question_generator,
+            combine_docs_chain=combine_docs_chain,
+            retriever=packing_retriever,
+            memory=memory,
+            return_source_documents=True,
+            response_if_no_docs_found=NOT_FOUND_MESSAGE,
+        )
+
+        started = time.perf_counter()
+        llm_stats = llm_call_stats()
+        callbacks = [llm_stats, telemetry.stage_callbacks()]
+        if stream:
+            from streaming import WebSocketStreamHandler
 
-    res = qa.invoke({"question": human_input})
-    logger.info(res)
+            stream_handler = WebSocketStreamHandler(api_gateway_management_api, table, connection_ids, conversation_id)
+            try:
+                res = qa.invoke({"question": human_input}, config={"callbacks": [stream_handler, *callbacks]})
+            finally:
+                stream_handler.close()
+            logger.info(f"Streamed answer in {stream_handler.frames} frames")
+        else:
+            res = qa.invoke({"question": human_input}, config={"callbacks": callbacks})
+        logger.debug(res)
+        logger.info(
+            {
+                "question": telemetry.truncate(res.get("generated_question", human_input)),
+                "answer": telemetry.truncate(res["answer"]),
+                "source_documents": len(res["source_documents"]),
+                "context_tokens": [packing_retriever.tokens_before, packing_retriever.tokens_after],
+            }
+        )
 
-    for connectionId in connectionIds:
-        try:
-            logger.info("Sending message to connectionId: " + connectionId["connectionId"]["S"])
-            api_gateway_management_api.post_to_connection(
-                ConnectionId=connectionId["connectionId"]["S"],
-                Data=json.dumps({"message": res["answer"], "conversationId": conversation_id})
-            )
-        except Exception as e:
-             logger.error(f"Error sending message to connectionId {connectionId}: {e}")
+        metrics.add_metric(name="LLMCalls", unit=MetricUnit.Count, value=llm_stats.calls)
+        metrics.add_metric(name="LLMLatency", unit=MetricUnit.Milliseconds, value=llm_stats.seconds * 1000)
+        metrics.add_metric(name="ContextTokens", unit=MetricUnit.Count, value=packing_retriever.tokens_before)
+        metrics.add_metric(name="PackedContextTokens", unit=MetricUnit.Count, value=packing_retriever.tokens_after)
+
+        answer, answer_sources = res["answer"], sources(res["source_documents"])
+        # Nothing relevant was found and the LLM was skipped, the best partial matches go out as sources
+        not_found = not res["source_documents"]
+        metrics.add_metric(name="NotFoundEarlyExit", unit=MetricUnit.Count, value=1 if not_found else 0)
+        # Answered from the lexical index without embedding the question
+        lexical_only = getattr(retriever, "lexical_only", False)
+        if scope != "library":
+            metrics.add_metric(name="LexicalOnly", unit=MetricUnit.Count, value=1 if lexical_only else 0)
+        if not_found and scope != "library":
+            answer_sources = [
+                {**source, "relevance": round(score, 3)}
+                for source, (_, score) in zip(sources([doc for doc, _ in retriever.matches]), retriever.matches)
+            ]
+        if cache_version and not not_found:
+            answer_cache.put(cache_version, human_input, question_vector, answer, answer_sources, (time.perf_counter() - started) * 1000)
+
+    logger.info(f"Sending message to {len(connection_ids)} connections")
+    with telemetry.stage("post"):
+        broadcast(
+            api_gateway_management_api,
+            table,
+            connection_ids,
+            json.dumps(
+                {
+                    "type": "answer",
+                    "question": human_input,
+                    "message": answer,
+                    "sources": answer_sources,
+                    "conversationId": conversation_id,
+                    "cached": cached is not None,
+                    "notFound": not_found,
+                }
+            ),
+        )
+
+    timer.emit(
+        metrics,
+        logger,
+        scope=scope,
+        first_turn=first_turn,
+        cached=cached is not None,
+        not_found=not_found,
+        lexical_only=lexical_only,
+        llm_calls=0 if cached else llm_stats.calls,
+        connections=len(connection_ids),
+    )
 
     return {
         "statusCode": 200,
@@ -86,5 +238,5 @@ def handler(event, context):
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "*",
         },
-        "body": json.dumps(res["answer"]),
+        "body": json.dumps(answer),
     }
@@ -0,0 +1,84 @@
+import os
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from aws_lambda_powertools import Logger
+from ragbot_common import telemetry
+
+LIBRARY_MAX_SHARDS = int(os.environ.get("LIBRARY_MAX_SHARDS", 16))
+LIBRARY_SEARCH_CONCURRENCY = int(os.environ.get("LIBRARY_SEARCH_CONCURRENCY", 4))
+
+logger = Logger(child=True)
+
+executor = ThreadPoolExecutor(max_workers=LIBRARY_SEARCH_CONCURRENCY)
+
+
+def ready_documents(document_table, user_id):
+    documents = []
+    kwargs = {
+        "KeyConditionExpression": Key("userId").eq(user_id),
+        "ProjectionExpression": "filename, docStatus, centroid, created",
+    }
+    while True:
+        response = document_table.query(**kwargs)
+        documents.extend(item for item in response["Items"] if item.get("docStatus") == "READY")
+        if "LastEvaluatedKey" not in response:
+            return documents
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def route(documents, query_vector, max_shards=LIBRARY_MAX_SHARDS):
+    # Picks the documents whose centroid is closest (cosine) to the question, so
+    # only those indexes are fetched. Documents without a centroid (indexed
+    # before centroids existed) can not be ranked, the newest of them are
+    # searched first and the closest scored ones fill the rest of max_shards
+    import numpy as np
+
+    query = np.asarray(query_vector, dtype=np.float32)
+    query /= np.linalg.norm(query) or 1.0
+    scored, unscored = [], []
+    for document in documents:
+        if "centroid" not in document:
+            unscored.append(document)
+            continue
+        centroid = np.frombuffer(document["centroid"].value, dtype=np.float32)
+        scored.append((float(centroid @ query) / (float(np.linalg.norm(centroid)) or 1.0), document["filename"]))
+    unscored.sort(key=lambda document: document.get("created", ""), reverse=True)
+    if len(unscored) > max_shards:
+        logger.warning({"library_unscored_skipped": len(unscored) - max_shards})
+    unscored = unscored[:max_shards]
+    selected = [file_name for _, file_name in heapq.nlargest(max_shards - len(unscored), scored)]
+    return [document["filename"] for document in unscored] + selected
+
+
+def search(index_cache, loader, user_id, file_names, query_vector, k):
+    # Searches every shard concurrently with bounded parallelism and merges the
+    # per-shard top-k by distance. Shards are loaded through the index cache, so
+    # its memory budget bounds how many stay resident at once
+    def search_shard(file_name):
+        try:
+            store = index_cache.get(f"{user_id}/{file_name}", loader)
+        except FileNotFoundError:
+            return []
+        with telemetry.stage("shard_search"):
+            results = store.similarity_search_with_score_by_vector(query_vector, k=k)
+        for doc, _ in results:
+            doc.metadata["fileName"] = file_name
+        return results
+
+    shard_results = executor.map(search_shard, file_names)
+    return heapq.nsmallest(k, (result for results in shard_results for result in results), key=lambda result: float(result[1]))
+
+
+def library_retriever(index_cache, loader, document_table, user_id, embeddings, k=4):
+    from langchain_core.retrievers import BaseRetriever
+
+    class LibraryRetriever(BaseRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            query_vector = embeddings.embed_query(query)
+            with telemetry.stage("routing"):
+                file_names = route(ready_documents(document_table, user_id), query_vector)
+            logger.info({"library_shards": len(file_names)})
+            return [doc for doc, _ in search(index_cache, loader, user_id, file_names, query_vector, k)]
+
+    return LibraryRetriever()
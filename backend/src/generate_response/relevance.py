@@ -0,0 +1,80 @@
+import os
+from ragbot_common import telemetry
+
+RELEVANCE_THRESHOLD = float(os.environ.get("RELEVANCE_THRESHOLD", 0.7))
+NOT_FOUND_MESSAGE = os.environ.get("NOT_FOUND_MESSAGE", "I could not find anything about that in this document.")
+# Candidates taken from each ranking before they are fused
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 8))
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", 60))
+# The question is answered from the lexical matches alone, without embedding
+# it, when the best chunk contains every query term (coverage) and scores this
+# many times higher than the next one (margin)
+LEXICAL_CONFIDENT_COVERAGE = float(os.environ.get("LEXICAL_CONFIDENT_COVERAGE", 1.0))
+LEXICAL_CONFIDENT_MARGIN = float(os.environ.get("LEXICAL_CONFIDENT_MARGIN", 1.5))
+
+
+def confident(lexical):
+    if not lexical or lexical[0][2] < LEXICAL_CONFIDENT_COVERAGE:
+        return False
+    return len(lexical) == 1 or lexical[0][1] >= LEXICAL_CONFIDENT_MARGIN * lexical[1][1]
+
+
+def fuse(rankings, k, constant=HYBRID_RRF_K):
+    # Reciprocal rank fusion: a chunk ranked high by either list comes first
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = (doc.metadata.get("page"), doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (constant + rank + 1)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+
+def relevance_retriever(store, threshold=RELEVANCE_THRESHOLD, k=4):
+    # Same cut-off as notebook/imis_chroma.py: when even the best chunk scores
+    # below the threshold no documents are returned, so the chain answers with
+    # response_if_no_docs_found instead of calling the LLM. The scored matches
+    # of the last query are kept so the response can still show them.
+    # Stores with a lexical index are searched both ways and the rankings
+    # fused, so exact form names and codes are found even where embeddings
+    # miss them; a chunk matching every query term also passes the cut-off
+    from langchain_core.retrievers import BaseRetriever
+
+    class RelevanceRetriever(BaseRetriever):
+        matches: list = []
+        lexical_only: bool = False
+        lexical_query: str = ""
+        lexical: list = []
+
+        def lexical_search(self, query):
+            # Searched once per query, so checking confident() first costs no second search
+            if query != self.lexical_query:
+                self.lexical = []
+                if hasattr(store, "lexical_search"):
+                    with telemetry.stage("lexical_search"):
+                        self.lexical = store.lexical_search(query, k=HYBRID_CANDIDATES)
+                self.lexical_query = query
+            return self.lexical
+
+        def confident(self, query):
+            # Whether the query is answered from the lexical matches alone, without embedding it
+            return confident(self.lexical_search(query))
+
+        def _get_relevant_documents(self, query, *, run_manager):
+            lexical = self.lexical_search(query)
+            self.lexical_only = confident(lexical)
+            if self.lexical_only:
+                self.matches = [(doc, coverage) for doc, _, coverage in lexical[:k]]
+                return [doc for doc, _, _ in lexical[:k]]
+
+            self.matches = store.similarity_search_with_relevance_scores(query, k=HYBRID_CANDIDATES if lexical else k)
+            exact = lexical and lexical[0][2] >= LEXICAL_CONFIDENT_COVERAGE
+            if not exact and (not self.matches or self.matches[0][1] < threshold):
+                self.matches = self.matches[:k]
+                return []
+            if not lexical:
+                return [doc for doc, _ in self.matches]
+            return fuse([[doc for doc, _ in self.matches], [doc for doc, _, _ in lexical]], k)
+
+    return RelevanceRetriever()
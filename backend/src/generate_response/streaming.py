@@ -0,0 +1,56 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.callbacks import BaseCallbackHandler
+from connections import broadcast
+
+STREAM_FRAME_CHARS = int(os.environ.get("STREAM_FRAME_CHARS", 64))
+STREAM_FRAME_INTERVAL_MS = int(os.environ.get("STREAM_FRAME_INTERVAL_MS", 150))
+
+
+class WebSocketStreamHandler(BaseCallbackHandler):
+    # Forwards streamed LLM tokens to the caller's connections. Only the
+    # answer-generation LLM streams, so condensed questions are never sent.
+    # Tokens are coalesced into frames of STREAM_FRAME_CHARS characters or
+    # STREAM_FRAME_INTERVAL_MS milliseconds, whichever comes first, and posted
+    # in order from a single background thread so generation never waits on
+    # post_to_connection.
+
+    def __init__(self, api, table, connection_ids, conversation_id):
+        self.api = api
+        self.table = table
+        self.connection_ids = connection_ids
+        self.conversation_id = conversation_id
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.seq = 0
+        self.frames = 0
+        self.sender = ThreadPoolExecutor(max_workers=1)
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.buffer.append(token)
+        self.buffered_chars += len(token)
+        elapsed_ms = (time.monotonic() - self.last_flush) * 1000
+        if self.buffered_chars >= STREAM_FRAME_CHARS or elapsed_ms >= STREAM_FRAME_INTERVAL_MS:
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs):
+        self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        data = json.dumps({"type": "token", "seq": self.seq, "token": "".join(self.buffer), "conversationId": self.conversation_id})
+        self.sender.submit(broadcast, self.api, self.table, self.connection_ids, data)
+        self.buffer = []
+        self.buffered_chars = 0
+        self.last_flush = time.monotonic()
+        self.seq += 1
+        self.frames += 1
+
+    def close(self):
+        # Waits until every frame has been posted, so the final message is delivered last
+        self.flush()
+        self.sender.shutdown(wait=True)
@@ -0,0 +1,140 @@
+import os
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from aws_lambda_powertools import Logger
+from ragbot_common import telemetry, vector_index
+
+INDEX_CACHE_DIR = os.environ.get("INDEX_CACHE_DIR", "/tmp/indexes")
+INDEX_CACHE_MAX_MEMORY_BYTES = int(os.environ.get("INDEX_CACHE_MAX_MEMORY_BYTES", 768 * 1024 * 1024))
+INDEX_CACHE_MAX_DISK_BYTES = int(os.environ.get("INDEX_CACHE_MAX_DISK_BYTES", 384 * 1024 * 1024))
+
+logger = Logger(child=True)
+
+
+class VectorStoreCache:
+    # Keeps loaded vector stores in memory across warm invocations, keyed by
+    # "{user}/{file_name}". Index files live in one directory per document so
+    # documents never overwrite each other, and both the in-memory stores and
+    # the on-disk copies are evicted least-recently-used under a byte budget.
+    # Entries are revalidated against the S3 ETags of the index files.
+
+    def __init__(self, s3, bucket, cache_dir=INDEX_CACHE_DIR, max_memory_bytes=INDEX_CACHE_MAX_MEMORY_BYTES, max_disk_bytes=INDEX_CACHE_MAX_DISK_BYTES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()  # key -> (etags, size, store)
+        self.disk = OrderedDict()  # key -> (etags, size)
+        self.lock = threading.RLock()
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def local_dir(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+    def remote_etags(self, key):
+        response = self.s3.list_objects_v2(Bucket=self.bucket, Prefix=f"{key}/index.")
+        return {item["Key"].split("/")[-1]: item["ETag"] for item in response.get("Contents", [])}
+
+    def key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, loader):
+        with telemetry.stage("index_revalidate"):
+            etags = self.remote_etags(key)
+        if not etags:
+            raise FileNotFoundError(f"No index found for {key}")
+
+        # Different documents download and load in parallel, the same document only once
+        with self.key_lock(key):
+            with self.lock:
+                cached = self.memory.get(key)
+                if cached and cached[0] == etags:
+                    self.memory.move_to_end(key)
+                    self.disk.move_to_end(key)
+                    self.hits += 1
+                    logger.info({"index_cache": "hit", "key": key})
+                    return cached[2]
+
+                self.misses += 1
+                self.memory.pop(key, None)
+                on_disk = self.disk.pop(key, None)
+
+            local_dir = self.local_dir(key)
+            if not on_disk or on_disk[0] != etags or not os.path.isdir(local_dir):
+                with telemetry.stage("index_download"):
+                    size = self.download(key, etags, local_dir, on_disk[0] if on_disk else {})
+                logger.info({"index_cache": "miss", "key": key, "bytes": size})
+            else:
+                size = on_disk[1]
+                logger.info({"index_cache": "disk", "key": key, "bytes": size})
+
+            with telemetry.stage("index_open"):
+                store = loader(local_dir)
+            with self.lock:
+                self.disk[key] = (etags, size)
+                # Memory-mapped stores report their own resident size
+                self.memory[key] = (etags, getattr(store, "memory_bytes", size), store)
+                self.enforce_budget()
+            return store
+
+    def etags(self, key):
+        # ETags of the index files the store last returned by get() was loaded
+        # from, or the current ones in S3 if it has been evicted since
+        with self.lock:
+            cached = self.memory.get(key)
+        return cached[0] if cached else self.remote_etags(key)
+
+    def download(self, key, etags, local_dir, previous_etags):
+        # Files whose ETag did not change (e.g. the segments an incremental
+        # update left alone) are linked from the previous copy instead of downloaded
+        partial_dir = local_dir + ".partial"
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+
+        # Files a compaction retired are listed until they expire, only the ones
+        # the mapped metadata refers to are fetched. Legacy indexes have none
+        size = 0
+        wanted = None
+        for file_name in sorted(etags, key=lambda file_name: file_name != vector_index.META_FILE):
+            if wanted is not None and file_name not in wanted:
+                continue
+            path = os.path.join(partial_dir, file_name)
+            previous = os.path.join(local_dir, file_name)
+            if previous_etags.get(file_name) == etags[file_name] and os.path.exists(previous):
+                os.link(previous, path)
+            else:
+                self.s3.download_file(self.bucket, f"{key}/{file_name}", path)
+            size += os.path.getsize(path)
+            if file_name == vector_index.META_FILE:
+                wanted = set(vector_index.segment_files(vector_index.read_meta(partial_dir)))
+
+        shutil.rmtree(local_dir, ignore_errors=True)
+        os.replace(partial_dir, local_dir)
+        return size
+
+    def invalidate(self, key):
+        with self.lock:
+            self.memory.pop(key, None)
+            self.evict_disk(key)
+
+    def evict_disk(self, key):
+        self.disk.pop(key, None)
+        shutil.rmtree(self.local_dir(key), ignore_errors=True)
+
+    def enforce_budget(self):
+        # The most recently used entry is always kept, even if it alone exceeds the budget
+        while len(self.memory) > 1 and sum(entry[1] for entry in self.memory.values()) > self.max_memory_bytes:
+            key, _ = self.memory.popitem(last=False)
+            logger.info({"index_cache": "evict_memory", "key": key})
+
+        while len(self.disk) > 1 and sum(entry[1] for entry in self.disk.values()) > self.max_disk_bytes:
+            key = next(iter(self.disk))
+            self.memory.pop(key, None)
+            self.evict_disk(key)
+            logger.info({"index_cache": "evict_disk", "key": key})
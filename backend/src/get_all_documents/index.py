@@ -3,27 +3,80 @@ import boto3
 import json
 from boto3.dynamodb.conditions import Key
 from aws_lambda_powertools import Logger
+from ragbot_common.pagination import query_page
+from ragbot_common.documents import client_document
 
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
+# userId / created index projecting only the attributes of SUMMARY_ATTRIBUTES
+DOCUMENTS_CREATED_INDEX = os.environ.get("DOCUMENTS_CREATED_INDEX", "userId-created-index")
+DOCUMENTS_PAGE_SIZE = int(os.environ.get("DOCUMENTS_PAGE_SIZE", 50))
+# BatchGetItem reads at most 100 keys per call
+MAX_PAGE_SIZE = 100
+SUMMARY_ATTRIBUTES = ["documentId", "filename", "docStatus", "pages", "filesize", "created", "latestConversationId", "failureReason"]
 
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
 
 logger = Logger()
 
-@logger.inject_lambda_context(log_event=True)
+def batch_get(keys, projection=None):
+    # Items of keys in the order of keys; unprocessed keys are retried
+    request = {"Keys": keys}
+    if projection:
+        request["ProjectionExpression"] = ", ".join(f"#{name}" for name in projection)
+        request["ExpressionAttributeNames"] = {f"#{name}": name for name in projection}
+    items = {}
+    pending = {DOCUMENT_TABLE: request}
+    while pending:
+        response = ddb.batch_get_item(RequestItems=pending)
+        for item in response["Responses"].get(DOCUMENT_TABLE, []):
+            items[item["documentId"]] = item
+        pending = response.get("UnprocessedKeys")
+    return [items[key["documentId"]] for key in keys if key["documentId"] in items]
+
+def latest_conversation_id(conversations):
+    return max(conversations, key=lambda conv: conv["created"])["conversationId"] if conversations else None
+
+@logger.inject_lambda_context
 def handler(event, context):
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
+    # ?view=summary returns only what a document card shows, ?cursor= the next page
+    parameters = event.get("queryStringParameters") or {}
+    view = parameters.get("view", "full")
+    limit = min(int(parameters.get("limit", DOCUMENTS_PAGE_SIZE)), MAX_PAGE_SIZE)
+
+    # Newest first, ordered by the index instead of in memory
+    items, next_cursor = query_page(
+        document_table,
+        limit,
+        parameters.get("cursor"),
+        IndexName=DOCUMENTS_CREATED_INDEX,
+        KeyConditionExpression=Key("userId").eq(user_id),
+        ScanIndexForward=False,
+    )
+
+    if view == "summary":
+        # Documents written before latestConversationId existed link to their
+        # newest conversation. failureReason is not in the index's projection
+        # (a projection can't change once deployed), so failed documents read it too
+        missing = [item for item in items if "latestConversationId" not in item or item.get("docStatus") == "FAILED"]
+        if missing:
+            keys = [{"userId": user_id, "documentId": item["documentId"]} for item in missing]
+            details = {document["documentId"]: document for document in batch_get(keys, ["documentId", "conversations", "failureReason"])}
+            for item in missing:
+                document = details.get(item["documentId"], {})
+                if "latestConversationId" not in item:
+                    item["latestConversationId"] = latest_conversation_id(document.get("conversations"))
+                if "failureReason" in document:
+                    item["failureReason"] = document["failureReason"]
+        documents = [{name: item[name] for name in SUMMARY_ATTRIBUTES if name in item} for item in items]
+    else:
+        documents = [client_document(document) for document in batch_get([{"userId": user_id, "documentId": item["documentId"]} for item in items])]
+        for document in documents:
+            # Conversations are paged per document by get_conversations
+            document.pop("conversations", None)
 
-    response = document_table.query(KeyConditionExpression=Key("userId").eq(user_id))
-    
-    items = sorted(response["Items"], key=lambda item: item["created"], reverse=True)
-    
-    for item in items:
-        item["conversations"] = sorted(
-            item["conversations"], key=lambda conv: conv["created"], reverse=True
-        )
-    logger.info({"items": items})
+    logger.info({"view": view, "documents": len(documents), "more": next_cursor is not None})
 
     return {
         "statusCode": 200,
@@ -33,5 +86,5 @@ def handler(event, context):
             "Access-Control-Allow-Origin": "*",
             "Access-Control-Allow-Methods": "*",
         },
-        "body": json.dumps(items, default=str),
+        "body": json.dumps({"documents": documents, "nextCursor": next_cursor}, default=str),
     }
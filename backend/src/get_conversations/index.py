@@ -0,0 +1,45 @@
+import os
+import boto3
+import json
+from aws_lambda_powertools import Logger
+from ragbot_common.conversations import migrate_legacy, page_conversations
+
+DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
+CONVERSATION_TABLE = os.environ["CONVERSATION_TABLE"]
+CONVERSATIONS_PAGE_SIZE = int(os.environ.get("CONVERSATIONS_PAGE_SIZE", 50))
+
+ddb = boto3.resource("dynamodb")
+document_table = ddb.Table(DOCUMENT_TABLE)
+conversation_table = ddb.Table(CONVERSATION_TABLE)
+
+logger = Logger()
+
+@logger.inject_lambda_context
+def handler(event, context):
+    user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
+    document_id = event["pathParameters"]["documentId"]
+    # ?cursor= pages back through older conversations
+    parameters = event.get("queryStringParameters") or {}
+    limit = min(int(parameters.get("limit", CONVERSATIONS_PAGE_SIZE)), 100)
+
+    headers = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Headers": "*",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Methods": "*",
+    }
+
+    # Conversations are keyed by document only, the document item proves ownership
+    document = document_table.get_item(Key={"userId": user_id, "documentId": document_id}, ProjectionExpression="documentId, conversations").get("Item")
+    if not document:
+        return {"statusCode": 404, "headers": headers, "body": json.dumps({"message": "Document not found"})}
+    migrate_legacy(document_table, conversation_table, user_id, document)
+
+    conversations, next_cursor = page_conversations(conversation_table, document_id, limit, parameters.get("cursor"))
+    logger.info({"conversations": len(conversations), "more": next_cursor is not None})
+
+    return {
+        "statusCode": 200,
+        "headers": headers,
+        "body": json.dumps({"conversations": conversations, "nextCursor": next_cursor}),
+    }
@@ -3,13 +3,22 @@ import boto3
 import json
 from boto3.dynamodb.conditions import Key
 from aws_lambda_powertools import Logger
+from ragbot_common.chat_history import page_messages, legacy_messages
+from ragbot_common.conversations import migrate_legacy, page_conversations
+from ragbot_common.documents import client_document
 
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
 SESSION_TABLE = os.environ["SESSION_TABLE"]
+MESSAGE_TABLE = os.environ["MESSAGE_TABLE"]
+CONVERSATION_TABLE = os.environ["CONVERSATION_TABLE"]
+MESSAGES_PAGE_SIZE = int(os.environ.get("MESSAGES_PAGE_SIZE", 50))
+CONVERSATIONS_PAGE_SIZE = int(os.environ.get("CONVERSATIONS_PAGE_SIZE", 50))
 
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
 session_table = ddb.Table(SESSION_TABLE)
+message_table = ddb.Table(MESSAGE_TABLE)
+conversation_table = ddb.Table(CONVERSATION_TABLE)
 
 logger = Logger()
 
@@ -18,14 +27,20 @@ def handler(event, context):
     user_id = event["requestContext"]["authorizer"]["claims"]["sub"]
     document_id = event["pathParameters"]["documentId"]
     conversation_id = event["pathParameters"]["conversationId"]
+    # ?cursor= pages back through older messages
+    parameters = event.get("queryStringParameters") or {}
+    cursor = parameters.get("cursor")
+    limit = min(int(parameters.get("limit", MESSAGES_PAGE_SIZE)), 200)
 
     response = document_table.get_item(Key={"userId": user_id, "documentId": document_id})
-    document = response["Item"]
-    document["conversations"] = sorted(document["conversations"], key=lambda conv: conv["created"], reverse=True)
+    document = client_document(response["Item"])
+    migrate_legacy(document_table, conversation_table, user_id, document)
+    # The newest conversations; older ones are paged through GET /doc/{documentId}
+    document["conversations"], document["conversationsCursor"] = page_conversations(conversation_table, document_id, CONVERSATIONS_PAGE_SIZE)
 
-    response = session_table.get_item(Key={"SessionId": conversation_id})
-
-    messages = response["Item"]["History"]
+    messages, next_cursor = page_messages(message_table, conversation_id, limit, cursor)
+    if not messages and not cursor:
+        messages = legacy_messages(session_table, conversation_id)
 
     return {
         "statusCode": 200,
@@ -40,6 +55,7 @@ def handler(event, context):
                 "conversationId": conversation_id,
                 "document": document,
                 "messages": messages,
+                "nextCursor": next_cursor,
             },
             default=str,
         ),
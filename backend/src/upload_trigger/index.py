@@ -1,26 +1,42 @@
 import os
 import boto3
 import json
-import PyPDF2
 import shortuuid
 import urllib
 from datetime import datetime
+from boto3.dynamodb.conditions import Key, Attr
+from pypdf import PdfReader
 from aws_lambda_powertools import Logger
+from ragbot_common import pdf_text
+from ragbot_common.conversations import put_conversations
 
 DOCUMENT_TABLE = os.environ["DOCUMENT_TABLE"]
-SESSION_TABLE = os.environ["SESSION_TABLE"]
+CONVERSATION_TABLE = os.environ["CONVERSATION_TABLE"]
 QUEUE_URL = os.environ["QUEUE_URL"]
 BUCKET_NAME = os.environ["BUCKET_NAME"]
+# When enabled the text of every page is extracted once here and stored next
+# to the PDF for generate_embeddings, otherwise only the pages are counted
+EXTRACT_TEXT = os.environ.get("EXTRACT_TEXT", "true").lower() == "true"
 
 ddb = boto3.resource("dynamodb")
 document_table = ddb.Table(DOCUMENT_TABLE)
-session_table = ddb.Table(SESSION_TABLE)
+conversation_table = ddb.Table(CONVERSATION_TABLE)
 
 sqs = boto3.client("sqs")
 s3 = boto3.client("s3")
 
 logger = Logger()
 
+def find_document(user_id, file_name):
+    kwargs = {"KeyConditionExpression": Key("userId").eq(user_id), "FilterExpression": Attr("filename").eq(file_name), "ProjectionExpression": "documentId"}
+    while True:
+        response = document_table.query(**kwargs)
+        if response["Items"]:
+            return response["Items"][0]
+        if "LastEvaluatedKey" not in response:
+            return None
+        kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
 @logger.inject_lambda_context(log_event=True)
 def handler(event, context):
     key = urllib.parse.unquote_plus(event["Records"][0]["s3"]["object"]["key"])
@@ -28,18 +44,42 @@ def handler(event, context):
     user_id = split[0]
     file_name = split[1]
 
-    document_id = shortuuid.uuid()
+    existing = find_document(user_id, file_name)
 
     s3.download_file(BUCKET_NAME, key, f"/tmp/{file_name}")
 
-    with open(f"/tmp/{file_name}", "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        pages = str(len(reader.pages))
-
-    conversation_id = shortuuid.uuid()
+    text_key = f"{user_id}/{file_name}/{pdf_text.ARTIFACT_NAME}"
+    if EXTRACT_TEXT:
+        artifact = pdf_text.extract(f"/tmp/{file_name}")
+        pdf_text.write_artifact(s3, BUCKET_NAME, text_key, artifact)
+        pages = str(artifact["pages"])
+    else:
+        pages = str(pdf_text.count_pages(PdfReader(f"/tmp/{file_name}")))
 
     timestamp = datetime.utcnow()
     timestamp_str = timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    filesize = str(event["Records"][0]["s3"]["object"]["size"])
+
+    message = {
+        "key": key,
+        "user": user_id,
+    }
+    if EXTRACT_TEXT:
+        message["textKey"] = text_key
+
+    # A replaced file keeps its document and conversations, only the index is updated
+    if existing:
+        document_table.update_item(
+            Key={"userId": user_id, "documentId": existing["documentId"]},
+            UpdateExpression="SET pages = :pages, filesize = :filesize, docStatus = :docStatus, modified = :modified",
+            ExpressionAttributeValues={":pages": pages, ":filesize": filesize, ":docStatus": "UPLOADED", ":modified": timestamp_str},
+        )
+        message.update({"documentId": existing["documentId"], "incremental": True})
+        sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps(message))
+        return
+
+    document_id = shortuuid.uuid()
+    conversation_id = shortuuid.uuid()
 
     document = {
         "userId": user_id,
@@ -47,22 +87,13 @@ def handler(event, context):
         "filename": file_name,
         "created": timestamp_str,
         "pages": pages,
-        "filesize": str(event["Records"][0]["s3"]["object"]["size"]),
+        "filesize": filesize,
         "docStatus": "UPLOADED",
-        "conversations": [],
+        "latestConversationId": conversation_id,
     }
 
-    conversation = {"conversationId": conversation_id, "created": timestamp_str}
-    document["conversations"].append(conversation)
-
     document_table.put_item(Item=document)
+    put_conversations(conversation_table, user_id, document_id, [{"conversationId": conversation_id, "created": timestamp_str}])
 
-    conversation = {"SessionId": conversation_id, "History": []}
-    session_table.put_item(Item=conversation)
-
-    message = {
-        "documentId": document_id,
-        "key": key,
-        "user": user_id,
-    }
+    message["documentId"] = document_id
     sqs.send_message(QueueUrl=QUEUE_URL, MessageBody=json.dumps(message))
@@ -0,0 +1,70 @@
+import io
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "common"))
+
+from botocore.exceptions import ClientError
+from ragbot_common.embedding_engine import EmbeddingEngine
+
+
+class FakeClient:
+    # Throttles the first `throttles` calls and records the peak number of calls in flight
+    def __init__(self, throttles=0, latency=0.01):
+        self.throttles = throttles
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def invoke_model(self, body, modelId, accept, contentType):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+            throttled = self.throttles > 0
+            self.throttles -= throttled
+        try:
+            time.sleep(self.latency)
+            if throttled:
+                raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "InvokeModel")
+            return {"body": io.BytesIO(json.dumps({"embedding": [float(len(body))]}).encode())}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class EmbeddingEngineTest(unittest.TestCase):
+    def test_throttled_limit_carries_over_to_next_embed(self):
+        client = FakeClient(throttles=8)
+        engine = EmbeddingEngine(client, "model", max_concurrency=8, base_delay=0.001)
+        engine.embed([f"text {i}" for i in range(8)])
+        self.assertLess(engine.limiter.limit, 8)
+
+        # The next batch starts from the reduced limit; a fresh limiter would send all 8 at once
+        client.peak = 0
+        engine.embed([f"more {i}" for i in range(8)])
+        self.assertLess(client.peak, 8)
+
+    def test_concurrent_callers_share_the_limit(self):
+        client = FakeClient(latency=0.02)
+        engine = EmbeddingEngine(client, "model", max_concurrency=4)
+        threads = [threading.Thread(target=engine.embed, args=([f"{caller} {i}" for i in range(12)],)) for caller in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(client.peak, 4)
+
+    def test_results_keep_input_order(self):
+        engine = EmbeddingEngine(FakeClient(throttles=2, latency=0), "model", max_concurrency=4, base_delay=0.001)
+        texts = ["a" * n for n in range(1, 20)]
+        vectors = engine.embed(texts)
+        self.assertEqual(vectors, [[float(len(json.dumps({"inputText": text})))] for text in texts])
+
+
+if __name__ == "__main__":
+    unittest.main()
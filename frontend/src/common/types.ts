@@ -6,10 +6,13 @@ export interface Document {
   docStatus: string;
   created: string;
   pages: string;
-  conversations: {
+  latestConversationId?: string;
+  failureReason?: string;
+  conversations?: {
     conversationId: string;
     created: string;
   }[];
+  conversationsCursor?: string;
 }
 
 export interface Conversation {
@@ -23,4 +26,5 @@ export interface Conversation {
       additional_kwargs: {};
     };
   }[];
+  nextCursor?: string;
 }
@@ -1,23 +1,39 @@
 import DoubleArrowIcon from '@mui/icons-material/DoubleArrow';
 import CircularProgress from '@mui/material/CircularProgress';
-import { Box, TextField, Grid, IconButton, List, Typography } from '@mui/material';
+import { Box, Button, TextField, Grid, IconButton, List, Typography } from '@mui/material';
 import { Conversation } from '../common/types';
 import React from 'react';
 
 interface ChatMessagesProps {
   prompt: string;
+  partialAnswer: string;
   conversation: Conversation;
   isLoadingMessage: boolean;
   handlePromptChange: (event: React.ChangeEvent<HTMLInputElement>) => void;
   handleKeyPress: (event: React.KeyboardEvent<HTMLInputElement>) => void;
   submitMessage: (event: any) => Promise<void>;
+  loadEarlierMessages: () => Promise<void>;
 }
 
-const ChatMessages: React.FC<ChatMessagesProps> = ({ prompt, conversation, isLoadingMessage, submitMessage, handlePromptChange, handleKeyPress }) => {
+const ChatMessages: React.FC<ChatMessagesProps> = ({
+  prompt,
+  partialAnswer,
+  conversation,
+  isLoadingMessage,
+  submitMessage,
+  handlePromptChange,
+  handleKeyPress,
+  loadEarlierMessages,
+}) => {
   return (
     <Grid item={true} md={8}>
       <Box sx={{ display: 'flex', flexDirection: 'column', justifyContent: 'space-between', padding: '5px' }}>
         <List>
+          {conversation.nextCursor && (
+            <Button size='small' onClick={loadEarlierMessages} sx={{ marginBottom: 2 }}>
+              Load earlier messages
+            </Button>
+          )}
           {conversation.messages.map((message, i) => (
             <div key={i}>
               {message.type === 'ai' ? (
@@ -59,6 +75,26 @@ const ChatMessages: React.FC<ChatMessagesProps> = ({ prompt, conversation, isLoa
               )}
             </div>
           ))}
+          {isLoadingMessage && partialAnswer && (
+            <Typography
+              align='right'
+              sx={{
+                backgroundColor: '#1976d2',
+                borderTopLeftRadius: 30,
+                borderBottomLeftRadius: 30,
+                borderTopRightRadius: 30,
+                borderBottomRightRadius: 5,
+                padding: 2,
+                color: 'white',
+                width: '75%',
+                textAlign: 'right',
+                marginLeft: 'auto',
+                marginBottom: 2,
+              }}
+            >
+              {partialAnswer}
+            </Typography>
+          )}
           {isLoadingMessage && <CircularProgress size={40} sx={{ mt: 2 }} />}
         </List>
         <Box display='flex' alignItems='center'>
@@ -12,9 +12,18 @@ interface ChatSidebarProps {
   addConversation: () => Promise<void>;
   deleteDocument: () => Promise<void>;
   switchConversation: (e: React.MouseEvent<HTMLButtonElement>) => void;
+  loadEarlierConversations: () => Promise<void>;
 }
 
-const ChatSidebar: React.FC<ChatSidebarProps> = ({ conversation, params, addConversation, switchConversation, deleteDocument, isLoadingConversation }) => {
+const ChatSidebar: React.FC<ChatSidebarProps> = ({
+  conversation,
+  params,
+  addConversation,
+  switchConversation,
+  loadEarlierConversations,
+  deleteDocument,
+  isLoadingConversation,
+}) => {
   return (
     <Grid item={true} md={4}>
       <Box style={{ backgroundColor: '#f5f5f5', padding: '1rem' }}>
@@ -39,7 +48,7 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({ conversation, params, addConv
           Start a new conversation
         </Button>
         {conversation &&
-          conversation.document.conversations.map((conversation, i) => (
+          conversation.document.conversations?.map((conversation, i) => (
             <Box key={i}>
               <Button
                 id={conversation.conversationId}
@@ -62,6 +71,11 @@ const ChatSidebar: React.FC<ChatSidebarProps> = ({ conversation, params, addConv
               </Button>
             </Box>
           ))}
+        {conversation?.document.conversationsCursor && (
+          <Button onClick={loadEarlierConversations} variant='text' style={{ width: '100%', marginTop: '0.5rem' }}>
+            Show older conversations
+          </Button>
+        )}
         <Button
           disabled={isLoadingConversation}
           onClick={deleteDocument}
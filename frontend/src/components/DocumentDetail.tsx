@@ -6,6 +6,7 @@ import CloudIcon from '@mui/icons-material/Cloud';
 import RotateRightIcon from '@mui/icons-material/RotateRight';
 import CheckCircleIcon from '@mui/icons-material/CheckCircle';
 import ScheduleIcon from '@mui/icons-material/Schedule';
+import ErrorIcon from '@mui/icons-material/Error';
 import { Typography, Box, CardContent } from '@mui/material';
 import React from 'react';
 
@@ -79,6 +80,28 @@ const DocumentDetail: React.FC<Document> = (document: Document) => {
             </Box>
           </Box>
         )}
+        {document.docStatus === 'FAILED' && (
+          <Box sx={{ display: 'flex', justifyContent: 'center' }}>
+            <Box
+              title={document.failureReason}
+              sx={{
+                display: 'inline-flex',
+                alignItems: 'center',
+                backgroundColor: '#ffebee',
+                color: '#d32f2f',
+                fontSize: '0.75rem',
+                fontWeight: 'medium',
+                marginRight: 1,
+                px: 1.5,
+                py: 0.5,
+                borderRadius: 2,
+              }}
+            >
+              <ErrorIcon sx={{ width: 16, height: 16, marginRight: 1 }} />
+              Processing failed
+            </Box>
+          </Box>
+        )}
         <Box sx={{ display: 'flex', alignItems: 'center', mt: 2, mb: 1 }}>
           <InsertDriveFileIcon sx={{ width: 16, height: 16, mr: 1 }} />
           <Typography variant='body2'>{document.pages} pages</Typography>
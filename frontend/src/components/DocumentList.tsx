@@ -9,13 +9,30 @@ import { Loader } from '@aws-amplify/ui-react';
 
 const DocumentList: React.FC = () => {
   const [documents, setDocuments] = useState<Document[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setLoading] = useState<boolean>(false);
 
-  const fetchData = async () => {
+  const fetchPage = async (cursor?: string) => {
     setLoading(true);
-    const documents = await API.get('ragbot-api', '/doc', {});
+    const page = await API.get('ragbot-api', '/doc', {
+      queryStringParameters: { view: 'summary', ...(cursor ? { cursor } : {}) },
+    });
     setLoading(false);
-    setDocuments(documents);
+    return page;
+  };
+
+  const fetchData = async () => {
+    const page = await fetchPage();
+    setDocuments(page.documents);
+    setNextCursor(page.nextCursor);
+  };
+
+  const fetchMore = async () => {
+    if (!nextCursor) return;
+
+    const page = await fetchPage(nextCursor);
+    setDocuments([...documents, ...page.documents]);
+    setNextCursor(page.nextCursor);
   };
 
   useEffect(() => {
@@ -53,7 +70,7 @@ const DocumentList: React.FC = () => {
         {documents.map((document: Document) => (
           <Grid item xs={12} sm={6} md={4} key={document.documentId}>
             <Link
-              to={`/doc/${document.documentId}/${document.conversations[0].conversationId}/`}
+              to={`/doc/${document.documentId}/${document.latestConversationId}/`}
               style={{
                 display: 'block',
                 padding: '6px',
@@ -69,6 +86,13 @@ const DocumentList: React.FC = () => {
           </Grid>
         ))}
       </Grid>
+      {nextCursor && (
+        <Box style={{ display: 'flex', justifyContent: 'center', marginTop: '16px' }}>
+          <Button onClick={fetchMore} variant='outlined' color='primary' disabled={isLoading}>
+            Load more
+          </Button>
+        </Box>
+      )}
       {!isLoading && documents.length === 0 && (
         <Box
           style={{
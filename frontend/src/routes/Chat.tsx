@@ -1,4 +1,4 @@
-import React, { useEffect, useState, KeyboardEvent } from 'react';
+import React, { useEffect, useRef, useState, KeyboardEvent } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
 import { API, Auth } from 'aws-amplify';
 import { Grid } from '@mui/material';
@@ -17,8 +17,11 @@ const Chat: React.FC = () => {
 
   const [conversation, setConversation] = React.useState<Conversation | null>(null);
   const [prompt, setPrompt] = useState('');
+  const [partialAnswer, setPartialAnswer] = useState('');
 
   const [client, setClient] = useState<WebSocket>();
+  // The conversation on screen; the socket handler outlives renders, so it reads this instead of state
+  const conversationIdRef = useRef<string | undefined>(params.conversationid);
 
   const initializeClient = async () => {
     console.log('Initializing WebSocket client');
@@ -52,8 +55,31 @@ const Chat: React.FC = () => {
       const event = JSON.parse(message.data);
       //console.log(`Received message for ${event.conversationId}`, event);
 
+      // Every tab of the user receives every answer, only the one for the conversation on screen is shown
+      if (event.conversationId !== conversationIdRef.current) {
+        return;
+      }
+
+      // Streamed answer fragments, followed by one final message with the complete answer
+      if (event.type === 'token') {
+        setPartialAnswer((answer) => answer + event.token);
+        return;
+      }
+
+      setPartialAnswer('');
       setPrompt('');
-      fetchData(event.conversationId); //conversation?.conversationId
+      if (event.question === undefined) {
+        fetchData(event.conversationId);
+      } else {
+        // The new turn is appended, so pages loaded with "load earlier" stay on screen
+        const turn = [
+          { type: 'human', data: { content: event.question, example: false, additional_kwargs: {} } },
+          { type: 'ai', data: { content: event.message, example: false, additional_kwargs: {} } },
+        ];
+        setConversation((current) =>
+          current && current.conversationId === event.conversationId ? { ...current, messages: [...current.messages, ...turn] } : current
+        );
+      }
       setLoadingMessage(false);
     };
 
@@ -61,6 +87,7 @@ const Chat: React.FC = () => {
   };
 
   const fetchData = async (conversationid = params.conversationid) => {
+    conversationIdRef.current = conversationid;
     setLoadingChat(true);
 
     const conversation = await API.get('ragbot-api', `/doc/${params.documentid}/${conversationid}`, {});
@@ -71,6 +98,31 @@ const Chat: React.FC = () => {
     navigate(`/doc/${params.documentid}/${conversationid}`);
   };
 
+  const loadEarlierMessages = async () => {
+    if (!conversation?.nextCursor) return;
+
+    const earlier = await API.get('ragbot-api', `/doc/${params.documentid}/${conversation.conversationId}`, {
+      queryStringParameters: { cursor: conversation.nextCursor },
+    });
+    setConversation({ ...conversation, messages: [...earlier.messages, ...conversation.messages], nextCursor: earlier.nextCursor });
+  };
+
+  const loadEarlierConversations = async () => {
+    if (!conversation?.document.conversationsCursor) return;
+
+    const earlier = await API.get('ragbot-api', `/doc/${params.documentid}`, {
+      queryStringParameters: { cursor: conversation.document.conversationsCursor },
+    });
+    setConversation({
+      ...conversation,
+      document: {
+        ...conversation.document,
+        conversations: [...(conversation.document.conversations ?? []), ...earlier.conversations],
+        conversationsCursor: earlier.nextCursor,
+      },
+    });
+  };
+
   useEffect(() => {
     initializeClient();
 
@@ -129,6 +181,7 @@ const Chat: React.FC = () => {
         conversationId: conversation?.conversationId,
         userId: user.attributes.sub,
         prompt: prompt,
+        stream: true,
         token: (await Auth.currentSession()).getIdToken().getJwtToken(),
       })
     );
@@ -145,16 +198,19 @@ const Chat: React.FC = () => {
               params={params}
               addConversation={addConversation}
               switchConversation={switchConversation}
+              loadEarlierConversations={loadEarlierConversations}
               deleteDocument={deleteDocument}
               isLoadingConversation={isLoadingConversation}
             />
             <ChatMessages
               prompt={prompt}
+              partialAnswer={partialAnswer}
               conversation={conversation}
               isLoadingMessage={isLoadingMessage}
               submitMessage={(e: any) => submitMessage(e)}
               handleKeyPress={handleKeyPress}
               handlePromptChange={handlePromptChange}
+              loadEarlierMessages={loadEarlierMessages}
             />
           </Grid>
         </div>